@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure the cost of framing and unframing IPMI packets.
+
+A Get Chassis Status request is encoded and its response decoded, as an
+IPMI 1.5 packet with an MD5 authcode and as an RMCP+ packet with
+HMAC-SHA1-96 integrity and AES-CBC-128 confidentiality, both by the codec
+and by the list of ints framing the session used to do.  Reported are
+microseconds per packet only.  Memory allocated per packet is not, Python 2
+has neither tracemalloc nor any other way to count allocations outside of
+debug builds.
+
+Usage: python benchmarks/codec.py [packets]
+"""
+import hashlib
+import os
+import struct
+import sys
+import time
+
+from Crypto.Cipher import AES
+from Crypto.Hash import HMAC
+from Crypto.Hash import SHA
+
+from pyghmi.ipmi.private import codec
+from pyghmi.ipmi.private import cryptobackend
+
+PASSWORD = 'password' + '\x00' * 8
+K1 = os.urandom(20)
+AESKEY = os.urandom(16)
+INTEGRITY = cryptobackend.get_backend().integrity(K1)
+CONFIDENTIALITY = cryptobackend.get_backend().confidentiality(AESKEY)
+SESSIONID = 0x12345678
+SEQNUMBER = 42
+REQUEST = [0x20, 0, 0xe0, 0x81, 0x10, 1, 0x6e]
+RESPONSE = [0x81, 4, 0x7b, 0x20, 0x10, 1, 0, 0x41, 0x10, 0x40, 0x70, 0x4e]
+
+
+def legacy_aespad(data):
+    newdata = list(data)
+    currlen = len(data) + 1
+    neededpad = currlen % 16
+    if neededpad:
+        neededpad = 16 - neededpad
+    padval = 1
+    while padval <= neededpad:
+        newdata.append(padval)
+        padval += 1
+    newdata.append(neededpad)
+    return newdata
+
+
+def legacy_authcode(payload, seqnumber):
+    passdata = struct.unpack("16B", PASSWORD)
+    seqbytes = struct.unpack("!4B", struct.pack("<I", seqnumber))
+    sessdata = struct.unpack("!4B", struct.pack("<I", SESSIONID))
+    bodydata = passdata + sessdata + tuple(payload) + seqbytes + passdata
+    dgst = hashlib.md5(
+        struct.pack("%dB" % len(bodydata), *bodydata)).digest()
+    return struct.unpack("!%dB" % len(dgst), dgst)
+
+
+def legacy_encode15(payload):
+    message = [0x6, 0, 0xff, 0x07, 2]
+    message += struct.unpack("!4B", struct.pack("<I", SEQNUMBER))
+    message += struct.unpack("!4B", struct.pack("<I", SESSIONID))
+    message += legacy_authcode(payload, SEQNUMBER)
+    message.append(len(payload))
+    message += payload
+    if 34 + len(message) in (56, 84, 112, 128, 156):
+        message.append(0)
+    return struct.pack("!%dB" % len(message), *message)
+
+
+def legacy_encode20(payload):
+    message = [0x6, 0, 0xff, 0x07, 6, 0b11000000]
+    message += struct.unpack("!4B", struct.pack("<I", SESSIONID))
+    message += struct.unpack("!4B", struct.pack("<I", SEQNUMBER))
+    psize = len(payload)
+    pad = (psize + 1) % 16
+    if pad:
+        pad = 16 - pad
+    newpsize = psize + pad + 17
+    message.append(newpsize & 0xff)
+    message.append(newpsize >> 8)
+    iv = os.urandom(16)
+    message += list(struct.unpack("16B", iv))
+    payloadtocrypt = legacy_aespad(payload)
+    crypter = AES.new(AESKEY, AES.MODE_CBC, iv)
+    crypted = crypter.encrypt(struct.pack("%dB" % len(payloadtocrypt),
+                                          *payloadtocrypt))
+    message += list(struct.unpack("%dB" % len(crypted), crypted))
+    neededpad = (len(message) - 2) % 4
+    if neededpad:
+        neededpad = 4 - neededpad
+    message += [0xff] * neededpad
+    message.append(neededpad)
+    message.append(7)
+    integdata = message[4:]
+    authcode = HMAC.new(K1, struct.pack("%dB" % len(integdata), *integdata),
+                        SHA).digest()[:12]
+    message += struct.unpack("12B", authcode)
+    return struct.pack("!%dB" % len(message), *message)
+
+
+def legacy_decode15(data):
+    remsequencenumber = struct.unpack('<I', data[5:9])[0]
+    rsp = list(struct.unpack("!%dB" % len(data), data))
+    authcode = data[13:29]
+    del rsp[13:29]
+    payload = list(rsp[14:14 + rsp[13]])
+    expectedauthcode = legacy_authcode(payload, remsequencenumber)
+    expectedauthcode = struct.pack("%dB" % len(expectedauthcode),
+                                   *expectedauthcode)
+    assert expectedauthcode == authcode
+    return payload
+
+
+def legacy_decode20(rawdata):
+    data = list(struct.unpack("%dB" % len(rawdata), rawdata))
+    authcode = rawdata[-12:]
+    expectedauthcode = HMAC.new(K1, rawdata[4:-12], SHA).digest()[:12]
+    assert authcode == expectedauthcode
+    struct.unpack("<I", rawdata[6:10])[0]
+    struct.unpack("<I", rawdata[10:14])[0]
+    psize = data[14] + (data[15] << 8)
+    payload = data[16:16 + psize]
+    iv = memoryview(rawdata)[16:32].tobytes()
+    decrypter = AES.new(AESKEY, AES.MODE_CBC, iv)
+    decrypted = decrypter.decrypt(struct.pack("%dB" % len(payload[16:]),
+                                              *payload[16:]))
+    payload = struct.unpack("%dB" % len(decrypted), decrypted)
+    padsize = payload[-1] + 1
+    return list(payload[:-padsize])
+
+
+def codec_encode15(payload):
+    authcode = codec.ipmi15_authcode(PASSWORD, SESSIONID, SEQNUMBER, payload)
+    return codec.encode_ipmi15(2, SEQNUMBER, SESSIONID, payload, authcode)
+
+
+def codec_encode20(payload):
+    return codec.encode_rmcpplus(0, SESSIONID, SEQNUMBER, payload,
+                                 INTEGRITY, CONFIDENTIALITY)
+
+
+def codec_decode15(data):
+    _, seqnumber, _, authcode, payload = codec.decode_ipmi15(data)
+    assert authcode == codec.ipmi15_authcode(PASSWORD, SESSIONID, seqnumber,
+                                             payload)
+    return bytearray(payload)
+
+
+def codec_decode20(data):
+    _, _, _, payload = codec.decode_rmcpplus(data)
+    assert codec.rmcpplus_authentic(data, INTEGRITY)
+    return codec.decrypt_payload(payload, CONFIDENTIALITY)
+
+
+def measure(function, argument, packets):
+    start = time.time()
+    for _ in xrange(packets):
+        function(argument)
+    elapsed = time.time() - start
+    return elapsed * 1000000 / packets
+
+
+def main(packets):
+    request = bytearray(REQUEST)
+    response = bytearray(RESPONSE)
+    # received packets come in as views of the receive buffer
+    received15 = memoryview(codec_encode15(response))
+    received20 = memoryview(codec_encode20(response))
+    assert legacy_decode15(received15) == list(codec_decode15(received15))
+    assert legacy_decode20(received20) == list(codec_decode20(received20))
+    cases = (
+        ('ipmi15', 'encode', legacy_encode15, codec_encode15,
+         REQUEST, request),
+        ('ipmi15', 'decode', legacy_decode15, codec_decode15,
+         received15, received15),
+        ('rmcp+', 'encode', legacy_encode20, codec_encode20,
+         REQUEST, request),
+        ('rmcp+', 'decode', legacy_decode20, codec_decode20,
+         received20, received20),
+    )
+    print "%6s %6s %8s %12s" % ("format", "op", "framing", "usec/packet")
+    for framing, op, legacy, current, legacyarg, currentarg in cases:
+        for name, function, argument in (('lists', legacy, legacyarg),
+                                         ('codec', current, currentarg)):
+            usec = measure(function, argument, packets)
+            print "%6s %6s %8s %12.2f" % (framing, op, name, usec)
+
+
+if __name__ == '__main__':
+    packets = 1000000
+    if len(sys.argv) > 1:
+        packets = int(sys.argv[1])
+    main(packets)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure the per-packet cost of the Session event loop.
+
+timers: each simulated packet does what the transmit path does for real,
+push out the keepalive, arm the retransmit timer and take a non-blocking pass
+through wait_for_rsp.  The cost per packet should not depend on how many
+sessions are alive.
+
+syscalls: bursts of datagrams are fired at the session socket over loopback
+and the poll and receive calls made to take them in are counted, for the
+select per datagram loop the event loop used to have and each of the batch
+receivers.
+
+receive: a child process sends datagrams over loopback as fast as it can
+while the event loop takes them in, reporting packets per second and CPU
+time of the receiving process per packet for each receiver.
+
+transmit: sessions fan packets out through _xmit_packet to a set of loopback
+sinks, with each packet sent on its own as before and with each sender of
+the transmit queue, reporting packets per second and CPU time per packet.
+
+Usage: python benchmarks/eventloop.py [timers|syscalls|receive|transmit]
+                                      [packets]
+"""
+import os
+import random
+import select
+import socket
+import sys
+import time
+
+from pyghmi.ipmi.private import batchio
+from pyghmi.ipmi.private import session
+
+
+def benchsocket():
+    """The pool socket benchmark sessions are assigned to
+    """
+    return session.Session._assignsocket('::1', 623)
+
+
+def make_sessions(count):
+    sessions = []
+    for _ in xrange(count):
+        ipmisession = object.__new__(session.Session)
+        ipmisession._initsession()
+        ipmisession.iosocket = benchsocket()
+        ipmisession._arm_keepalive()
+        ipmisession._arm_retry(session._monotonic_time() + 3600)
+        sessions.append(ipmisession)
+    return sessions
+
+
+def clear_sessions(sessions):
+    for ipmisession in sessions:
+        ipmisession._cancel_retry()
+        session.Session.timerheap.cancel(
+            session.Session.keepalive_sessions.pop(ipmisession))
+
+
+def bench_timers(packets):
+    print "%8s %14s" % ("sessions", "usec/packet")
+    for count in (10, 100, 1000, 10000):
+        sessions = make_sessions(count)
+        start = time.time()
+        for _ in xrange(packets):
+            ipmisession = random.choice(sessions)
+            ipmisession._arm_keepalive()
+            ipmisession._arm_retry(session._monotonic_time() + 3600)
+            session.Session.wait_for_rsp(timeout=0, callout=False)
+        elapsed = time.time() - start
+        print "%8d %14.2f" % (count, elapsed * 1000000 / packets)
+        clear_sessions(sessions)
+
+
+class LegacyReceiver(object):
+    """Reads the way the event loop used to, a select before each recvfrom
+    """
+
+    def __init__(self, sock, batchsize=64):
+        self.socket = sock
+        self.batchsize = batchsize
+        self.syscalls = 0
+
+    def recv(self):
+        pktqueue = []
+        while len(pktqueue) < self.batchsize:
+            self.syscalls += 1
+            if not select.select((self.socket,), (), (), 0)[0]:
+                break
+            self.syscalls += 1
+            pktqueue.append(self.socket.recvfrom(3000))
+        return pktqueue
+
+
+class CountingSocket(object):
+    def __init__(self, sock, receiver):
+        self.socket = sock
+        self.receiver = receiver
+
+    def recvfrom_into(self, *args):
+        self.receiver.syscalls += 1
+        return self.socket.recvfrom_into(*args)
+
+
+def counted(receiver):
+    """Count the receive system calls made through receiver
+    """
+    receiver.syscalls = 0
+    if isinstance(receiver, batchio.MmsgReceiver):
+        recv = receiver.recv
+
+        def countedrecv():
+            receiver.syscalls += 1
+            return recv()
+        receiver.recv = countedrecv
+    elif isinstance(receiver, batchio.RecvIntoReceiver):
+        receiver.socket = CountingSocket(receiver.socket, receiver)
+    return receiver
+
+
+def receiver_kinds():
+    kinds = [('legacy', LegacyReceiver),
+             ('recvinto', batchio.RecvIntoReceiver)]
+    if batchio.get_receiver(benchsocket().socket).__class__ is \
+            batchio.MmsgReceiver:
+        kinds.append(('recvmmsg', batchio.MmsgReceiver))
+    return kinds
+
+
+def bind_session_socket():
+    sock = benchsocket().socket
+    sock.bind(('::1', 0))
+    return sock.getsockname()
+
+
+def bench_syscalls(packets, burst=64):
+    target = bind_session_socket()
+    sender = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    datagram = '\x06\x00\xff\x07' + '\x00' * 30
+    poll = session.Session.iopoller.poll
+    sent = (packets // burst) * burst
+    print "%8s %10s %14s" % ("receiver", "polls/pkt", "syscalls/pkt")
+    for name, kind in receiver_kinds():
+        receiver = counted(kind(benchsocket().socket))
+        benchsocket().receivers = [receiver]
+        polls = [0]
+
+        def countedpoll(timeout=None):
+            polls[0] += 1
+            return poll(timeout)
+        session.Session.iopoller.poll = countedpoll
+        for _ in xrange(packets // burst):
+            for _ in xrange(burst):
+                sender.sendto(datagram, target)
+            session.Session.wait_for_rsp(timeout=1)
+        print "%8s %10.2f %14.2f" % (
+            name, float(polls[0]) / sent,
+            float(polls[0] + receiver.syscalls) / sent)
+    session.Session.iopoller.poll = poll
+
+
+def bench_receive(packets):
+    target = bind_session_socket()
+    datagram = '\x06\x00\xff\x07' + '\x00' * 30
+    print "%8s %10s %10s %14s" % ("receiver", "received", "pkts/sec",
+                                  "cpu usec/pkt")
+    for name, kind in receiver_kinds():
+        receiver = kind(benchsocket().socket)
+        recv = receiver.recv
+        received = [0]
+
+        def countedrecv():
+            pktqueue = recv()
+            received[0] += len(pktqueue)
+            return pktqueue
+        receiver.recv = countedrecv
+        benchsocket().receivers = [receiver]
+        child = os.fork()
+        if child == 0:
+            sender = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            for _ in xrange(packets):
+                sender.sendto(datagram, target)
+            os._exit(0)
+        cpustart = os.times()
+        start = time.time()
+        last = start
+        while received[0] < packets and time.time() - last < 0.5:
+            before = received[0]
+            session.Session.wait_for_rsp(timeout=0.5)
+            if received[0] != before:
+                last = time.time()
+        elapsed = last - start
+        cpuend = os.times()
+        os.waitpid(child, 0)
+        cpu = (cpuend[0] - cpustart[0]) + (cpuend[1] - cpustart[1])
+        print "%8s %10d %10.0f %14.2f" % (
+            name, received[0], received[0] / elapsed,
+            cpu * 1000000 / max(received[0], 1))
+
+
+def bench_transmit(packets, fanout=64):
+    sinks = []
+    sessions = []
+    for _ in xrange(fanout):
+        sink = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sink.bind(('::1', 0))
+        sinks.append(sink)
+        ipmisession = object.__new__(session.Session)
+        ipmisession._initsession()
+        ipmisession.nowait = False
+        ipmisession.trace = None
+        ipmisession.iosocket = benchsocket()
+        ipmisession.pacescopes = session.Session.pacer.scopes(None)
+        ipmisession.sockaddr = sink.getsockname()
+        ipmisession.netpacket = '\x06\x00\xff\x07' + '\x00' * 40
+        sessions.append(ipmisession)
+    kinds = [('sendto', None), ('batched', batchio.SendtoSender)]
+    if batchio.get_sender(benchsocket().socket).__class__ is \
+            batchio.MmsgSender:
+        kinds.append(('sendmmsg', batchio.MmsgSender))
+    print "%8s %10s %14s" % ("sender", "pkts/sec", "cpu usec/pkt")
+    for name, kind in kinds:
+        session.Session.sendbatching = kind is not None
+        if kind is not None:
+            benchsocket().sender = kind(benchsocket().socket,
+                                        session.Session.sendbatchsize)
+        cpustart = os.times()
+        start = time.time()
+        for idx in xrange(packets):
+            sessions[idx % fanout]._xmit_packet(retry=False)
+        session.Session.wait_for_rsp(timeout=0)
+        elapsed = time.time() - start
+        cpuend = os.times()
+        cpu = (cpuend[0] - cpustart[0]) + (cpuend[1] - cpustart[1])
+        print "%8s %10.0f %14.2f" % (name, packets / elapsed,
+                                     cpu * 1000000 / packets)
+    session.Session.sendbatching = True
+
+
+if __name__ == '__main__':
+    benchmark = 'timers'
+    packets = 20000
+    if len(sys.argv) > 1:
+        benchmark = sys.argv[1]
+    if len(sys.argv) > 2:
+        packets = int(sys.argv[2])
+    session.Session._createsocket()
+    if benchmark == 'timers':
+        bench_timers(packets)
+    elif benchmark == 'syscalls':
+        bench_syscalls(packets)
+    elif benchmark == 'receive':
+        bench_receive(packets)
+    elif benchmark == 'transmit':
+        bench_transmit(packets)
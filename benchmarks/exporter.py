@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Show what serving metrics over HTTP does to the event loop.
+
+A sweep of Get Device ID to every BMC of a fleet, stood in for by the IPMI
+1.5 BMCs of benchmarks/logins.py, is run in rounds for a while, once alone
+and once with a child process scraping the metrics exporter with urllib2
+every few milliseconds.  Reported are microseconds per command, the event
+loop pass time the 99th percentile falls within as the exporter has it,
+and how many scrapes were answered and how long they took.
+
+Usage: python benchmarks/exporter.py [sessions] [seconds]
+"""
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import urllib2
+
+from pyghmi.ipmi.private import exporter
+from pyghmi.ipmi.private import metrics
+from pyghmi.ipmi.private import session
+
+from logins import password
+from logins import serve
+from metrics import percentile
+
+
+def scrape(port, seconds, interval=0.005):
+    """Scrape the exporter for a while, printing the scrape times
+    """
+    times = []
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        start = time.time()
+        body = urllib2.urlopen('http://127.0.0.1:%d/metrics' % port).read()
+        if 'pyghmi_commands_total' in body:
+            times.append(time.time() - start)
+        time.sleep(interval)
+    times.sort()
+    print "%d %f %f" % (len(times), times[len(times) // 2], times[-1])
+
+
+def run(mode, ports, seconds):
+    session.Session.subnetmaxrate = None
+    session.Session.subnetmaxpending = 1 << 30
+    endpoint = exporter.MetricsExporter(port=0)
+    loggedin = [0]
+
+    def logged(response):
+        loggedin[0] += 1
+
+    sessions = [session.Session('::1', 'admin', password, port=port,
+                                onlogon=logged)
+                for port in ports]
+    while loggedin[0] < len(sessions):
+        session.Session.wait_for_rsp(timeout=0.1)
+    # only the sweep is of interest, not the logins
+    session.Session.metricsregistry.looplatency = metrics.Histogram(
+        metrics.loopbuckets)
+    reader, writer = os.pipe()
+    scraper = None
+    if mode == 'scraped':
+        scraper = os.fork()
+        if scraper == 0:
+            os.dup2(writer, 1)
+            scrape(endpoint.port, seconds)
+            sys.stdout.flush()
+            os._exit(0)
+    os.close(writer)
+    outstanding = [0]
+
+    def done(response):
+        outstanding[0] -= 1
+
+    commands = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        outstanding[0] = len(sessions)
+        for ipmisession in sessions:
+            ipmisession.raw_command(netfn=6, command=1, callback=done)
+        while outstanding[0]:
+            session.Session.wait_for_rsp(timeout=0.1)
+        commands += len(sessions)
+    elapsed = time.time() - start
+    # keep serving until the scraper is through
+    scrapes = ''
+    while scraper is not None and not scrapes.endswith('\n'):
+        session.Session.wait_for_rsp(timeout=0.01)
+        if select.select([reader], [], [], 0)[0]:
+            scrapes += os.read(reader, 4096)
+    if scraper is not None:
+        os.waitpid(scraper, 0)
+        count, median, worst = scrapes.split()
+        scrapes = "%9s %9.1f %9.1f" % (count, float(median) * 1000,
+                                       float(worst) * 1000)
+    else:
+        scrapes = "%9s %9s %9s" % ('-', '-', '-')
+    looplatency = session.Session.get_metrics(perbmc=False)['looplatency']
+    print "%9s %9.1f %9s %s" % (mode, elapsed * 1e6 / commands,
+                                percentile(looplatency, 0.99), scrapes)
+    endpoint.close()
+
+
+def main(count, seconds):
+    socks = []
+    for _ in xrange(count):
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.bind(('::1', 0))
+        socks.append(sock)
+    server = os.fork()
+    if server == 0:
+        serve(socks, count, count, 0)
+        os._exit(0)
+    ports = [bound.getsockname()[1] for bound in socks]
+    print "%9s %9s %9s %9s %9s %9s" % (
+        "mode", "us/cmd", "loop p99<=", "scrapes", "scrape ms", "worst ms")
+    try:
+        for mode in ('unscraped', 'scraped'):
+            # each mode gets a fresh process, so that the session class
+            # starts out the same for both
+            child = os.fork()
+            if child == 0:
+                run(mode, ports, seconds)
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(child, 0)
+    finally:
+        os.kill(server, signal.SIGTERM)
+        os.waitpid(server, 0)
+
+
+if __name__ == '__main__':
+    count = 500
+    seconds = 5
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        seconds = int(sys.argv[2])
+    main(count, seconds)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time a sweep of a fleet with Command, to compare one commit to another.
+
+For each fleet size and packet loss, the RMCP+ BMCs of
+benchmarks/simulator.py are stood up, each on an address of its own spread
+over 127.0.0.0/8 in /24 subnets of 250, and a fresh process with Command
+objects for all of them goes through, one operation after another, with
+every BMC at once and by way of callbacks:
+
+  login:       Command set up with onlogon
+  get_power
+  set_power:   power on with wait=True, which the BMCs take a second to do
+  set_bootdev: network
+  get_bootdev
+  raw_command: Get Device ID
+
+Sessions keep their default pacing and retries.  For each operation are
+reported how many BMCs it went through for and how many it failed for, the
+seconds all of them took and so BMCs per second, the 50th and 99th
+percentile of the time each BMC took, CPU seconds used and the peak
+resident set size of the process so far.  The simulator has a process of
+its own, so its CPU time does not count, but at the largest sizes it may
+well be what holds the sweep back.
+
+The table goes to standard output and the same figures, along with the
+commit they were measured at, as JSON to the given file.
+
+Usage: python benchmarks/fleet.py [json file] [sizes] [losses]
+  sizes and losses are comma separated, 1,100,1000,10000 and 0,0.01,0.05
+  by default
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from pyghmi.ipmi import command
+from pyghmi.ipmi.private import session
+
+from simulator import password
+from simulator import Simulator
+
+operations = ('login', 'get_power', 'set_power', 'set_bootdev',
+              'get_bootdev', 'raw_command')
+
+
+def addresses(count):
+    return ['127.0.%d.%d' % (idx // 250, 1 + idx % 250)
+            for idx in xrange(count)]
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def issue(operation, ipmicmd, callback):
+    if operation == 'get_power':
+        ipmicmd.get_power(callback=callback)
+    elif operation == 'set_power':
+        ipmicmd.set_power('on', wait=True, callback=callback)
+    elif operation == 'set_bootdev':
+        ipmicmd.set_bootdev('network', callback=callback)
+    elif operation == 'get_bootdev':
+        ipmicmd.get_bootdev(callback=callback)
+    elif operation == 'raw_command':
+        ipmicmd.raw_command(netfn=6, command=1, callback=callback)
+
+
+def run(endpoints, loss, writer):
+    records = []
+    commands = []
+    for operation in operations:
+        latencies = []
+        passed = []
+        outstanding = [0]
+
+        def finish(issued, ipmicmd):
+            def done(response, *args):
+                outstanding[0] -= 1
+                latencies.append(time.time() - issued)
+                if 'error' not in response:
+                    passed.append(args[0] if ipmicmd is None else ipmicmd)
+            return done
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = usage.ru_utime + usage.ru_stime
+        start = time.time()
+        if operation == 'login':
+            outstanding[0] = len(endpoints)
+            for address, port in endpoints:
+                # onlogon is given the Command as well as the response
+                command.Command(address, 'admin', password, port=port,
+                                onlogon=finish(time.time(), None))
+        else:
+            outstanding[0] = len(commands)
+            for ipmicmd in commands:
+                issue(operation, ipmicmd, finish(time.time(), ipmicmd))
+        while outstanding[0]:
+            session.Session.wait_for_rsp(timeout=1)
+        elapsed = time.time() - start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        latencies.sort()
+        record = {
+            'operation': operation,
+            'bmcs': len(endpoints),
+            'loss': loss,
+            'ok': len(passed),
+            'failed': len(latencies) - len(passed),
+            'seconds': elapsed,
+            'throughput': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5) if latencies else None,
+            'p99': percentile(latencies, 0.99) if latencies else None,
+            'cpu': usage.ru_utime + usage.ru_stime - cpu,
+            'maxrss': usage.ru_maxrss * 1024,
+        }
+        print "%11s %6d %5.3f %6d %6d %8.2f %8.1f %8.1f %8.1f %7.2f %7.1f" % (
+            operation, record['bmcs'], loss, record['ok'], record['failed'],
+            elapsed, record['throughput'], (record['p50'] or 0) * 1000,
+            (record['p99'] or 0) * 1000, record['cpu'],
+            record['maxrss'] / 1048576.0)
+        sys.stdout.flush()
+        records.append(record)
+        # BMCs that could not be logged in to are left out from then on
+        if operation == 'login':
+            commands = passed
+    os.write(writer, json.dumps(records))
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w'),
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(path, sizes, losses):
+    results = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'started': time.time(),
+        'results': [],
+    }
+    print "%11s %6s %5s %6s %6s %8s %8s %8s %8s %7s %7s" % (
+        "operation", "bmcs", "loss", "ok", "failed", "seconds", "per sec",
+        "p50 ms", "p99 ms", "cpu s", "rss MB")
+    for count in sizes:
+        for loss in losses:
+            simulator = Simulator(count, addresses=addresses(count),
+                                  loss=loss, latency=0.0005, powerdelay=1)
+            endpoints = simulator.endpoints
+            simulator.start()
+            reader, writer = os.pipe()
+            try:
+                # each run gets a fresh process, so that the session class
+                # starts out the same for all
+                child = os.fork()
+                if child == 0:
+                    os.close(reader)
+                    run(endpoints, loss, writer)
+                    os._exit(0)
+                os.close(writer)
+                output = ''
+                while True:
+                    data = os.read(reader, 65536)
+                    if not data:
+                        break
+                    output += data
+                os.waitpid(child, 0)
+            finally:
+                os.close(reader)
+                simulator.stop()
+            results['results'].extend(json.loads(output))
+    with open(path, 'w') as out:
+        json.dump(results, out, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    path = 'fleet.json'
+    sizes = (1, 100, 1000, 10000)
+    losses = (0, 0.01, 0.05)
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    if len(sys.argv) > 2:
+        sizes = [int(size) for size in sys.argv[2].split(',')]
+    if len(sys.argv) > 3:
+        losses = [float(loss) for loss in sys.argv[3].split(',')]
+    main(path, sizes, losses)
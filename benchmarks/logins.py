@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Show how a fleet of sessions gets logged in.
+
+A child process stands in for a number of IPMI 1.5 BMCs on loopback ports,
+grouped into chassis that each handle only so many logins at once and
+answer Get Session Challenge with Node Busy beyond that.  Sessions are set
+up for all of them at once, and reported are how many logged in, how many
+failed and how long it took until all had done one or the other.  Packets
+are not paced, so that it is the logins alone that are held back.
+
+legacy starts every handshake at once and gives up on a busy BMC, as
+sessions used to.  scheduled goes through the login scheduler of Session,
+saving what it learns of the BMCs to a file, and cached then does the same
+in a fresh process with what was saved, skipping Get Channel Authentication
+Capabilities.
+
+Usage: python benchmarks/logins.py [sessions] [chassis size] [capacity]
+"""
+import heapq
+import os
+import random
+import select
+import shutil
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+from pyghmi.ipmi.private import capabilities
+from pyghmi.ipmi.private import codec
+from pyghmi.ipmi.private import logins
+from pyghmi.ipmi.private import session
+
+password = 'password'
+
+
+def checksum(*data):
+    return (-sum(data)) & 0xff
+
+
+class Chassis(object):
+    """BMCs sharing a management controller, and its login capacity
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.handshakes = {}
+
+    def admit(self, sid, now):
+        for pending, deadline in self.handshakes.items():
+            if deadline < now:
+                del self.handshakes[pending]
+        if len(self.handshakes) >= self.capacity:
+            return False
+        self.handshakes[sid] = now + 3
+        return True
+
+
+def answer(chassis, sessions, request, now):
+    """The reply of an IPMI 1.5 BMC to request, None to drop it
+    """
+    _, _, sid, _, payload = codec.decode_ipmi15(request)
+    payload = bytearray(payload)
+    netfn = (payload[1] >> 2) + 1
+    command = payload[5]
+    code = 0
+    data = []
+    authtype = 0
+    seqnumber = 0
+    if command == 0x38:  # get channel authentication capabilities
+        data = [1, 0b100, 0, 0, 0, 0, 0, 0]  # MD5 only, IPMI 1.5
+    elif command == 0x39:  # get session challenge
+        newsid = random.randint(1, 0xffffffff)
+        if chassis.admit(newsid, now):
+            sessions[newsid] = 0
+            data = (list(bytearray(struct.pack('<I', newsid))) +
+                    list(bytearray(os.urandom(16))))
+        else:
+            code = 0xc0  # node busy
+    elif sid not in sessions:
+        return None
+    elif command == 0x3a:  # activate session
+        authtype = 2
+        data = ([2] + list(bytearray(struct.pack('<I', sid))) +
+                [1, 0, 0, 0, 4])
+    else:
+        authtype = 2
+        sessions[sid] += 1
+        seqnumber = sessions[sid]
+        if command == 0x3b:  # set session privilege level, login is done
+            chassis.handshakes.pop(sid, None)
+            data = [4]
+        elif command == 0x3c:  # close session
+            del sessions[sid]
+    reply = bytearray((0x81, netfn << 2, checksum(0x81, netfn << 2),
+                       0x20, payload[4], command, code))
+    reply.extend(data)
+    reply.append(checksum(*reply[3:]))
+    authcode = ''
+    if authtype:
+        authcode = codec.ipmi15_authcode(password.ljust(16, '\x00'), sid,
+                                         seqnumber, reply)
+    return codec.encode_ipmi15(authtype, seqnumber, sid, reply, authcode)
+
+
+def serve(socks, chassissize, capacity, latency):
+    chassis = {}
+    sessions = {}
+    for idx, sock in enumerate(socks):
+        group = idx // chassissize
+        if group not in chassis:
+            chassis[group] = Chassis(capacity)
+        chassis[sock] = chassis[group]
+        sessions[sock] = {}
+    byfd = {}
+    poller = select.poll()
+    for sock in socks:
+        byfd[sock.fileno()] = sock
+        poller.register(sock, select.POLLIN)
+    replies = []
+    while True:
+        timeout = None
+        if replies:
+            timeout = max(replies[0][0] - time.time(), 0) * 1000
+        for fd, _ in poller.poll(timeout):
+            sock = byfd[fd]
+            data, sockaddr = sock.recvfrom(3000)
+            now = time.time()
+            reply = answer(chassis[sock], sessions[sock], data, now)
+            if reply is not None:
+                heapq.heappush(replies, (now + latency, sock, reply,
+                                         sockaddr))
+        while replies and replies[0][0] <= time.time():
+            _, sock, data, sockaddr = heapq.heappop(replies)
+            sock.sendto(data, sockaddr)
+
+
+def run(mode, ports, cachepath):
+    # only logins are limited here, not packets in general
+    session.Session.subnetmaxrate = None
+    session.Session.subnetmaxpending = 1 << 30
+    session.Session._createsocket()
+    session.Session.pacer.globalscope.window = 1 << 30
+    if mode == 'legacy':
+        session.Session.loginscheduler = logins.LoginScheduler(
+            session.Session.timerheap, session._monotonic_time,
+            maxactive=len(ports), retries=0)
+    else:
+        session.Session.capabilitycache = capabilities.CapabilityCache(
+            cachepath)
+    sent = [0]
+    sendto = session.Session._sendto
+
+    def countedsendto(ipmisession, packet, sockaddr):
+        sent[0] += 1
+        return sendto(ipmisession, packet, sockaddr)
+    session.Session._sendto = countedsendto
+    results = {'success': 0, 'error': 0}
+    start = time.time()
+
+    def logged(response):
+        results['error' if 'error' in response else 'success'] += 1
+        results['end'] = time.time()
+
+    for port in ports:
+        session.Session('::1', 'admin', password, port=port, onlogon=logged)
+    while results['success'] + results['error'] < len(ports):
+        session.Session.wait_for_rsp(timeout=0.1)
+    session.Session.capabilitycache.save()
+    state = session.Session.loginscheduler.state()
+    print "%9s %9d %9d %9.2f %9d %9d" % (
+        mode, results['success'], results['error'], results['end'] - start,
+        state['retried'], sent[0])
+
+
+def main(count, chassissize, capacity, latency=0.01):
+    socks = []
+    for _ in xrange(count):
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.bind(('::1', 0))
+        socks.append(sock)
+    server = os.fork()
+    if server == 0:
+        serve(socks, chassissize, capacity, latency)
+        os._exit(0)
+    ports = [bound.getsockname()[1] for bound in socks]
+    print "%9s %9s %9s %9s %9s %9s" % ("mode", "logged in", "failed",
+                                       "seconds", "retries", "packets")
+    cachedir = tempfile.mkdtemp()
+    cachepath = os.path.join(cachedir, 'capabilities.json')
+    try:
+        for mode in ('legacy', 'scheduled', 'cached'):
+            # each mode gets a fresh process, so that the session class
+            # starts out the same for both
+            child = os.fork()
+            if child == 0:
+                run(mode, ports, cachepath)
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(child, 0)
+    finally:
+        os.kill(server, signal.SIGTERM)
+        os.waitpid(server, 0)
+        shutil.rmtree(cachedir)
+
+
+if __name__ == '__main__':
+    count = 1000
+    chassissize = 14
+    capacity = 2
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        chassissize = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        capacity = int(sys.argv[3])
+    main(count, chassissize, capacity)
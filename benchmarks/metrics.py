@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure what keeping session metrics costs.
+
+First the cost of accounting for a single answered command is timed.  Then
+a sweep of Get Device ID to every BMC of a fleet, stood in for by the IPMI
+1.5 BMCs of benchmarks/logins.py, is run in rounds with metrics kept and
+with the accounting made to do nothing.  Reported are microseconds per
+command, and what the metrics have to say of the sweep.
+
+Usage: python benchmarks/metrics.py [sessions] [rounds]
+"""
+import os
+import signal
+import socket
+import sys
+import time
+import timeit
+
+from pyghmi.ipmi.private import metrics
+from pyghmi.ipmi.private import session
+
+from logins import password
+from logins import serve
+
+
+def percentile(histogram, fraction):
+    """Upper bound of the bucket the given fraction of values fall within
+    """
+    for bound, count in histogram['buckets']:
+        if count >= fraction * histogram['count']:
+            return bound
+
+
+def bench_record(count):
+    registry = metrics.MetricsRegistry()
+    bmc = registry.bmc('::1', 623)
+    elapsed = timeit.timeit(lambda: bmc.command(6, 1, 0.0042), number=count)
+    print "accounting for a command: %.0f ns" % (elapsed * 1e9 / count)
+
+
+def run(mode, ports, rounds):
+    session.Session.subnetmaxrate = None
+    session.Session.subnetmaxpending = 1 << 30
+    if mode == 'off':
+        for name in ('command', 'retry', 'timeout', 'drop', 'loginattempt',
+                     'login'):
+            setattr(metrics.BmcMetrics, name, lambda self, *args: None)
+    loggedin = [0]
+
+    def logged(response):
+        loggedin[0] += 1
+
+    sessions = [session.Session('::1', 'admin', password, port=port,
+                                onlogon=logged)
+                for port in ports]
+    while loggedin[0] < len(sessions):
+        session.Session.wait_for_rsp(timeout=0.1)
+    outstanding = [0]
+
+    def done(response):
+        outstanding[0] -= 1
+
+    start = time.time()
+    for _ in xrange(rounds):
+        outstanding[0] = len(sessions)
+        for ipmisession in sessions:
+            ipmisession.raw_command(netfn=6, command=1, callback=done)
+        while outstanding[0]:
+            session.Session.wait_for_rsp(timeout=0.1)
+    elapsed = time.time() - start
+    usecs = elapsed * 1e6 / (rounds * len(sessions))
+    if mode == 'off':
+        print "%9s %9.1f %9s %9s %9s %9s" % (mode, usecs, '-', '-', '-', '-')
+        return
+    snapshot = session.Session.get_metrics(perbmc=False)
+    latency = snapshot['bycommand'][(6, 1)]
+    print "%9s %9.1f %9d %9s %9s %9d" % (
+        mode, usecs, latency['count'], percentile(latency, 0.5),
+        percentile(latency, 0.99), snapshot['logins'])
+
+
+def main(count, rounds):
+    bench_record(100000)
+    socks = []
+    for _ in xrange(count):
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.bind(('::1', 0))
+        socks.append(sock)
+    server = os.fork()
+    if server == 0:
+        serve(socks, count, count, 0)
+        os._exit(0)
+    ports = [bound.getsockname()[1] for bound in socks]
+    print "%9s %9s %9s %9s %9s %9s" % (
+        "metrics", "us/cmd", "counted", "p50 <=", "p99 <=", "logins")
+    try:
+        for mode in ('off', 'on'):
+            # each mode gets a fresh process, so that the session class
+            # starts out the same for both
+            child = os.fork()
+            if child == 0:
+                run(mode, ports, rounds)
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(child, 0)
+    finally:
+        os.kill(server, signal.SIGTERM)
+        os.waitpid(server, 0)
+
+
+if __name__ == '__main__':
+    count = 500
+    rounds = 20
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+    main(count, rounds)
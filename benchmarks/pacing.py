@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Show what pacing does for a fleet wide burst of commands.
+
+A child process stands in for a number of BMCs on loopback ports behind a
+switch that forwards so many packets per second and buffers a few dozen,
+dropping what does not fit.  Every session then issues a command at once,
+as a fleet wide set_power would, and does so again once all have answered.
+Reported are how long the sweeps took, the latency of the commands and the
+retransmissions made.
+
+unpaced lets everything out at once, as sessions used to.  paced holds new
+requests to the rate and windows of Session, backing off as packets are
+lost.
+
+Usage: python benchmarks/pacing.py [sessions] [sweeps] [capacity]
+"""
+import heapq
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+from pyghmi.ipmi.private import session
+
+from retransmit import answer
+from retransmit import make_session
+from retransmit import percentile
+
+
+def serve(socks, capacity, depth, latency):
+    """Answer requests on socks, as queued through a switch port
+    """
+    replies = []
+    backlog = 0.0
+    last = time.time()
+    while True:
+        timeout = None
+        if replies:
+            timeout = max(replies[0][0] - time.time(), 0)
+        for sock in select.select(socks, (), (), timeout)[0]:
+            data, sockaddr = sock.recvfrom(3000)
+            now = time.time()
+            backlog = max(backlog - (now - last) * capacity, 0)
+            last = now
+            if backlog >= depth:  # the switch buffer is full
+                continue
+            backlog += 1
+            heapq.heappush(replies, (now + backlog / capacity + latency, sock,
+                                     answer(data), sockaddr))
+        while replies and replies[0][0] <= time.time():
+            _, sock, data, sockaddr = heapq.heappop(replies)
+            sock.sendto(data, sockaddr)
+
+
+def run(mode, sockaddrs, sweeps):
+    if mode == 'unpaced':
+        session.Session.subnetmaxrate = None
+        session.Session.subnetmaxpending = 1 << 30
+    session.Session._createsocket()
+    if mode == 'unpaced':
+        session.Session.maxpending = 1 << 30
+        session.Session.pacer.globalscope.window = 1 << 30
+        session.Session.pacer.globalscope.limit = 1 << 30
+    sessions = [make_session(sockaddr, session.rtt.RttEstimator)
+                for sockaddr in sockaddrs]
+    if mode == 'unpaced':
+        for scope in session.Session.pacer.subnets.itervalues():
+            scope.window = 1 << 30
+    latencies = []
+    outstanding = [0]
+
+    def done(response, start):
+        outstanding[0] -= 1
+        latencies.append(time.time() - start)
+
+    sweeptimes = []
+    for _ in xrange(sweeps):
+        start = time.time()
+        outstanding[0] = len(sessions)
+        for ipmisession in sessions:
+            ipmisession.raw_command(netfn=0, command=2, data=(1,),
+                                    callback=done, callback_args=start)
+        while outstanding[0]:
+            session.Session.wait_for_rsp(timeout=0.1)
+        sweeptimes.append(time.time() - start)
+    latencies.sort()
+    retries = sum(ipmisession.rtt.backoffs for ipmisession in sessions)
+    print "%9s %10.3f %10.3f %9.3f %9.3f %9d" % (
+        mode, sum(sweeptimes) / len(sweeptimes), max(sweeptimes),
+        percentile(latencies, 0.5), percentile(latencies, 0.99), retries)
+
+
+def main(count, sweeps, capacity, depth=64, latency=0.002):
+    socks = []
+    for _ in xrange(count):
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.bind(('::1', 0))
+        socks.append(sock)
+    server = os.fork()
+    if server == 0:
+        serve(socks, capacity, depth, latency)
+        os._exit(0)
+    sockaddrs = [bound.getsockname() for bound in socks]
+    print "%9s %10s %10s %9s %9s %9s" % (
+        "mode", "sweep s", "worst s", "p50 s", "p99 s", "retries")
+    try:
+        for mode in ('unpaced', 'paced'):
+            # each mode gets a fresh process, so that the session class
+            # starts out the same for both
+            child = os.fork()
+            if child == 0:
+                run(mode, sockaddrs, sweeps)
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(child, 0)
+    finally:
+        os.kill(server, signal.SIGTERM)
+        os.waitpid(server, 0)
+
+
+if __name__ == '__main__':
+    count = 500
+    sweeps = 5
+    capacity = 2000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        sweeps = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        capacity = float(sys.argv[3])
+    main(count, sweeps, capacity)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Show what bounding the session pool does for a collector.
+
+A collector sets up sessions to every BMC of a fleet, stood in for by the
+IPMI 1.5 BMCs of benchmarks/logins.py, and then polls in rounds a hot tenth
+of the fleet plus a random twentieth of the rest.  Reported are the sessions
+left logged in at the end, and so sending keepalives, how many logins were
+made all told and how long the rounds took.
+
+unbounded keeps every session logged in, as sessions used to.  pooled
+caps the pool at a fifth of the fleet, evicting the least recently used.
+
+Usage: python benchmarks/pool.py [sessions] [rounds]
+"""
+import os
+import random
+import signal
+import socket
+import sys
+import time
+
+from pyghmi.ipmi.private import session
+
+from logins import password
+from logins import serve
+
+
+def run(mode, ports, rounds):
+    if mode == 'pooled':
+        session.Session.maxsessions = len(ports) // 5
+    loggedin = [0]
+
+    def logged(response):
+        loggedin[0] += 1
+
+    sessions = [session.Session('::1', 'admin', password, port=port,
+                                onlogon=logged)
+                for port in ports]
+    while loggedin[0] < len(sessions):
+        session.Session.wait_for_rsp(timeout=0.1)
+    hot = sessions[:len(sessions) // 10]
+    cold = sessions[len(sessions) // 10:]
+    outstanding = [0]
+    errors = [0]
+
+    def done(response):
+        outstanding[0] -= 1
+        if 'error' in response:
+            errors[0] += 1
+
+    start = time.time()
+    for _ in xrange(rounds):
+        polled = hot + random.sample(cold, len(hot) // 2)
+        outstanding[0] = len(polled)
+        for ipmisession in polled:
+            ipmisession.raw_command(netfn=6, command=1, callback=done)
+        while outstanding[0]:
+            session.Session.wait_for_rsp(timeout=0.1)
+    elapsed = time.time() - start
+    live = len([s for s in sessions if s.logged])
+    print "%9s %9d %9.1f %9d %9.2f %9d" % (
+        mode, live, live * 60 / 27.45,
+        session.Session.loginscheduler.succeeded, elapsed, errors[0])
+
+
+def main(count, rounds):
+    socks = []
+    for _ in xrange(count):
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.bind(('::1', 0))
+        socks.append(sock)
+    server = os.fork()
+    if server == 0:
+        serve(socks, 14, 14, 0.01)
+        os._exit(0)
+    ports = [bound.getsockname()[1] for bound in socks]
+    print "%9s %9s %9s %9s %9s %9s" % (
+        "mode", "live", "ka/min", "logins", "seconds", "errors")
+    try:
+        for mode in ('unbounded', 'pooled'):
+            # each mode gets a fresh process, so that the session class
+            # starts out the same for both
+            child = os.fork()
+            if child == 0:
+                run(mode, ports, rounds)
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(child, 0)
+    finally:
+        os.kill(server, signal.SIGTERM)
+        os.waitpid(server, 0)
+
+
+if __name__ == '__main__':
+    count = 2000
+    rounds = 10
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+    main(count, rounds)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Show what name lookups cost the event loop.
+
+Sessions are set up for a number of BMC names that a stand-in for
+getaddrinfo resolves only after a delay, to a loopback port that never
+answers, and the event loop is then run while they retransmit.  Reported
+are the time taken to set the sessions up, how many lookups were made while
+the event loop ran and the longest the event loop went between passes.
+
+legacy has every transmit look the name up again, as sessions used to until
+a reply settled their address.  cached sets the sessions up straight away
+and has them read from the resolver cache, preresolved first looks the
+whole list up at once on a pool of threads.
+
+Usage: python benchmarks/resolver.py [sessions] [delay] [seconds]
+"""
+import os
+import socket
+import sys
+import time
+
+from pyghmi.ipmi.private import resolver
+from pyghmi.ipmi.private import session
+
+
+class SlowResolver(object):
+    """Stand-in for getaddrinfo, as a sluggish name service would behave
+    """
+
+    def __init__(self, delay, sockaddr):
+        self.delay = delay
+        self.sockaddr = sockaddr
+        self.calls = 0
+
+    def __call__(self, host, port, family=0, socktype=0):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP, '',
+                 self.sockaddr)]
+
+
+def run(mode, count, delay, seconds):
+    sink = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    sink.bind(('::1', 0))
+    slow = SlowResolver(delay, sink.getsockname())
+    cache = resolver.ResolverCache(getaddrinfo=slow,
+                                   clock=session._monotonic_time)
+    if mode == 'legacy':
+        cache.ttl = 0
+        cache.cached = cache.lookup
+    session.Session.resolvercache = cache
+    bmcs = ['bmc%d' % idx for idx in xrange(count)]
+    start = time.time()
+    if mode == 'preresolved':
+        cache.preresolve(bmcs)
+    for bmc in bmcs:
+        session.Session(bmc, 'admin', 'password', onlogon=lambda rsp: None)
+    setup = time.time() - start
+    calls = slow.calls
+    longest = 0
+    last = time.time()
+    end = last + seconds
+    while last < end:
+        session.Session.wait_for_rsp(timeout=0.01)
+        now = time.time()
+        longest = max(longest, now - last)
+        last = now
+    print "%12s %10.2f %10d %12.3f" % (mode, setup, slow.calls - calls,
+                                       longest)
+
+
+def main(count, delay, seconds):
+    print "%12s %10s %10s %12s" % ("mode", "setup s", "lookups",
+                                   "max stall s")
+    for mode in ('legacy', 'cached', 'preresolved'):
+        # each mode gets a fresh process, so that sessions left retrying
+        # by one do not weigh on the next
+        child = os.fork()
+        if child == 0:
+            run(mode, count, delay, seconds)
+            sys.stdout.flush()
+            os._exit(0)
+        os.waitpid(child, 0)
+
+
+if __name__ == '__main__':
+    count = 20
+    delay = 0.05
+    seconds = 5
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        delay = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        seconds = float(sys.argv[3])
+    main(count, delay, seconds)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Show what lost packets cost in command latency.
+
+A child process stands in for a number of BMCs on loopback ports, answering
+each IPMI request after a delay and dropping requests and replies at the
+given rate.  Sessions issue commands back to back for a while, and the
+latency of the commands is reported along with how many timed out and how
+many retransmissions were made.
+
+legacy retries the way sessions used to, a flat second more on each retry
+from a timeout of half a second to a second.  adaptive has the timeouts
+follow the round trip times measured for each BMC.
+
+Usage: python benchmarks/retransmit.py [sessions] [loss] [seconds]
+"""
+import heapq
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import time
+
+from pyghmi.ipmi.private import codec
+from pyghmi.ipmi.private import pacing
+from pyghmi.ipmi.private import rtt
+from pyghmi.ipmi.private import session
+
+
+class LegacyEstimator(rtt.RttEstimator):
+    """Timeouts as they were, measured round trips make no difference
+    """
+
+    def sample(self, roundtrip):
+        self.samples += 1
+
+    def backoff(self, timeout):
+        self.backoffs += 1
+        return timeout + 1
+
+
+def checksum(*data):
+    return (-sum(data)) & 0xff
+
+
+def answer(request):
+    """Frame the reply a BMC would give to an IPMI 1.5 request
+    """
+    payload = bytearray(codec.decode_ipmi15(request)[4])
+    netfn = (payload[1] >> 2) + 1
+    reply = bytearray((0x81, netfn << 2, checksum(0x81, netfn << 2),
+                       0x20, payload[4], payload[5], 0))
+    reply.append(checksum(*reply[3:]))
+    return codec.encode_ipmi15(0, 0, 0, reply)
+
+
+def serve(socks, loss, latency):
+    """Answer requests on socks, dropping a share of them either way
+    """
+    replies = []
+    while True:
+        timeout = None
+        if replies:
+            timeout = max(replies[0][0] - time.time(), 0)
+        for sock in select.select(socks, (), (), timeout)[0]:
+            data, sockaddr = sock.recvfrom(3000)
+            if random.random() < loss:  # lost on the way to the BMC
+                continue
+            if random.random() < loss:  # and on the way back
+                continue
+            delay = latency + random.expovariate(1 / latency)
+            heapq.heappush(replies, (time.time() + delay, sock,
+                                     answer(data), sockaddr))
+        while replies and replies[0][0] <= time.time():
+            _, sock, data, sockaddr = heapq.heappop(replies)
+            sock.sendto(data, sockaddr)
+
+
+def make_session(sockaddr, estimator):
+    """A session as it would be once logged in without authentication
+    """
+    ipmisession = object.__new__(session.Session)
+    ipmisession._initsession()
+    ipmisession.initialized = True
+    ipmisession.cleaningup = False
+    ipmisession.incommand = False
+    ipmisession.lastpayload = None
+    ipmisession.nowait = False
+    ipmisession.pendingpayloads = session.collections.deque()
+    ipmisession.pendingcommands = session.collections.deque()
+    ipmisession.pipelined = {}
+    ipmisession.bmc = sockaddr[0]
+    ipmisession.port = sockaddr[1]
+    ipmisession.rtt = estimator(
+        session.initialtimeout + (0.5 * random.random()),
+        session.Session.retryfloor, session.Session.retryceiling)
+    ipmisession.metrics = session.Session.metricsregistry.bmc(
+        *sockaddr[:2])
+    ipmisession.evicted = False
+    ipmisession.trace = None
+    ipmisession.reviving = False
+    ipmisession.firstxmit = None
+    ipmisession.xmittime = None
+    ipmisession.retransmitted = False
+    ipmisession.iosocket = session.Session._assignsocket(*sockaddr[:2])
+    ipmisession.pacescopes = session.Session.pacer.scopes(
+        pacing.subnet_of(sockaddr))
+    ipmisession.inflight = False
+    ipmisession.sockaddr = sockaddr
+    ipmisession.logged = 1
+    session.Session.bmc_handlers[sockaddr] = ipmisession
+    return ipmisession
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(mode, sockaddrs, seconds):
+    session.Session._createsocket()
+    estimator = rtt.RttEstimator
+    if mode == 'legacy':
+        estimator = LegacyEstimator
+    latencies = []
+    timeouts = [0]
+
+    def issue(ipmisession):
+        ipmisession.raw_command(netfn=6, command=1, callback=done,
+                                callback_args=(ipmisession, time.time()))
+
+    def done(response, args):
+        ipmisession, start = args
+        if 'error' in response:
+            timeouts[0] += 1
+        else:
+            latencies.append(time.time() - start)
+        if time.time() < end:
+            issue(ipmisession)
+
+    sessions = [make_session(sockaddr, estimator) for sockaddr in sockaddrs]
+    end = time.time() + seconds
+    for ipmisession in sessions:
+        issue(ipmisession)
+    while time.time() < end:
+        session.Session.wait_for_rsp(timeout=0.1)
+    latencies.sort()
+    backoffs = sum(ipmisession.rtt.backoffs for ipmisession in sessions)
+    print "%9s %9d %9.3f %9.3f %9.3f %9d %9d" % (
+        mode, len(latencies), percentile(latencies, 0.5),
+        percentile(latencies, 0.99), percentile(latencies, 1),
+        timeouts[0], backoffs)
+
+
+def main(count, loss, seconds, latency=0.02):
+    socks = []
+    for _ in xrange(count):
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.bind(('::1', 0))
+        socks.append(sock)
+    server = os.fork()
+    if server == 0:
+        serve(socks, loss, latency)
+        os._exit(0)
+    sockaddrs = [bound.getsockname() for bound in socks]
+    print "%9s %9s %9s %9s %9s %9s %9s" % (
+        "mode", "commands", "p50 s", "p99 s", "max s", "timeouts",
+        "retries")
+    try:
+        for mode in ('legacy', 'adaptive'):
+            # each mode gets a fresh process, so that the session class
+            # starts out the same for both
+            child = os.fork()
+            if child == 0:
+                run(mode, sockaddrs, seconds)
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(child, 0)
+    finally:
+        os.kill(server, signal.SIGTERM)
+        os.waitpid(server, 0)
+
+
+if __name__ == '__main__':
+    count = 20
+    loss = 0.05
+    seconds = 20
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        loss = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        seconds = float(sys.argv[3])
+    main(count, loss, seconds)
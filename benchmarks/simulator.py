@@ -0,0 +1,734 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stand in for a fleet of BMCs, so sessions can be exercised offline.
+
+A Simulator answers on a UDP socket per BMC, spread over loopback addresses,
+all served by one poll loop, in a forked child by way of start() or in the
+calling process by way of serve().  Each BMC speaks IPMI 1.5 with MD5
+authentication and, unless made to be 1.5 only, RMCP+ with cipher suite 3
+(RAKP-HMAC-SHA1, HMAC-SHA1-96 and AES-CBC-128).  In a session it answers
+Get Device ID, Set Session Privilege Level, Close Session, Get Chassis
+Status, Chassis Control, Set and Get System Boot Options and Activate and
+Deactivate Payload for SOL, whose console echoes back what is sent to it.
+Anything else is answered with Invalid Command.  Packets are framed, signed
+and encrypted by code of its own written against the specifications, rather
+than by the codec the sessions use, so the two check each other.
+
+How the network and the BMCs behave is up to the caller:
+  latency, jitter: seconds a reply is held back, plus up to jitter more
+  loss:            chance of each packet being lost, either way
+  reorder:         chance of a reply being held back another reorderdelay
+                   seconds, for the replies after it to overtake it
+  busy:            chance of a login being turned away as if the BMC had
+                   insufficient resources, Node Busy for IPMI 1.5 and
+                   status 1 to an RMCP+ open session request
+  capacity:        sessions a BMC has room for, logins beyond that are
+                   turned away the same way
+  powerdelay:      seconds a chassis control takes to change the power
+                   state
+  ipmi15:          fraction of the BMCs that only speak IPMI 1.5
+
+Run as a script, it logs in to every BMC, a mix of both protocols, and runs
+Get Device ID against all of them for a while, then goes through power,
+boot device and SOL with a Command and a Console on one BMC of each kind.
+
+Usage: python benchmarks/simulator.py [bmcs] [loss] [latency] [seconds]
+"""
+import hashlib
+import heapq
+import hmac
+import itertools
+import os
+import random
+import resource
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+
+from Crypto.Cipher import AES
+
+from pyghmi.ipmi import command as ipmicommand
+from pyghmi.ipmi import console
+from pyghmi.ipmi.private import session
+
+password = 'password'
+
+# the parameter 3 data of Set System Boot Options that disables the timer
+_bootinfoack = (3, 8)
+_sidpack = struct.Struct('<I')
+# RMCP version 1.0, no RMCP ack, class IPMI (ASF 2.0 section 3.2.2.1)
+_rmcpheader = '\x06\x00\xff\x07'
+# session headers, IPMI 2.0 tables 13-8 and 13-9: auth type, sequence number
+# and session id for IPMI 1.5, auth type 6, payload type, session id,
+# sequence number and payload length for RMCP+
+_ipmi15header = struct.Struct('<BII')
+_ipmi20header = struct.Struct('<BBIIH')
+# IPMI 1.5 session packets from the auth type up to the message of these
+# lengths take an extra pad byte (IPMI 2.0 table 13-8)
+_legacypadlengths = (56, 84, 112, 128, 156)
+
+
+def _checksum(data):
+    return (-sum(data)) & 0xff
+
+
+def _sha1(key, data):
+    return hmac.new(key, data, hashlib.sha1).digest()
+
+
+def _sid(data, offset):
+    return _sidpack.unpack_from(str(data[offset:offset + 4]))[0]
+
+
+def _md5authcode(password, sid, seqnumber, message):
+    """The MD5 auth code of an IPMI 1.5 packet, IPMI 2.0 section 22.17.1
+    """
+    return hashlib.md5(password + _sidpack.pack(sid) + str(message) +
+                       _sidpack.pack(seqnumber) + password).digest()
+
+
+def _frame15(authtype, seqnumber, sid, message, authcode=''):
+    message = str(message)
+    packet = (_ipmi15header.pack(authtype, seqnumber, sid) + authcode +
+              chr(len(message)) + message)
+    if len(packet) in _legacypadlengths:
+        packet += '\x00'
+    return _rmcpheader + packet
+
+
+def _unframe15(data):
+    """Auth type, sequence number, session id, auth code and message
+    """
+    authtype, seqnumber, sid = _ipmi15header.unpack_from(data, 4)
+    offset = 13
+    authcode = ''
+    if authtype != 0:
+        authcode = data[offset:offset + 16]
+        offset += 16
+    length = ord(data[offset])
+    return (authtype, seqnumber, sid, authcode,
+            data[offset + 1:offset + 1 + length])
+
+
+def _frame20(ptype, sid, seqnumber, payload, k1=None, aeskey=None):
+    """An RMCP+ packet, signed with HMAC-SHA1-96 under k1 and encrypted
+    with AES-CBC-128 under aeskey if given, IPMI 2.0 section 13.28
+    """
+    payload = str(payload)
+    if aeskey is not None:
+        ptype |= 0b10000000
+        # pad bytes count up from 1, followed by how many there are, to a
+        # whole number of blocks (IPMI 2.0 section 13.29)
+        padlen = -(len(payload) + 1) % 16
+        payload += ''.join(chr(pad) for pad in xrange(1, padlen + 1))
+        payload += chr(padlen)
+        iv = os.urandom(16)
+        payload = iv + AES.new(aeskey, AES.MODE_CBC, iv).encrypt(payload)
+    if k1 is not None:
+        ptype |= 0b01000000
+    packet = _ipmi20header.pack(6, ptype, sid, seqnumber, len(payload))
+    packet += payload
+    if k1 is not None:
+        # the auth code covers the auth type up to the next header, padded
+        # to a multiple of four bytes
+        padlen = -(len(packet) + 2) % 4
+        packet += '\xff' * padlen + chr(padlen) + '\x07'
+        packet += hmac.new(k1, packet, hashlib.sha1).digest()[:12]
+    return _rmcpheader + packet
+
+
+def _unframe20(data):
+    """Payload type, session id, sequence number and payload
+    """
+    _, ptype, sid, seqnumber, length = _ipmi20header.unpack_from(data, 4)
+    return ptype, sid, seqnumber, data[16:16 + length]
+
+
+def _authentic20(data, k1):
+    return (len(data) > 16 and
+            hmac.new(k1, data[4:-12], hashlib.sha1).digest()[:12] ==
+            data[-12:])
+
+
+def _decrypt20(payload, aeskey):
+    payload = str(payload)
+    if len(payload) < 32 or len(payload) % 16:
+        return None
+    cipher = AES.new(aeskey, AES.MODE_CBC, payload[:16])
+    plain = cipher.decrypt(payload[16:])
+    padlen = ord(plain[-1])
+    if padlen >= 16:
+        return None
+    return bytearray(plain[:-1 - padlen])
+
+
+def _newsid(taken):
+    sid = 0
+    while sid == 0 or sid in taken:
+        sid = random.randint(1, 0xffffffff)
+    return sid
+
+
+class _Session(object):
+    """A session a BMC has open, or is being opened by RAKP
+
+    :param ipmi2: whether it is an RMCP+ session
+    :param sid: the session id the BMC handed out
+    :param consolesid: the session id the console goes by, RMCP+ only
+    """
+
+    def __init__(self, ipmi2, sid, consolesid=None):
+        self.ipmi2 = ipmi2
+        self.sid = sid
+        self.consolesid = consolesid
+        self.active = False
+        self.seqnumber = 0
+        self.lastseen = 0
+        self.consolerand = None
+        self.bmcrand = None
+        self.privuser = None
+        self.k1 = None
+        self.aeskey = None
+        self.rakp4 = None
+        # SOL: sequence number of the last packet taken from the console,
+        # and what it was answered with, for when it comes again
+        self.solseq = 0
+        self.solreply = None
+        self.myseq = 0
+
+    def nextseq(self):
+        self.seqnumber += 1
+        return self.seqnumber
+
+
+class Bmc(object):
+    """One simulated BMC, its sessions and the state of its system
+
+    :param simulator: the Simulator it is part of, for its settings
+    :param ipmi15only: whether to turn down RMCP+
+    """
+
+    def __init__(self, simulator, ipmi15only=False):
+        self.simulator = simulator
+        self.ipmi15only = ipmi15only
+        self.guid = os.urandom(16)
+        self.sessions = {}
+        self.poweron = False
+        self.pendingpower = None
+        self.bootflags = (0, 0, 0, 0, 0)
+        self.solowner = None
+
+    def receive(self, data, now):
+        """The packets data is answered with, a list of them
+        """
+        if data[4] == '\x06':
+            return self._receive_ipmi2(data, now)
+        return self._receive_ipmi15(data, now)
+
+    def _admit(self, now):
+        """Whether there is room for another session
+        """
+        sim = self.simulator
+        for sid, ses in self.sessions.items():
+            if ses.lastseen + sim.sessiontimeout < now:
+                self._close(sid)
+        if sim.busy and random.random() < sim.busy:
+            return False
+        return len(self.sessions) < sim.capacity
+
+    def _close(self, sid):
+        ses = self.sessions.pop(sid, None)
+        if ses is not None and self.solowner is ses:
+            self.solowner = None
+
+    def _power(self, now):
+        if self.pendingpower is not None and self.pendingpower[0] <= now:
+            self.poweron = self.pendingpower[1]
+            self.pendingpower = None
+        return self.poweron
+
+    def _chassis_control(self, control, now):
+        if control not in (0, 1, 2, 3, 5):
+            return 0xcc
+        if control == 3:  # a reset leaves the power alone
+            return 0
+        if control == 2:  # a power cycle ends up on, like power on
+            control = 1
+        when = now + self.simulator.powerdelay
+        self.pendingpower = (when, control == 1)
+        self._power(now)
+        return 0
+
+    def command(self, ses, netfn, cmd, data, now):
+        """Completion code and data a command in a session is answered with
+        """
+        if netfn == 6:
+            if cmd == 0x01:  # get device id
+                return 0, (0x20, 0x81, 0x01, 0x00, 0x02, 0xbf,
+                           0x00, 0x00, 0x00, 0x00, 0x00)
+            elif cmd == 0x3b:  # set session privilege level
+                return 0, (data[0] if data else 4,)
+            elif cmd == 0x3c:  # close session
+                self._close(ses.sid)
+                return 0, ()
+            elif cmd == 0x48:  # activate payload
+                if not data or data[0] != 1:
+                    return 0x80, ()
+                if self.solowner is not None and self.solowner is not ses:
+                    return 0x80, ()  # active for another session
+                self.solowner = ses
+                ses.solseq = 0
+                ses.solreply = None
+                return 0, (0, 0, 0, 0, 0, 1, 0, 1, 623 & 0xff, 623 >> 8,
+                           0xff, 0xff)
+            elif cmd == 0x49:  # deactivate payload
+                if self.solowner is not None:
+                    self.solowner = None
+                    return 0, ()
+                return 0x80, ()
+        elif netfn == 0:
+            if cmd == 0x01:  # get chassis status
+                return 0, (int(self._power(now)), 0, 0)
+            elif cmd == 0x02:  # chassis control
+                if not data:
+                    return 0xc7, ()
+                return self._chassis_control(data[0], now), ()
+            elif cmd == 0x08:  # set system boot options
+                if tuple(data[:2]) == _bootinfoack:
+                    return 0, ()
+                if len(data) == 6 and data[0] & 0x7f == 5:
+                    self.bootflags = tuple(data[1:])
+                    return 0, ()
+                return 0x80, ()  # parameter not supported
+            elif cmd == 0x09:  # get system boot options
+                if data and data[0] & 0x7f == 5:
+                    return 0, (1, 5) + self.bootflags
+                return 0x80, ()
+        return 0xc1, ()
+
+    def _ipmi_reply(self, request, code, data):
+        netfn = (request[1] >> 2) + 1
+        reply = bytearray((0x81, netfn << 2, _checksum((0x81, netfn << 2)),
+                           0x20, request[4], request[5], code))
+        reply.extend(data)
+        reply.append(_checksum(reply[3:]))
+        return reply
+
+    def _receive_ipmi15(self, data, now):
+        sim = self.simulator
+        authtype, seqnumber, sid, authcode, payload = _unframe15(data)
+        payload = bytearray(payload)
+        if len(payload) < 7:
+            return []
+        netfn = payload[1] >> 2
+        cmd = payload[5]
+        request = payload[6:-1]
+        if sid == 0:  # outside of a session
+            if netfn != 6:
+                return []
+            if cmd == 0x38:  # get channel authentication capabilities
+                if self.ipmi15only:
+                    if request and request[0] & 0x80:
+                        return self._ipmi15_reply(None, payload, 0xcc, ())
+                    reply = (1, 0b100, 0, 0, 0, 0, 0, 0)
+                else:  # MD5, and IPMI 2.0 extended capabilities
+                    reply = (1, 0b10000100, 0, 0b10, 0, 0, 0, 0)
+                return self._ipmi15_reply(None, payload, 0, reply)
+            elif cmd == 0x39:  # get session challenge
+                if not self._admit(now):
+                    return self._ipmi15_reply(None, payload, 0xc0, ())
+                ses = _Session(False, _newsid(self.sessions))
+                ses.lastseen = now
+                self.sessions[ses.sid] = ses
+                challenge = bytearray(_sidpack.pack(ses.sid) + os.urandom(16))
+                return self._ipmi15_reply(None, payload, 0, challenge)
+            return []
+        ses = self.sessions.get(sid)
+        if ses is None or ses.ipmi2 or authtype != 2:
+            return []
+        if authcode != _md5authcode(sim.paddedpassword, sid, seqnumber,
+                                    payload):
+            return []
+        ses.lastseen = now
+        if cmd == 0x3a and netfn == 6:  # activate session
+            ses.active = True
+            reply = bytearray((2,)) + _sidpack.pack(sid) + \
+                bytearray((1, 0, 0, 0, 4))
+            return self._ipmi15_reply(ses, payload, 0, reply, seqnumber=0)
+        if not ses.active:
+            return []
+        code, reply = self.command(ses, netfn, cmd, request, now)
+        return self._ipmi15_reply(ses, payload, code, reply)
+
+    def _ipmi15_reply(self, ses, request, code, data, seqnumber=None):
+        reply = self._ipmi_reply(request, code, data)
+        if ses is None:
+            return [_frame15(0, 0, 0, reply)]
+        if seqnumber is None:
+            seqnumber = ses.nextseq()
+        authcode = _md5authcode(self.simulator.paddedpassword, ses.sid,
+                                seqnumber, reply)
+        return [_frame15(2, seqnumber, ses.sid, reply, authcode)]
+
+    def _receive_ipmi2(self, data, now):
+        if self.ipmi15only:
+            return []
+        payload_type, sid, _, payload = _unframe20(data)
+        ptype = payload_type & 0b00111111
+        payload = bytearray(payload)
+        if ptype == 0x10:
+            return self._open_session(payload, now)
+        elif ptype == 0x12:
+            return self._rakp1(payload)
+        elif ptype == 0x14:
+            return self._rakp3(payload)
+        elif ptype not in (0, 1):
+            return []
+        ses = self.sessions.get(sid)
+        if (ses is None or not ses.active or
+                not payload_type & 0b01000000 or
+                not _authentic20(data, ses.k1)):
+            return []
+        ses.lastseen = now
+        if payload_type & 0b10000000:
+            payload = _decrypt20(payload, ses.aeskey)
+            if payload is None:
+                return []
+        if ptype == 1:
+            reply = self._sol(ses, payload)
+            if reply is None:
+                return []
+        else:
+            if len(payload) < 7:
+                return []
+            code, reply = self.command(ses, payload[1] >> 2, payload[5],
+                                       payload[6:-1], now)
+            reply = self._ipmi_reply(payload, code, reply)
+        return [_frame20(ptype, ses.consolesid, ses.nextseq(), reply,
+                         ses.k1, ses.aeskey)]
+
+    def _rmcpplus(self, ptype, payload):
+        return [_frame20(ptype, 0, 0, bytearray(payload))]
+
+    def _open_session(self, payload, now):
+        if len(payload) < 32:
+            return []
+        tag = payload[0]
+        consolesid = payload[4:8]
+        if not self._admit(now):  # insufficient resources
+            return self._rmcpplus(0x11, bytearray((tag, 1, 0, 0)) +
+                                  consolesid)
+        ses = _Session(True, _newsid(self.sessions), _sid(consolesid, 0))
+        ses.lastseen = now
+        self.sessions[ses.sid] = ses
+        reply = bytearray((tag, 0, 4, 0)) + consolesid + \
+            _sidpack.pack(ses.sid) + payload[8:32]
+        return self._rmcpplus(0x11, reply)
+
+    def _rakp1(self, payload):
+        if len(payload) < 28:
+            return []
+        tag = payload[0]
+        ses = self.sessions.get(_sid(payload, 4))
+        if ses is None or not ses.ipmi2:
+            return self._rmcpplus(0x13, (tag, 2, 0, 0, 0, 0, 0, 0))
+        userlen = payload[27]
+        ses.consolerand = str(payload[8:24])
+        ses.bmcrand = os.urandom(16)
+        ses.privuser = str(payload[24:25] + payload[27:28 + userlen])
+        consolesid = _sidpack.pack(ses.consolesid)
+        hmacdata = (consolesid + _sidpack.pack(ses.sid) + ses.consolerand +
+                    ses.bmcrand + self.guid + ses.privuser)
+        reply = (chr(tag) + '\x00\x00\x00' + consolesid + ses.bmcrand +
+                 self.guid + _sha1(self.simulator.password, hmacdata))
+        return self._rmcpplus(0x13, reply)
+
+    def _rakp3(self, payload):
+        if len(payload) < 28:
+            return []
+        tag = payload[0]
+        ses = self.sessions.get(_sid(payload, 4))
+        if ses is None or not ses.ipmi2 or ses.bmcrand is None:
+            return self._rmcpplus(0x15, (tag, 2, 0, 0, 0, 0, 0, 0))
+        consolesid = _sidpack.pack(ses.consolesid)
+        if ses.rakp4 is not None:  # RAKP4 was lost, say it again
+            return self._rmcpplus(0x15, chr(tag) + ses.rakp4)
+        password = self.simulator.password
+        expected = _sha1(password, ses.bmcrand + consolesid + ses.privuser)
+        if str(payload[8:]) != expected:  # invalid integrity check value
+            return self._rmcpplus(0x15, chr(tag) + '\x0f\x00\x00' +
+                                  consolesid)
+        sik = _sha1(self.simulator.kg or password,
+                    ses.consolerand + ses.bmcrand + ses.privuser)
+        ses.k1 = _sha1(sik, '\x01' * 20)
+        ses.aeskey = _sha1(sik, '\x02' * 20)[:16]
+        ses.active = True
+        ses.rakp4 = ('\x00\x00\x00' + consolesid +
+                     _sha1(sik, ses.consolerand + _sidpack.pack(ses.sid) +
+                           self.guid)[:12])
+        return self._rmcpplus(0x15, chr(tag) + ses.rakp4)
+
+    def _sol(self, ses, payload):
+        """The answer to a SOL packet from the console, None for none
+
+        Characters sent to the console come straight back, in the packet
+        acknowledging them.
+        """
+        if self.solowner is not ses or len(payload) < 4:
+            return None
+        seq = payload[0] & 0xf
+        if seq == 0:  # only acknowledges what the BMC sent
+            return None
+        if seq == ses.solseq:  # sent again, answer the same
+            return ses.solreply
+        text = payload[4:]
+        myseq = 0
+        if text:
+            ses.myseq = (ses.myseq % 15) + 1
+            myseq = ses.myseq
+        ses.solseq = seq
+        ses.solreply = bytearray((myseq, seq, len(text), 0)) + text
+        return ses.solreply
+
+
+class Simulator(object):
+    """A fleet of simulated BMCs, each on its own UDP socket
+
+    :param count: how many BMCs
+    :param addresses: local addresses to spread the BMCs over, each getting
+                      a port picked for it; 127.0.0.0/8 is all loopback on
+                      Linux, so a large fleet can be spread over many
+    :param password: password the BMCs take, for any user name
+    :param kg: BMC key of the RMCP+ BMCs, if not the password
+    See the module docstring for the rest.
+    """
+
+    def __init__(self, count, addresses=('::1',), password=password, kg=None,
+                 latency=0.0, jitter=0.0, loss=0.0, reorder=0.0,
+                 reorderdelay=0.005, busy=0.0, capacity=16, powerdelay=0.0,
+                 ipmi15=0.0, sessiontimeout=60):
+        self.password = password
+        self.paddedpassword = password.ljust(16, '\x00')
+        self.kg = kg
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorderdelay = reorderdelay
+        self.busy = busy
+        self.capacity = capacity
+        self.powerdelay = powerdelay
+        self.sessiontimeout = sessiontimeout
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < count + 256 <= hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (count + 256, hard))
+        self.socks = []
+        self.bmcs = {}
+        self.endpoints = []
+        legacy = int(count * ipmi15)
+        for idx in xrange(count):
+            address = addresses[idx % len(addresses)]
+            family = socket.AF_INET6 if ':' in address else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.bind((address, 0))
+            sock.setblocking(0)
+            self.socks.append(sock)
+            # the 1.5 only BMCs are spread out evenly among the others
+            self.bmcs[sock.fileno()] = (
+                sock, Bmc(self, legacy and idx * legacy // count !=
+                          (idx + 1) * legacy // count))
+            self.endpoints.append((address, sock.getsockname()[1]))
+        self.child = None
+
+    def _send_later(self, replies, order, sock, packets, sockaddr, now):
+        for packet in packets:
+            if self.loss and random.random() < self.loss:
+                continue
+            when = now + self.latency
+            if self.jitter:
+                when += random.uniform(0, self.jitter)
+            if self.reorder and random.random() < self.reorder:
+                when += self.reorderdelay
+            heapq.heappush(replies, (when, next(order), sock, packet,
+                                     sockaddr))
+
+    def serve(self):
+        """Answer the BMCs' packets, until killed
+        """
+        poller = select.poll()
+        for sock in self.socks:
+            poller.register(sock, select.POLLIN)
+        replies = []
+        order = itertools.count()
+        while True:
+            timeout = None
+            if replies:
+                timeout = max(replies[0][0] - time.time(), 0) * 1000
+            for fd, _ in poller.poll(timeout):
+                sock, bmc = self.bmcs[fd]
+                now = time.time()
+                while True:
+                    try:
+                        data, sockaddr = sock.recvfrom(3000)
+                    except socket.error:
+                        break
+                    if len(data) < 16 or data[0] != '\x06':
+                        continue
+                    if self.loss and random.random() < self.loss:
+                        continue
+                    self._send_later(replies, order, sock,
+                                     bmc.receive(data, now), sockaddr, now)
+            now = time.time()
+            while replies and replies[0][0] <= now:
+                _, _, sock, packet, sockaddr = heapq.heappop(replies)
+                try:
+                    sock.sendto(packet, sockaddr)
+                except socket.error:
+                    pass
+
+    def start(self):
+        """Serve from a forked child, closing the sockets in this process
+        """
+        self.child = os.fork()
+        if self.child == 0:
+            try:
+                self.serve()
+            finally:
+                os._exit(0)
+        for sock in self.socks:
+            sock.close()
+        self.socks = []
+        self.bmcs = {}
+
+    def stop(self):
+        """Stop the child started by start()
+        """
+        if self.child:
+            os.kill(self.child, signal.SIGTERM)
+            os.waitpid(self.child, 0)
+            self.child = None
+
+
+def sweep(endpoints, seconds):
+    session.Session.subnetmaxrate = None
+    session.Session.subnetmaxpending = 1 << 30
+    results = {'success': 0, 'error': 0}
+    start = time.time()
+
+    def logged(response):
+        results['error' if 'error' in response else 'success'] += 1
+
+    sessions = [session.Session(address, 'admin', password, port=port,
+                                onlogon=logged)
+                for address, port in endpoints]
+    while results['success'] + results['error'] < len(sessions):
+        session.Session.wait_for_rsp(timeout=0.1)
+    logintime = time.time() - start
+    sessions = [ipmisession for ipmisession in sessions
+                if ipmisession.logged]
+    versions = [ipmisession.ipmiversion for ipmisession in sessions]
+    outstanding = [0]
+    errors = [0]
+
+    def done(response):
+        outstanding[0] -= 1
+        if 'error' in response:
+            errors[0] += 1
+
+    commands = 0
+    start = time.time()
+    while sessions and time.time() - start < seconds:
+        outstanding[0] = len(sessions)
+        for ipmisession in sessions:
+            ipmisession.raw_command(netfn=6, command=1, callback=done)
+        while outstanding[0]:
+            session.Session.wait_for_rsp(timeout=0.1)
+        commands += len(sessions)
+    elapsed = time.time() - start
+    print "%9s %9s %9s %9s %9s %9s %9s" % (
+        "logged in", "failed", "1.5", "2.0", "login s", "commands", "us/cmd")
+    print "%9d %9d %9d %9d %9.2f %9d %9.1f" % (
+        results['success'], results['error'], versions.count(1.5),
+        versions.count(2.0), logintime, commands - errors[0],
+        elapsed * 1e6 / max(commands, 1))
+
+
+def check(endpoint):
+    """Go through power, boot device and SOL on a BMC with Command
+    """
+    address, port = endpoint
+    ipmicmd = ipmicommand.Command(address, 'admin', password, port=port)
+    results = [ipmicmd.ipmi_session.ipmiversion]
+    results.append(ipmicmd.set_power('on', wait=True)['powerstate'])
+    results.append(ipmicmd.get_power()['powerstate'])
+    results.append(ipmicmd.set_bootdev('network')['bootdev'])
+    results.append(ipmicmd.get_bootdev()['bootdev'])
+    results.append(ipmicmd.set_power('off', wait=True)['powerstate'])
+    echoed = []
+    if ipmicmd.ipmi_session.ipmiversion == 2.0:
+        sol = console.Console(address, 'solo', password, echoed.append,
+                              port=port)
+        deadline = time.time() + 10
+        while sol.ipmi_session.sol_handler is None and \
+                time.time() < deadline:
+            session.Session.wait_for_rsp(timeout=0.1)
+        sol.send_data('hello')
+        while not echoed and time.time() < deadline:
+            session.Session.wait_for_rsp(timeout=0.1)
+    results.append(''.join(echoed) or '-')
+    print "%9s %9s %9s %9s %9s %9s %9s" % (
+        "ipmi", "power", "get", "bootdev", "get", "power", "sol")
+    print "%9s %9s %9s %9s %9s %9s %9s" % tuple(results)
+
+
+def main(count, loss, latency, seconds):
+    simulator = Simulator(count, loss=loss, latency=latency, ipmi15=0.5,
+                          powerdelay=0.5)
+    endpoints = simulator.endpoints
+    simulator.start()
+    try:
+        # each run gets a fresh process, so that the session class starts
+        # out the same for both
+        for run, args in ((sweep, (endpoints, seconds)),
+                          (check, (endpoints[0],)),
+                          (check, (endpoints[1],))):
+            child = os.fork()
+            if child == 0:
+                run(*args)
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(child, 0)
+    finally:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    count = 1000
+    loss = 0.0
+    latency = 0.001
+    seconds = 5
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        loss = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        latency = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        seconds = int(sys.argv[4])
+    main(count, loss, latency, seconds)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure what tracing commands costs, and show what it tells.
+
+A sweep of Get Device ID to every BMC of a fleet, stood in for by the IPMI
+1.5 BMCs of benchmarks/logins.py, is run in rounds with no tracer, with one
+tracing a hundredth of commands and with one tracing them all into a ring
+buffer.  Reported are microseconds per command, and then where the time of
+the traced commands went, as the mean time from one phase to the next.
+
+Usage: python benchmarks/tracing.py [sessions] [rounds]
+"""
+import os
+import signal
+import socket
+import sys
+import time
+
+from pyghmi.ipmi.private import session
+from pyghmi.ipmi.private import tracing
+
+from logins import password
+from logins import serve
+
+
+def run(samplerate, ports, rounds):
+    session.Session.subnetmaxrate = None
+    session.Session.subnetmaxpending = 1 << 30
+    loggedin = [0]
+
+    def logged(response):
+        loggedin[0] += 1
+
+    sessions = [session.Session('::1', 'admin', password, port=port,
+                                onlogon=logged)
+                for port in ports]
+    while loggedin[0] < len(sessions):
+        session.Session.wait_for_rsp(timeout=0.1)
+    sink = tracing.RingBufferSink(rounds * len(sessions))
+    if samplerate:
+        session.Session.tracer = tracing.Tracer(sink, samplerate)
+    outstanding = [0]
+
+    def done(response):
+        outstanding[0] -= 1
+
+    start = time.time()
+    for _ in xrange(rounds):
+        outstanding[0] = len(sessions)
+        for ipmisession in sessions:
+            ipmisession.raw_command(netfn=6, command=1, callback=done)
+        while outstanding[0]:
+            session.Session.wait_for_rsp(timeout=0.1)
+    elapsed = time.time() - start
+    usecs = elapsed * 1e6 / (rounds * len(sessions))
+    print "%9s %9.1f %9d" % (samplerate, usecs, len(sink.records()))
+    return sink.records()
+
+
+def breakdown(records):
+    """Mean microseconds from each phase to the next, in order first seen
+    """
+    order = []
+    totals = {}
+    for record in records:
+        last = 0
+        for phase, offset in record['phases']:
+            if phase not in totals:
+                order.append(phase)
+                totals[phase] = 0
+            totals[phase] += offset - last
+            last = offset
+    for phase in order:
+        print "%12s %9.1f" % (phase, totals[phase] * 1e6 / len(records))
+
+
+def main(count, rounds):
+    socks = []
+    for _ in xrange(count):
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.bind(('::1', 0))
+        socks.append(sock)
+    server = os.fork()
+    if server == 0:
+        serve(socks, count, count, 0)
+        os._exit(0)
+    ports = [bound.getsockname()[1] for bound in socks]
+    print "%9s %9s %9s" % ("sampled", "us/cmd", "traced")
+    try:
+        for samplerate in (0, 0.01, 1):
+            # each mode gets a fresh process, so that the session class
+            # starts out the same for all
+            child = os.fork()
+            if child == 0:
+                records = run(samplerate, ports, rounds)
+                if samplerate == 1:
+                    print "%12s %9s" % ("phase", "mean us")
+                    breakdown(records)
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(child, 0)
+    finally:
+        os.kill(server, signal.SIGTERM)
+        os.waitpid(server, 0)
+
+
+if __name__ == '__main__':
+    count = 500
+    rounds = 20
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+    main(count, rounds)
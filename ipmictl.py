@@ -24,7 +24,7 @@ import os
 import string
 import sys
 
-from pyghmi.ipmi import command
+from pyghmi.ipmi import fleet
 password = os.environ['IPMIPASSWORD']
 os.environ['IPMIPASSWORD'] = ""
 if (len(sys.argv) < 3):
@@ -37,33 +37,30 @@ args = None
 if len(sys.argv) >= 5:
     args = sys.argv[4:]
 
-ipmicmd = None
-
-
-def docommand(result, ipmisession):
-    cmmand = sys.argv[3]
-    print "Logged into %s" % ipmisession.bmc
-    if 'error' in result:
-        print result['error']
-        return
-    if cmmand == 'power':
-        if args:
-            print ipmisession.set_power(args[0], wait=True)
-        else:
-            value = ipmisession.get_power()
-            print "%s: %s" % (ipmisession.bmc, value['powerstate'])
-    elif cmmand == 'bootdev':
-        if args:
-            print ipmisession.set_bootdev(args[0])
-        else:
-            print ipmisession.get_bootdev()
-    elif cmmand == 'raw':
-        print ipmisession.raw_command(netfn=int(args[0]),
-                                      command=int(args[1]),
-                                      data=map(lambda x: int(x, 16), args[2:]))
-
 bmcs = string.split(bmc, ",")
+nodes = fleet.Fleet([(node, userid, password) for node in bmcs])
+cmmand = sys.argv[3]
+results = {}
+if cmmand == 'power':
+    if args:
+        results = nodes.set_power(args[0], wait=True)
+    else:
+        results = nodes.get_power()
+elif cmmand == 'bootdev':
+    if args:
+        results = nodes.set_bootdev(args[0])
+    else:
+        results = nodes.get_bootdev()
+elif cmmand == 'raw':
+    results = nodes.raw_command(netfn=int(args[0]), command=int(args[1]),
+                                data=map(lambda x: int(x, 16), args[2:]))
 for bmc in bmcs:
-    ipmicmd = command.Command(bmc=bmc, userid=userid, password=password,
-                              onlogon=docommand)
-ipmicmd.eventloop()
+    if bmc not in results:
+        continue
+    result = results[bmc]
+    if 'error' in result:
+        print "%s: %s" % (bmc, result['error'])
+    elif cmmand == 'power' and not args:
+        print "%s: %s" % (bmc, result['powerstate'])
+    else:
+        print "%s: %s" % (bmc, result)
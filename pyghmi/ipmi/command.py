@@ -17,6 +17,8 @@
 
 import pyghmi.exceptions as exc
 
+from pyghmi.ipmi.private import exporter
+from pyghmi.ipmi.private import polling
 from pyghmi.ipmi.private import session
 
 
@@ -63,7 +65,13 @@ class Command(object):
     For asynchronous mode, simply pass in a callback function.  It is
     recommended to pass in an instance method to callback and ignore the
     callback_args parameter. However, callback_args can optionally be populated
-    if desired.
+    if desired.  In asynchronous mode, errors are passed to the callback as a
+    dict with an 'error' key rather than raised.  Commands issued this way
+    while another is outstanding on the same BMC are run in order.
+
+    Something has to drive the event loop, either eventloop() or
+    wait_for_rsp(), or an application's own loop by way of get_handles() and
+    get_timeout().
 
     :param bmc: hostname or ip address of the BMC
     :param userid: username to use to connect
@@ -73,9 +81,19 @@ class Command(object):
     :param kg: Optional parameter to use if BMC has a particular Kg configured
     """
 
+    # set_power waits poll quickly at first and back off to no more than
+    # every powerpollceiling seconds, with the polls of every wait in the
+    # process kept to powerpollbudget polls per second between them
+    powerpollinterval = 0.5
+    powerpollceiling = 5.0
+    powerpollbudget = polling.PollBudget(200, clock=session._monotonic_time)
+    # seconds a power state read from the BMC is reused for by get_power and
+    # set_power, by every Command on the same session, or None to always ask
+    # the BMC.  Chassis control through the session forgets it
+    powerstatettl = None
+
     def __init__(self, bmc, userid, password, port=623, onlogon=None, kg=None):
-        # TODO(jbjohnso): accept tuples and lists of each parameter for mass
-        # operations without pushing the async complexities up the stack
+        # operations on many BMCs at once are left to pyghmi.ipmi.fleet
         self.onlogon = onlogon
         self.bmc = bmc
         if onlogon is not None:
@@ -110,7 +128,111 @@ class Command(object):
         """
         return session.Session.wait_for_rsp(timeout=timeout)
 
-    def get_bootdev(self):
+    @classmethod
+    def get_handles(cls):
+        """Handles for an application's own event loop to watch
+
+        When one is readable, call wait_for_rsp(timeout=0).
+        """
+        return session.Session.get_handles()
+
+    @classmethod
+    def get_timeout(cls):
+        """Seconds until wait_for_rsp(timeout=0) should next be called
+
+        :returns: number of seconds, or None if nothing is scheduled
+        """
+        return session.Session.get_timeout()
+
+    @classmethod
+    def preresolve(cls, bmcs, port=623, workers=16):
+        """Look up the addresses of a list of BMCs ahead of time
+
+        Lookups run concurrently on a pool of threads.  Otherwise each is made
+        as a Command for the BMC is first set up, its login starting from the
+        event loop once the name service has answered.
+
+        :param bmcs: iterable of BMC names or addresses
+        :param port: port the BMCs will be reached on
+        :param workers: how many lookups to have going at once
+        :returns: dict of BMC to tuple of its addresses, or to the
+                  socket.gaierror its lookup failed with
+        """
+        return session.Session.resolvercache.preresolve(bmcs, port, workers)
+
+    @classmethod
+    def get_login_state(cls):
+        """How the logins of all sessions are getting on
+
+        Logins are started a limited number at a time and retried when a BMC
+        turns them away as too busy.
+
+        :returns: dict with counts of logins active, queued and backing off
+                  before a retry, of those that succeeded, failed and were
+                  retried, and in wave and lastwave the seconds taken by the
+                  logins under way and by the last batch to complete
+        """
+        return session.Session.loginscheduler.state()
+
+    @classmethod
+    def get_metrics(cls, perbmc=True):
+        """Counters and latency histograms of all sessions
+
+        See Session.get_metrics for what is in there.
+
+        :param perbmc: whether to break them down by BMC as well
+        """
+        return session.Session.get_metrics(perbmc)
+
+    @classmethod
+    def start_metrics_exporter(cls, address='127.0.0.1', port=9623):
+        """Serve the metrics of all sessions over HTTP for Prometheus
+
+        The endpoint is served from the session event loop, so as long as
+        something is waiting on sessions, and never holds it up.
+
+        :param address: address to listen on, loopback by default
+        :param port: port to listen on, 0 to have one picked
+        :returns: MetricsExporter, with the port it listens on in port and a
+                  close method to stop it
+        """
+        return exporter.MetricsExporter(address, port)
+
+    def get_rtt(self):
+        """Round trip time statistics of the BMC
+
+        :returns: dict with the smoothed round trip time (srtt) and its
+                  variation (rttvar) in seconds, None until a reply has been
+                  measured, the current retransmission timeout (rto) and how
+                  many replies were measured (samples) and retransmissions
+                  made (backoffs)
+        """
+        return self.ipmi_session.rtt.state()
+
+    def _async_command(self, request, netfn, command, data=(),
+                       delay_xmit=None):
+        """Send a command on behalf of a call made with a callback
+
+        The response, with any completion code turned into an error, goes to
+        request['handler'], which returns the result for the caller's
+        callback, or None if it carried on with another command.
+        """
+        self.ipmi_session.raw_command(netfn=netfn, command=command, data=data,
+                                      callback=self._async_response,
+                                      callback_args=request,
+                                      delay_xmit=delay_xmit)
+        return True
+
+    def _async_response(self, response, request):
+        errorstr = session.get_ipmi_error(response)
+        if errorstr:
+            response['error'] = errorstr
+        result = request['handler'](response, request)
+        if result is not None:
+            session.call_with_optional_args(request['callback'], result,
+                                            request['callback_args'])
+
+    def get_bootdev(self, callback=None, callback_args=None):
         """Get current boot device override information.
 
         Provides the current requested boot device.  Be aware that not all IPMI
@@ -118,11 +240,22 @@ class Command(object):
         BIOS or UEFI fail to honor it. This is usually only applicable to the
         next reboot.
 
-        :returns: dict --The response will be provided in the return as a dict
+        :param callback: optional callback
+        :param callback_args: optional arguments to callback
+        :returns: dict or True -- If callback is not provided, the response
+                  will be provided in the return as a dict
         """
+        if callback is not None:
+            request = {'handler': self._got_bootdev, 'callback': callback,
+                       'callback_args': callback_args}
+            return self._async_command(request, netfn=0, command=9,
+                                       data=(5, 0, 0))
         response = self.ipmi_session.raw_command(netfn=0,
                                                  command=9,
                                                  data=(5, 0, 0))
+        return self._got_bootdev(response)
+
+    def _got_bootdev(self, response, request=None):
         # interpret response per 'get system boot options'
         if 'error' in response:
             return response
@@ -143,7 +276,8 @@ class Command(object):
             else:
                 return {'bootdev': bootnum}
 
-    def set_power(self, powerstate, wait=False):
+    def set_power(self, powerstate, wait=False, callback=None,
+                  callback_args=None):
         """Request power state change
 
         :param powerstate:
@@ -158,17 +292,40 @@ class Command(object):
         :param wait: If True, do not return until system actually completes
                      requested state change for 300 seconds.
                      If a non-zero number, adjust the wait time to the
-                     requested number of seconds
-        :returns: dict -- A dict describing the response retrieved
+                     requested number of seconds.  With a callback, nothing
+                     blocks and the callback gets the result once the state
+                     changes, so many BMCs can be waited on at once.  The
+                     state is polled, quickly at first and less often as the
+                     wait goes on, within a budget shared by every wait
+        :param callback: optional callback
+        :param callback_args: optional arguments to callback
+        :returns: dict or True -- If callback is not provided, a dict
+                  describing the response retrieved
         """
         if powerstate not in power_states:
             raise exc.InvalidParameterValue(
                 "Unknown power state %s requested" % powerstate)
+        if callback is not None:
+            request = {'handler': self._set_power_gotstate,
+                       'callback': callback, 'callback_args': callback_args,
+                       'powerstate': powerstate, 'wait': wait}
+            request['cachedpowerstate'] = self._cached_power()
+            if request['cachedpowerstate'] is not None:
+                result = self._set_power_gotstate(None, request)
+                if result is not None:
+                    session.call_with_optional_args(callback, result,
+                                                    callback_args)
+                return True
+            request['powergeneration'] = self.ipmi_session.powergeneration
+            return self._async_command(request, netfn=0, command=1)
         self.newpowerstate = powerstate
-        response = self.ipmi_session.raw_command(netfn=0, command=1)
-        if 'error' in response:
-            raise exc.IpmiException(response['error'])
-        self.powerstate = 'on' if (response['data'][0] & 1) else 'off'
+        self.powerstate = self._cached_power()
+        if self.powerstate is None:
+            generation = self.ipmi_session.powergeneration
+            response = self.ipmi_session.raw_command(netfn=0, command=1)
+            if 'error' in response:
+                raise exc.IpmiException(response['error'])
+            self.powerstate = self._read_power(response, generation)
         if self.powerstate == self.newpowerstate:
             return {'powerstate': self.powerstate}
         if self.newpowerstate == 'boot':
@@ -178,30 +335,99 @@ class Command(object):
         if 'error' in response:
             raise exc.IpmiException(response['error'])
         self.lastresponse = {'pendingpowerstate': self.newpowerstate}
-        waitattempts = 300
-        if not isinstance(wait, bool):
-            waitattempts = wait
         if (wait and
            self.newpowerstate in ('on', 'off', 'shutdown', 'softoff')):
             if self.newpowerstate in ('softoff', 'shutdown'):
                 self.waitpowerstate = 'off'
             else:
                 self.waitpowerstate = self.newpowerstate
-            currpowerstate = None
-            while currpowerstate != self.waitpowerstate and waitattempts > 0:
-                response = self.ipmi_session.raw_command(netfn=0, command=1,
-                                                         delay_xmit=1)
-                if 'error' in response:
-                    return response
-                currpowerstate = 'on' if (response['data'][0] & 1) else 'off'
-                waitattempts -= 1
-            if currpowerstate != self.waitpowerstate:
-                raise exc.IpmiException(
-                    "System did not accomplish power state change")
-            return {'powerstate': currpowerstate}
+            results = []
+            request = {'callback': results.append, 'callback_args': None}
+            self._wait_power(request, self.waitpowerstate, wait)
+            while not results:
+                session.Session.wait_for_rsp()
+            if request.get('timedout'):
+                raise exc.IpmiException(results[0]['error'])
+            return results[0]
         else:
             return self.lastresponse
 
+    def _set_power_gotstate(self, response, request):
+        if response is None:  # the power state last read will do
+            self.powerstate = request['cachedpowerstate']
+        elif 'error' in response:
+            return {'error': response['error']}
+        else:
+            self.powerstate = self._read_power(response,
+                                               request['powergeneration'])
+        newpowerstate = request['powerstate']
+        if self.powerstate == newpowerstate:
+            return {'powerstate': self.powerstate}
+        if newpowerstate == 'boot':
+            newpowerstate = 'on' if self.powerstate == 'off' else 'reset'
+            request['powerstate'] = newpowerstate
+        request['handler'] = self._set_power_requested
+        self._async_command(request, netfn=0, command=2,
+                            data=[power_states[newpowerstate]])
+
+    def _set_power_requested(self, response, request):
+        if 'error' in response:
+            return {'error': response['error']}
+        newpowerstate = request['powerstate']
+        wait = request['wait']
+        if not (wait and
+                newpowerstate in ('on', 'off', 'shutdown', 'softoff')):
+            return {'pendingpowerstate': newpowerstate}
+        if newpowerstate in ('softoff', 'shutdown'):
+            self._wait_power(request, 'off', wait)
+        else:
+            self._wait_power(request, newpowerstate, wait)
+
+    def _wait_power(self, request, waitpowerstate, wait):
+        """Poll the power state until it is waitpowerstate
+
+        The result goes to request's callback, with an error once wait
+        seconds, or 300 if wait is True, have gone by without it changing.
+        """
+        if isinstance(wait, bool):
+            wait = 300
+        request['handler'] = self._set_power_polled
+        request['waitpowerstate'] = waitpowerstate
+        request['waitdeadline'] = session._monotonic_time() + wait
+        request['polls'] = 0
+        self._schedule_power_poll(request)
+
+    def _schedule_power_poll(self, request):
+        interval = polling.backoff(request['polls'], self.powerpollinterval,
+                                   self.powerpollceiling)
+        request['polls'] += 1
+        when = Command.powerpollbudget.slot(session._monotonic_time() +
+                                            interval)
+        session.Session.timerheap.schedule(when, self._poll_power, request)
+
+    def _poll_power(self, request):
+        if self.ipmi_session.paced():
+            # try again shortly, without counting it as a poll
+            when = Command.powerpollbudget.slot(session._monotonic_time() +
+                                                0.1)
+            session.Session.timerheap.schedule(when, self._poll_power,
+                                               request)
+            return
+        request['powergeneration'] = self.ipmi_session.powergeneration
+        self._async_command(request, netfn=0, command=1)
+
+    def _set_power_polled(self, response, request):
+        if 'error' in response:
+            return response
+        currpowerstate = self._read_power(response,
+                                          request['powergeneration'])
+        if currpowerstate == request['waitpowerstate']:
+            return {'powerstate': currpowerstate}
+        if session._monotonic_time() >= request['waitdeadline']:
+            request['timedout'] = True
+            return {'error': "System did not accomplish power state change"}
+        self._schedule_power_poll(request)
+
     def set_bootdev(self,
                     bootdev,
                     persist=False,
@@ -230,15 +456,31 @@ class Command(object):
         :returns: dict or True -- If callback is not provided, the response
         """
 
-        self.commandcallback = callback
-        self.commandcallbackargs = callback_args
         if bootdev not in boot_devices:
-            return {'error': "Unknown bootdevice %s requested" % bootdev}
+            response = {'error': "Unknown bootdevice %s requested" % bootdev}
+            if callback is None:
+                return response
+            session.call_with_optional_args(callback, response, callback_args)
+            return True
         self.bootdev = boot_devices[bootdev]
         self.persistboot = persist
         self.uefiboot = uefiboot
+        bootflags = 0x80
+        if self.uefiboot:
+            bootflags = bootflags | 1 << 5
+        if self.persistboot:
+            bootflags = bootflags | 1 << 6
+        if self.bootdev == 0:
+            bootflags = 0
+        data = (5, bootflags, self.bootdev, 0, 0, 0)
         # first, we disable timer by way of set system boot options,
         # then move on to set chassis capabilities
+        if callback is not None:
+            request = {'handler': self._set_bootdev_timerdisabled,
+                       'callback': callback, 'callback_args': callback_args,
+                       'bootdev': bootdev, 'data': data}
+            return self._async_command(request, netfn=0, command=8,
+                                       data=(3, 8))
         self.requestpending = True
         # Set System Boot Options is netfn=0, command=8, data
         response = self.ipmi_session.raw_command(netfn=0, command=8,
@@ -246,20 +488,24 @@ class Command(object):
         self.lastresponse = response
         if 'error' in response:
             return response
-        bootflags = 0x80
-        if self.uefiboot:
-            bootflags = bootflags | 1 << 5
-        if self.persistboot:
-            bootflags = bootflags | 1 << 6
-        if self.bootdev == 0:
-            bootflags = 0
-        data = (5, bootflags, self.bootdev, 0, 0, 0)
         response = self.ipmi_session.raw_command(netfn=0, command=8, data=data)
         if 'error' in response:
             return response
         return {'bootdev': bootdev}
 
-    def raw_command(self, netfn, command, data=()):
+    def _set_bootdev_timerdisabled(self, response, request):
+        if 'error' in response:
+            return response
+        request['handler'] = self._set_bootdev_done
+        self._async_command(request, netfn=0, command=8, data=request['data'])
+
+    def _set_bootdev_done(self, response, request):
+        if 'error' in response:
+            return response
+        return {'bootdev': request['bootdev']}
+
+    def raw_command(self, netfn, command, data=(), callback=None,
+                    callback_args=None):
         """Send raw ipmi command to BMC
 
         This allows arbitrary IPMI bytes to be issued.  This is commonly used
@@ -270,22 +516,80 @@ class Command(object):
         :param netfn: Net function number
         :param command: Command value
         :param data: Command data as a tuple or list
-        :returns: dict -- The response from IPMI device
+        :param callback: optional callback
+        :param callback_args: optional arguments to callback
+        :returns: dict or True -- If callback is not provided, the response
+                  from IPMI device
         """
+        if callback is not None:
+            request = {'handler': self._got_raw, 'callback': callback,
+                       'callback_args': callback_args}
+            return self._async_command(request, netfn=netfn, command=command,
+                                       data=data)
         return self.ipmi_session.raw_command(netfn=netfn, command=command,
                                              data=data)
 
-    def get_power(self):
+    def _got_raw(self, response, request):
+        return response
+
+    def get_power(self, callback=None, callback_args=None):
         """Get current power state of the managed system
 
         The response, if successful, should contain 'powerstate' key and
         either 'on' or 'off' to indicate current state.
 
-        :returns: dict -- {'powerstate': value}
+        :param callback: optional callback
+        :param callback_args: optional arguments to callback
+        :returns: dict or True -- If callback is not provided,
+                  {'powerstate': value}
         """
+        powerstate = self._cached_power()
+        if powerstate is not None:
+            self.powerstate = powerstate
+            if callback is None:
+                return {'powerstate': powerstate}
+            session.call_with_optional_args(
+                callback, {'powerstate': powerstate}, callback_args)
+            return True
+        request = {'powergeneration': self.ipmi_session.powergeneration}
+        if callback is not None:
+            request.update({'handler': self._got_power, 'callback': callback,
+                            'callback_args': callback_args})
+            return self._async_command(request, netfn=0, command=1)
         response = self.ipmi_session.raw_command(netfn=0, command=1)
+        result = self._got_power(response, request)
+        if 'error' in result:
+            raise exc.IpmiException(result['error'])
+        return result
+
+    def _got_power(self, response, request):
         if 'error' in response:
-            raise exc.IpmiException(response['error'])
+            return {'error': response['error']}
         assert(response['command'] == 1 and response['netfn'] == 1)
-        self.powerstate = 'on' if (response['data'][0] & 1) else 'off'
+        self.powerstate = self._read_power(response,
+                                           request['powergeneration'])
         return {'powerstate': self.powerstate}
+
+    def _read_power(self, response, generation):
+        """Power state from a Get Chassis Status response, kept for reuse
+
+        :param generation: the power generation of the session when the
+                           request was sent, the state is not kept if a
+                           chassis control has been sent since
+        """
+        powerstate = 'on' if (response['data'][0] & 1) else 'off'
+        if generation == self.ipmi_session.powergeneration:
+            self.ipmi_session.powerstate = (powerstate,
+                                            session._monotonic_time())
+        return powerstate
+
+    def _cached_power(self):
+        """Power state last read, if it is recent enough to go by
+        """
+        if self.powerstatettl is None:
+            return None
+        cached = self.ipmi_session.powerstate
+        if (cached is None or
+                session._monotonic_time() - cached[1] > self.powerstatettl):
+            return None
+        return cached[0]
@@ -0,0 +1,242 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This represents operations on many BMCs at once
+
+import collections
+import functools
+import socket
+
+import pyghmi.exceptions as exc
+
+from pyghmi.ipmi import command
+from pyghmi.ipmi.private import session
+
+# what Fleet can run against its BMCs
+operations = ('get_power', 'set_power', 'get_bootdev', 'set_bootdev',
+              'raw_command')
+
+
+class _Sweep(object):
+    """An operation being run against every BMC of a fleet
+
+    BMCs are taken up as others finish, so that no more than the fleet's
+    concurrency are logging in or awaiting their result at once.  Iterating
+    over it yields (name, result) as results come in, the name being the
+    bmc, or (bmc, port) for nodes given a port.  Results not yet taken are
+    held to no more than the concurrency either, BMCs being taken up only
+    once there is room for their result.  BMCs are told apart by (bmc,
+    port) throughout, as several may share an address.
+    """
+
+    def __init__(self, fleet, operation, args, kwargs):
+        self.fleet = fleet
+        self.operation = operation
+        self.args = args
+        self.kwargs = kwargs
+        self.nodes = iter(fleet.nodes)
+        self.exhausted = False
+        # (bmc, port) of BMCs under way, to the timer of their deadline if
+        # they have one, and to the name their result goes by
+        self.running = {}
+        self.names = {}
+        # (name, result) in the order they came in, until taken
+        self.finished = collections.deque()
+        self.starting = False
+
+    def __iter__(self):
+        try:
+            self._start_next()
+            while self.running or self.finished:
+                if not self.finished:
+                    session.Session.wait_for_rsp(timeout=1)
+                while self.finished:
+                    yield self.finished.popleft()
+                    self._start_next()
+        finally:
+            # given up on by the caller, take up no more BMCs
+            self.exhausted = True
+
+    def _start_next(self):
+        if self.starting:  # a BMC started below finished straight away
+            return
+        self.starting = True
+        try:
+            while (not self.exhausted and
+                   len(self.running) < self.fleet.concurrency and
+                   len(self.finished) < self.fleet.concurrency):
+                try:
+                    node = next(self.nodes)
+                except StopIteration:
+                    self.exhausted = True
+                    break
+                self._start(*node)
+        finally:
+            self.starting = False
+
+    def _start(self, bmc, userid, password, port=None):
+        name = bmc
+        if port is None:
+            port = self.fleet.port
+        else:
+            name = (bmc, port)
+        target = (bmc, port)
+        timer = None
+        if self.fleet.deadline is not None:
+            timer = session.Session.timerheap.schedule(
+                session._monotonic_time() + self.fleet.deadline,
+                self._expired, target)
+        self.running[target] = timer
+        self.names[target] = name
+        ipmicmd = self.fleet.commands.get(target)
+        if ipmicmd is not None:
+            return self._issue(target, ipmicmd)
+        try:
+            command.Command(bmc, userid, password, port=port,
+                            onlogon=functools.partial(self._logged,
+                                                      target=target),
+                            kg=self.fleet.kg)
+        except (socket.error, exc.IpmiException) as error:
+            # an address that does not resolve, for one, fails this BMC
+            # alone
+            self._finish({'error': str(error)}, target)
+
+    def _logged(self, response, ipmicmd, target):
+        if 'error' in response:
+            return self._finish(response, target)
+        self.fleet.commands[target] = ipmicmd
+        if target in self.running:  # not given up on in the meantime
+            self._issue(target, ipmicmd)
+
+    def _issue(self, target, ipmicmd):
+        getattr(ipmicmd, self.operation)(*self.args, callback=self._finish,
+                                         callback_args=target, **self.kwargs)
+
+    def _expired(self, target):
+        self.running[target] = None
+        self._finish({'error': 'timeout'}, target)
+
+    def _finish(self, result, target):
+        if target not in self.running:  # came in after its deadline
+            return
+        timer = self.running.pop(target)
+        if timer is not None:
+            session.Session.timerheap.cancel(timer)
+        self.finished.append((self.names.pop(target), result))
+        self._start_next()
+
+
+class Fleet(object):
+    """Run the same operation against many BMCs at once
+
+    Each method returns once every BMC has come through, with a dict of
+    BMC to what the Command method of the same name would have returned,
+    or to a dict with an 'error' key if it failed.  BMCs given a port in
+    nodes go by (bmc, port) instead, so that several may share an address.
+    as_completed instead yields each result as it comes in.  Everything goes
+    through the event loop shared by all sessions, so other sessions carry
+    on meanwhile.  Sessions are set up as BMCs are first taken up and kept for
+    the operations after.
+
+    :param nodes: iterable of (bmc, userid, password) tuples, or of
+                  (bmc, userid, password, port), each BMC and port
+                  appearing once
+    :param concurrency: most BMCs to have logging in or awaiting a result
+                        at once
+    :param deadline: seconds each BMC has, from being taken up to its
+                     result, before it is given up on with a 'timeout'
+                     error.  None leaves it to the retries of the session
+    :param port: port of the BMCs not given one
+    :param kg: Optional parameter to use if BMCs have a particular Kg
+               configured
+    """
+
+    def __init__(self, nodes, concurrency=256, deadline=None, port=623,
+                 kg=None):
+        self.nodes = list(nodes)
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.port = port
+        self.kg = kg
+        # logged in Commands by (bmc, port)
+        self.commands = {}
+
+    def as_completed(self, operation, *args, **kwargs):
+        """Run an operation against every BMC, yielding results as they come
+
+        Yields (name, result) in the order results come in, rather than
+        waiting on the slowest BMC, so they can be dealt with as the sweep
+        goes on.  BMCs keep being taken up while results are dealt with, but
+        not while as many results as the concurrency wait to be taken.
+
+        :param operation: name of the method of this class to run, such as
+                          'get_power'
+        :param args: positional arguments of the method
+        :param kwargs: keyword arguments of the method
+        :returns: iterator of (name, result) tuples, name being the bmc or
+                  (bmc, port) for nodes given a port
+        """
+        if operation not in operations:
+            raise exc.InvalidParameterValue(
+                "Unknown operation %s requested" % operation)
+        if operation == 'set_power':
+            powerstate = args[0] if args else kwargs.get('powerstate')
+            if powerstate not in command.power_states:
+                raise exc.InvalidParameterValue(
+                    "Unknown power state %s requested" % powerstate)
+        return iter(_Sweep(self, operation, args, kwargs))
+
+    def _sweep(self, operation, *args, **kwargs):
+        return dict(self.as_completed(operation, *args, **kwargs))
+
+    def get_power(self):
+        """Get the current power state of every BMC
+
+        :returns: dict of BMC to {'powerstate': value}
+        """
+        return self._sweep('get_power')
+
+    def set_power(self, powerstate, wait=False):
+        """Request a power state change of every BMC
+
+        See Command.set_power for the states and wait.
+
+        :returns: dict of BMC to the result of Command.set_power
+        """
+        return self._sweep('set_power', powerstate, wait=wait)
+
+    def get_bootdev(self):
+        """Get the boot device override of every BMC
+
+        :returns: dict of BMC to {'bootdev': value}
+        """
+        return self._sweep('get_bootdev')
+
+    def set_bootdev(self, bootdev, persist=False, uefiboot=False):
+        """Set the boot device of every BMC
+
+        See Command.set_bootdev for the devices, persist and uefiboot.
+
+        :returns: dict of BMC to {'bootdev': value}
+        """
+        return self._sweep('set_bootdev', bootdev, persist=persist,
+                           uefiboot=uefiboot)
+
+    def raw_command(self, netfn, command, data=()):
+        """Send the same raw IPMI command to every BMC
+
+        :returns: dict of BMC to the response, as from Command.raw_command
+        """
+        return self._sweep('raw_command', netfn, command, data=data)
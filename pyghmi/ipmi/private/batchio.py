@@ -0,0 +1,334 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides batched datagram I/O for the session socket
+
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+_libc = None
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                               ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _libc.recvmmsg.restype = ctypes.c_int
+    _libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                               ctypes.c_uint, ctypes.c_int]
+    _libc.sendmmsg.restype = ctypes.c_int
+except (AttributeError, OSError, TypeError):
+    pass
+
+_SOCKADDR_IN6_LEN = 28
+_MSG_DONTWAIT = 0x40
+# port, flow info and address are in network order, scope id is not
+_sockaddr_in6 = struct.Struct('!2xHI16s')
+_uint = struct.Struct('=I')
+_family = struct.Struct('=H')
+_sizet = struct.Struct('@' + {4: 'I', 8: 'Q'}[ctypes.sizeof(ctypes.c_size_t)])
+_pointer = struct.Struct('@P')
+
+
+def _decode_sockaddr(rawaddr):
+    """Turn a struct sockaddr_in6 into the tuple recvfrom would return
+    """
+    port, flowinfo, addr = _sockaddr_in6.unpack_from(rawaddr)
+    scopeid = _uint.unpack_from(rawaddr, 24)[0]
+    host = socket.inet_ntop(socket.AF_INET6, addr)
+    if scopeid:  # let the resolver library render the interface name
+        host = socket.getnameinfo((host, port, flowinfo, scopeid),
+                                  socket.NI_NUMERICHOST)[0]
+    return (host, port, flowinfo, scopeid)
+
+
+def _encode_sockaddr(sockaddr):
+    """Turn an AF_INET6 address tuple into a struct sockaddr_in6
+    """
+    host, port, flowinfo, scopeid = sockaddr
+    addr = socket.inet_pton(socket.AF_INET6, host.partition('%')[0])
+    return (_family.pack(socket.AF_INET6) +
+            _sockaddr_in6.pack(port, flowinfo, addr)[2:] +
+            _uint.pack(scopeid))
+
+
+class RecvIntoReceiver(object):
+    """Portable receiver reading into preallocated buffers
+
+    This calls recvfrom_into once per datagram, but still avoids allocating
+    a new string for each of them.
+
+    :param sock: non-blocking datagram socket to read from
+    :param batchsize: maximum number of datagrams to return per call
+    :param bufsize: largest datagram that will be accepted
+    """
+
+    def __init__(self, sock, batchsize=64, bufsize=3000):
+        self.socket = sock
+        self.batchsize = batchsize
+        self.bufsize = bufsize
+        self.buffer = bytearray(batchsize * bufsize)
+        view = memoryview(self.buffer)
+        self.slots = [view[idx * bufsize:(idx + 1) * bufsize]
+                      for idx in range(batchsize)]
+
+    def recv(self):
+        """Read up to batchsize datagrams that are waiting on the socket
+
+        The data comes back as memoryview slices of buffers that are reused
+        by the next call, so callers must be done with them by then.
+
+        :returns: list of (memoryview, sockaddr) tuples, empty when the
+                  socket had nothing to offer
+        """
+        pktqueue = []
+        for slot in self.slots:
+            try:
+                size, sockaddr = self.socket.recvfrom_into(slot, self.bufsize)
+            except socket.error as err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                # EAGAIN is the normal end of the queue, any other error
+                # will be retried on the next pass of the event loop
+                break
+            pktqueue.append((slot[:size], sockaddr))
+        return pktqueue
+
+
+class MmsgReceiver(RecvIntoReceiver):
+    """Linux receiver pulling a whole batch per system call with recvmmsg
+    """
+
+    def __init__(self, sock, batchsize=64, bufsize=3000):
+        super(MmsgReceiver, self).__init__(sock, batchsize, bufsize)
+        self.fd = sock.fileno()
+        self.names = ctypes.create_string_buffer(
+            batchsize * _SOCKADDR_IN6_LEN)
+        self.iovecs = (_iovec * batchsize)()
+        self.msgs = (_mmsghdr * batchsize)()
+        bufaddr = ctypes.addressof(
+            (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer))
+        nameaddr = ctypes.addressof(self.names)
+        for idx in range(batchsize):
+            self.iovecs[idx].iov_base = bufaddr + idx * bufsize
+            self.iovecs[idx].iov_len = bufsize
+            hdr = self.msgs[idx].msg_hdr
+            hdr.msg_name = nameaddr + idx * _SOCKADDR_IN6_LEN
+            hdr.msg_iov = ctypes.pointer(self.iovecs[idx])
+            hdr.msg_iovlen = 1
+            hdr.msg_namelen = _SOCKADDR_IN6_LEN
+        # going through ctypes attributes for every datagram is slow, so the
+        # lengths the kernel fills in are read straight out of the array
+        self.msgsview = memoryview(
+            (ctypes.c_char * ctypes.sizeof(self.msgs)).from_buffer(self.msgs))
+        self.lenoffsets = [idx * ctypes.sizeof(_mmsghdr) +
+                           _mmsghdr.msg_len.offset
+                           for idx in range(batchsize)]
+        self.nameoffsets = [idx * ctypes.sizeof(_mmsghdr) +
+                            _msghdr.msg_namelen.offset
+                            for idx in range(batchsize)]
+        # converting addresses is the most expensive part of a datagram that
+        # has been read, and the same few BMCs keep answering
+        self.addrcache = {}
+
+    def recv(self):
+        count = _libc.recvmmsg(self.fd, self.msgs, self.batchsize,
+                               _MSG_DONTWAIT, None)
+        if count <= 0:
+            return []
+        pktqueue = []
+        names = self.names.raw
+        addrcache = self.addrcache
+        msgsview = self.msgsview
+        for idx in range(count):
+            offset = idx * _SOCKADDR_IN6_LEN
+            rawaddr = names[offset:offset + _SOCKADDR_IN6_LEN]
+            try:
+                sockaddr = addrcache[rawaddr]
+            except KeyError:
+                if len(addrcache) > 65536:
+                    addrcache.clear()
+                sockaddr = _decode_sockaddr(rawaddr)
+                addrcache[rawaddr] = sockaddr
+            size = _uint.unpack_from(msgsview, self.lenoffsets[idx])[0]
+            # msg_namelen is updated by the kernel, restore it for next time
+            _uint.pack_into(msgsview, self.nameoffsets[idx],
+                            _SOCKADDR_IN6_LEN)
+            pktqueue.append((self.slots[idx][:size], sockaddr))
+        return pktqueue
+
+
+class SendtoSender(object):
+    """Portable sender transmitting a queue of datagrams with sendto
+
+    Datagrams that can not be sent are dropped, like packets lost on the wire
+    they are left to the retry logic of their sessions.
+
+    :param sock: non-blocking datagram socket to send with
+    """
+
+    def __init__(self, sock, batchsize=64, bufsize=3000):
+        self.socket = sock
+
+    def send(self, pktqueue):
+        """Send every (data, sockaddr) in pktqueue
+
+        :returns: number of datagrams handed to the kernel
+        """
+        sent = 0
+        for data, sockaddr in pktqueue:
+            try:
+                self.socket.sendto(data, sockaddr)
+                sent += 1
+            except socket.error as err:
+                if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break  # the send buffer is full, do not keep trying
+        return sent
+
+
+class MmsgSender(SendtoSender):
+    """Linux sender handing a whole batch to the kernel with sendmmsg
+    """
+
+    def __init__(self, sock, batchsize=64, bufsize=3000):
+        super(MmsgSender, self).__init__(sock)
+        self.fd = sock.fileno()
+        self.batchsize = batchsize
+        self.bufsize = bufsize
+        self.buffer = bytearray(batchsize * bufsize)
+        self.iovecs = (_iovec * batchsize)()
+        self.msgs = (_mmsghdr * batchsize)()
+        bufaddr = ctypes.addressof(
+            (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer))
+        for idx in range(batchsize):
+            self.iovecs[idx].iov_base = bufaddr + idx * bufsize
+            hdr = self.msgs[idx].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self.iovecs[idx])
+            hdr.msg_iovlen = 1
+            hdr.msg_namelen = _SOCKADDR_IN6_LEN
+        # as with receiving, per datagram fields are written straight into
+        # the arrays rather than through ctypes attributes
+        self.iovview = memoryview(
+            (ctypes.c_char * ctypes.sizeof(self.iovecs)).from_buffer(
+                self.iovecs))
+        self.msgsview = memoryview(
+            (ctypes.c_char * ctypes.sizeof(self.msgs)).from_buffer(self.msgs))
+        self.lenoffsets = [idx * ctypes.sizeof(_iovec) +
+                           _iovec.iov_len.offset
+                           for idx in range(batchsize)]
+        self.nameoffsets = [idx * ctypes.sizeof(_mmsghdr) +
+                            _msghdr.msg_name.offset
+                            for idx in range(batchsize)]
+        # where the encoded form of each address tuple lives, the encoded
+        # addresses themselves are kept alive in rawaddrs
+        self.addrcache = {}
+        self.rawaddrs = []
+
+    def _nameaddr(self, sockaddr):
+        rawaddr = ctypes.create_string_buffer(_encode_sockaddr(sockaddr),
+                                              _SOCKADDR_IN6_LEN)
+        self.rawaddrs.append(rawaddr)
+        self.addrcache[sockaddr] = ctypes.addressof(rawaddr)
+        return self.addrcache[sockaddr]
+
+    def send(self, pktqueue):
+        handed = 0
+        position = 0
+        total = len(pktqueue)
+        buf = self.buffer
+        bufsize = self.bufsize
+        iovview = self.iovview
+        msgsview = self.msgsview
+        if len(self.addrcache) > 65536:  # never while a batch refers to them
+            self.addrcache.clear()
+            self.rawaddrs = []
+        addrcache = self.addrcache
+        while position < total:
+            count = 0
+            offset = 0
+            end = min(position + self.batchsize, total)
+            for idx in xrange(position, end):
+                data, sockaddr = pktqueue[idx]
+                size = len(data)
+                if size > bufsize:  # will not fit in our buffers
+                    break
+                buf[offset:offset + size] = data
+                _sizet.pack_into(iovview, self.lenoffsets[count], size)
+                try:
+                    nameaddr = addrcache[sockaddr]
+                except KeyError:
+                    nameaddr = self._nameaddr(sockaddr)
+                _pointer.pack_into(msgsview, self.nameoffsets[count],
+                                   nameaddr)
+                count += 1
+                offset += bufsize
+            if count == 0:  # an oversized datagram, let sendto sort it out
+                handed += super(MmsgSender, self).send(
+                    pktqueue[position:position + 1])
+                position += 1
+                continue
+            sent = _libc.sendmmsg(self.fd, self.msgs, count, _MSG_DONTWAIT)
+            if sent < 0:
+                if ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break  # the send buffer is full, do not keep trying
+                # the first datagram was refused, drop it and move on
+                sent = 0
+                position += 1
+            handed += sent
+            position += sent
+        return handed
+
+
+def get_sender(sock, batchsize=64, bufsize=3000):
+    """Return the most efficient batch sender usable with sock
+    """
+    if (_libc is not None and hasattr(_libc, 'sendmmsg') and
+            sock.family == socket.AF_INET6):
+        return MmsgSender(sock, batchsize, bufsize)
+    return SendtoSender(sock, batchsize, bufsize)
+
+
+def get_receiver(sock, batchsize=64, bufsize=3000):
+    """Return the most efficient batch receiver usable with sock
+
+    recvmmsg is used when the C library offers it and the socket is
+    AF_INET6, as the session socket is.
+    """
+    if (_libc is not None and hasattr(_libc, 'recvmmsg') and
+            sock.family == socket.AF_INET6):
+        return MmsgReceiver(sock, batchsize, bufsize)
+    return RecvIntoReceiver(sock, batchsize, bufsize)
@@ -0,0 +1,108 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the cache of what BMCs are capable of
+#
+# Get Channel Authentication Capabilities costs a round trip at the start of
+# every login, and a second one for BMCs that balk at the IPMI 2.0 form of
+# it, to learn what does not change from one login to the next.  What was
+# learned is kept here, by BMC, and may be saved to a file to outlive the
+# process.
+
+import json
+import os
+import time
+
+
+class CapabilityCache(object):
+    """IPMI version, quirks, channel and cipher suite of BMCs
+
+    Entries are dicts with ipmiversion, ipmi15only, channel and
+    ciphersuites keys, the latter listing the cipher suites logins were
+    seen to settle on, empty for IPMI 1.5.
+
+    :param path: file to load entries from and save them to, if any
+    :param saveinterval: seconds to let pass at least between saves as
+                         entries change, save is called on exit regardless
+    :param clock: function returning the current time in seconds
+    """
+
+    def __init__(self, path=None, saveinterval=60, clock=time.time):
+        self.path = path
+        self.saveinterval = saveinterval
+        self.clock = clock
+        self.entries = {}
+        self.dirty = False
+        self.lastsave = clock()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def _key(host, port):
+        # saved as JSON, so a string, with IPv6 addresses bracketed for the
+        # port to be told apart from them
+        if ':' in host:
+            return '[%s]:%d' % (host, port)
+        return '%s:%d' % (host, port)
+
+    def get(self, host, port):
+        """Return the entry for a BMC, or None if nothing is known of it
+        """
+        return self.entries.get(self._key(host, port))
+
+    def record(self, host, port, ipmiversion, ipmi15only, channel,
+               ciphersuites=()):
+        entry = {
+            'ipmiversion': ipmiversion,
+            'ipmi15only': ipmi15only,
+            'channel': channel,
+            'ciphersuites': list(ciphersuites),
+        }
+        key = self._key(host, port)
+        if self.entries.get(key) == entry:
+            return
+        self.entries[key] = entry
+        self._changed()
+
+    def forget(self, host, port):
+        """Drop the entry of a BMC, for what it said no longer holds
+        """
+        if self.entries.pop(self._key(host, port), None) is not None:
+            self._changed()
+
+    def _changed(self):
+        self.dirty = True
+        if (self.path is not None and
+                self.clock() - self.lastsave >= self.saveinterval):
+            self.save()
+
+    def load(self):
+        with open(self.path) as cachefile:
+            self.entries.update(json.load(cachefile))
+
+    def save(self):
+        """Write the entries out to the file, if there is one and they changed
+
+        The file is replaced as a whole, so a reader never sees it half
+        written.
+        """
+        if self.path is None or not self.dirty:
+            return
+        tmppath = '%s.%d' % (self.path, os.getpid())
+        with open(tmppath, 'w') as cachefile:
+            json.dump(self.entries, cachefile)
+        os.rename(tmppath, self.path)
+        self.dirty = False
+        self.lastsave = self.clock()
@@ -0,0 +1,159 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the wire framing of IPMI 1.5 and RMCP+ packets
+#
+# Packets are put together from strings produced by precompiled structs and
+# taken apart by unpacking from the received buffer in place, so no Python
+# object is made per byte of a packet.  Payloads may be given as str,
+# bytearray or a sequence of ints.
+
+import hashlib
+import struct
+
+rmcp_header = '\x06\x00\xff\x07'  # constant RMCP header for IPMI
+# authtype, session sequence number, session id
+ipmi15_header = struct.Struct('<BII')
+# authtype, payload type, session id, session sequence number, payload length
+ipmi20_header = struct.Struct('<BBIIH')
+uint32 = struct.Struct('<I')
+
+# pad as specified in table 13-20, AES-CBC encrypted payload fields: 1, 2,
+# 3, ... followed by the pad length, to make a multiple of 16 bytes
+_aespads = [''.join(chr(x) for x in range(1, padlen + 1)) + chr(padlen)
+            for padlen in range(16)]
+# legacy pad as mandated by ipmi spec for IPMI 1.5 packets of these lengths
+_legacypadlengths = (56, 84, 112, 128, 156)
+
+
+def tobytes(payload):
+    """Return payload as a str
+    """
+    if isinstance(payload, str):
+        return payload
+    if isinstance(payload, memoryview):
+        return payload.tobytes()
+    if isinstance(payload, bytearray):
+        return str(payload)
+    return str(bytearray(payload))
+
+
+def aespad(payload):
+    """Pad payload to be encrypted per table 13-20
+    """
+    neededpad = (len(payload) + 1) % 16
+    if neededpad:
+        neededpad = 16 - neededpad
+    return payload + _aespads[neededpad]
+
+
+def ipmi15_authcode(password, sessionid, seqnumber, payload):
+    """MD5 authcode of an IPMI 1.5 packet
+
+    :param password: password padded out to 16 bytes
+    """
+    sessionid = uint32.pack(sessionid)
+    seqnumber = uint32.pack(seqnumber)
+    return hashlib.md5(
+        password + sessionid + tobytes(payload) + seqnumber + password
+    ).digest()
+
+
+def encode_ipmi15(authtype, seqnumber, sessionid, payload, authcode=''):
+    payload = tobytes(payload)
+    packet = (rmcp_header +
+              ipmi15_header.pack(authtype, seqnumber, sessionid) +
+              authcode + chr(len(payload)) + payload)
+    # Guessing the ipmi spec means the whole packet and assume no tag in old
+    # 1.5 world
+    if 34 + len(packet) in _legacypadlengths:
+        packet += '\x00'
+    return packet
+
+
+def encode_rmcpplus(payload_type, sessionid, seqnumber, payload,
+                    integrity=None, confidentiality=None):
+    """Frame an RMCP+ packet
+
+    :param integrity: context from pyghmi.ipmi.private.cryptobackend to sign
+                      the packet with HMAC-SHA1-96, if any
+    :param confidentiality: context to encrypt the payload with
+                            AES-CBC-128, if any
+    """
+    payload = tobytes(payload)
+    if confidentiality is not None:
+        payload_type |= 0b10000000
+        payload = confidentiality.encrypt(aespad(payload))
+    if integrity is not None:
+        payload_type |= 0b01000000
+    packet = (rmcp_header +
+              ipmi20_header.pack(6, payload_type, sessionid, seqnumber,
+                                 len(payload)) +
+              payload)
+    if integrity is not None:  # see table 13-8, RMCP+ packet format
+        # TODO(jbjohnso): SHA256 which is now allowed
+        neededpad = (len(packet) - 2) % 4
+        if neededpad:
+            neededpad = 4 - neededpad
+        # 7 is the reserved next header value required by the specification
+        packet += '\xff' * neededpad + chr(neededpad) + '\x07'
+        # SHA1-96 per RFC2404 truncates to 96 bits
+        packet += integrity.authcode(packet[4:])
+    return packet
+
+
+def decode_ipmi15(data):
+    """Split a received IPMI 1.5 packet into its fields
+
+    :returns: tuple of authtype, sequence number, session id, authcode
+              (or None) and the payload as a slice of data
+    """
+    authtype, seqnumber, sessionid = ipmi15_header.unpack_from(data, 4)
+    offset = 13
+    authcode = None
+    if authtype != 0:  # we have authcode in this ipmi 1.5 packet
+        authcode = data[13:29]
+        offset = 29
+    psize = ord(data[offset])
+    return (authtype, seqnumber, sessionid, authcode,
+            data[offset + 1:offset + 1 + psize])
+
+
+def decode_rmcpplus(data):
+    """Split a received RMCP+ packet into its fields
+
+    :returns: tuple of payload type (with the authenticated and encrypted
+              bits), session id, sequence number and the payload as a slice
+              of data
+    """
+    _, payload_type, sessionid, seqnumber, psize = \
+        ipmi20_header.unpack_from(data, 4)
+    return payload_type, sessionid, seqnumber, data[16:16 + psize]
+
+
+def rmcpplus_authentic(data, integrity):
+    """Check the HMAC-SHA1-96 trailing a received RMCP+ packet
+    """
+    return data[-12:] == integrity.authcode(tobytes(data[4:-12]))
+
+
+def decrypt_payload(payload, confidentiality):
+    """Decrypt an AES-CBC-128 payload and strip its pad
+
+    :returns: bytearray of the plaintext payload
+    """
+    decrypted = confidentiality.decrypt(tobytes(payload))
+    padsize = ord(decrypted[-1]) + 1
+    return bytearray(decrypted[:-padsize])
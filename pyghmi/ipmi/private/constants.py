@@ -48,6 +48,40 @@ rmcp_codes = {
     0x12: "Illegal or unrecognized parameter",
 }
 
+# answers to a login meaning the BMC is out of session slots or too busy for
+# now, rather than turning us away for good
+rmcp_busy_codes = (1, 0xb)
+# by command, 0x81 to activate session being "No available login slots"
+login_busy_codes = {
+    0x38: (0xc0,),
+    0x39: (0xc0,),
+    0x3a: (0x81, 0xc0),
+    0x3b: (0xc0,),
+}
+
+# cipher suite ids by the authentication, integrity and confidentiality
+# algorithms they are made of, table 22-20
+cipher_suites = {
+    (0, 0, 0): 0,
+    (1, 0, 0): 1,
+    (1, 1, 0): 2,
+    (1, 1, 1): 3,
+    (1, 1, 2): 4,
+    (1, 1, 3): 5,
+    (2, 0, 0): 6,
+    (2, 2, 0): 7,
+    (2, 2, 1): 8,
+    (2, 2, 2): 9,
+    (2, 2, 3): 10,
+    (2, 3, 0): 11,
+    (2, 3, 1): 12,
+    (2, 3, 2): 13,
+    (2, 3, 3): 14,
+    (3, 0, 0): 15,
+    (3, 4, 0): 16,
+    (3, 4, 1): 17,
+}
+
 netfn_codes = {
     "chassis": 0x0,
     "bridge": 0x2,
@@ -0,0 +1,157 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the per packet cryptography of established RMCP+ sessions
+#
+# A backend hands out an integrity context for K1 and a confidentiality
+# context for the AES key once a session is established.  The contexts do the
+# keyed setup a single time, so that each packet only pays for hashing and
+# encrypting its own bytes.
+#
+# An integrity context has authcode(data), returning the HMAC-SHA1-96 of data.
+# A confidentiality context has encrypt(payload), returning the IV followed by
+# the AES-CBC-128 encrypted payload, and decrypt(payload) undoing that.  The
+# payload handed to either is a multiple of 16 bytes long.  Contexts carry
+# chaining state and are not to be shared between threads.
+
+import hashlib
+import hmac
+import os
+
+from Crypto.Cipher import AES
+
+try:
+    from cryptography.hazmat import backends as cryptobackends
+    from cryptography.hazmat.primitives import ciphers
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives import hmac as cryptohmac
+except ImportError:
+    cryptobackends = None
+
+_zeroiv = '\x00' * 16
+
+
+class _HmacSha1(object):
+    """HMAC-SHA1-96 with the keyed inner and outer hashes done up front
+    """
+
+    def __init__(self, key):
+        self.keyed = hmac.new(key, digestmod=hashlib.sha1)
+
+    def authcode(self, data):
+        digest = self.keyed.copy()
+        digest.update(data)
+        return digest.digest()[:12]
+
+
+class _PyCryptoAesCbc(object):
+    """AES-CBC-128 with the key schedule expanded once
+
+    pycrypto can not rewind a CBC object to a new IV, so rather than building
+    a cipher per packet each direction keeps running a single one.  A random
+    block is encrypted ahead of the payload, the result being as unpredictable
+    an IV as the random block itself.  On the way in, the block decrypted with
+    whatever the chaining state was left at is dropped, after which the
+    ciphertext chains from the IV of the packet.
+    """
+
+    def __init__(self, key):
+        self.encrypter = AES.new(key, AES.MODE_CBC, _zeroiv)
+        self.decrypter = AES.new(key, AES.MODE_CBC, _zeroiv)
+
+    def encrypt(self, payload):
+        return self.encrypter.encrypt(os.urandom(16) + payload)
+
+    def decrypt(self, payload):
+        return self.decrypter.decrypt(payload)[16:]
+
+
+class PyCryptoBackend(object):
+    """Backend on top of pycrypto, with HMAC done by hashlib
+
+    pycrypto HMAC runs in Python around the hash, hashlib gets the same
+    result for a fraction of the cost.
+    """
+
+    name = 'pycrypto'
+
+    def integrity(self, key):
+        return _HmacSha1(key)
+
+    def confidentiality(self, key):
+        return _PyCryptoAesCbc(key)
+
+
+class _CryptographyHmacSha1(object):
+    def __init__(self, key):
+        self.keyed = cryptohmac.HMAC(key, hashes.SHA1(),
+                                     backend=cryptobackends.default_backend())
+
+    def authcode(self, data):
+        digest = self.keyed.copy()
+        digest.update(data)
+        return digest.finalize()[:12]
+
+
+class _CryptographyAesCbc(object):
+    """AES-CBC-128 through OpenSSL, run the same way as _PyCryptoAesCbc
+    """
+
+    def __init__(self, key):
+        cipher = ciphers.Cipher(ciphers.algorithms.AES(key),
+                                ciphers.modes.CBC(_zeroiv),
+                                backend=cryptobackends.default_backend())
+        self.encrypter = cipher.encryptor()
+        self.decrypter = cipher.decryptor()
+
+    def encrypt(self, payload):
+        return self.encrypter.update(os.urandom(16) + payload)
+
+    def decrypt(self, payload):
+        return self.decrypter.update(payload)[16:]
+
+
+class CryptographyBackend(object):
+    """Backend on top of the cryptography package, if it is installed
+    """
+
+    name = 'cryptography'
+
+    def __init__(self):
+        if cryptobackends is None:
+            raise ImportError('cryptography is not installed')
+
+    def integrity(self, key):
+        return _CryptographyHmacSha1(key)
+
+    def confidentiality(self, key):
+        return _CryptographyAesCbc(key)
+
+
+def get_backends():
+    """Return instances of every backend usable in this environment
+    """
+    backends = [PyCryptoBackend()]
+    if cryptobackends is not None:
+        backends.append(CryptographyBackend())
+    return backends
+
+
+def get_backend():
+    """Return an instance of the default backend
+
+    That is the one on top of pycrypto, which pyghmi requires anyway.
+    """
+    return PyCryptoBackend()
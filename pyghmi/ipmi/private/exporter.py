@@ -0,0 +1,212 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides an HTTP endpoint serving session metrics to Prometheus
+#
+# The listening socket and its connections are watched by the session event
+# loop, through register_handle_callback, and never block: requests are read
+# as they come in, and answers too large for the socket buffer are sent the
+# rest of the way from timers.  Rates are left to Prometheus to work out from
+# the counters.
+
+import errno
+import socket
+
+from pyghmi.ipmi.private import session
+
+# longest a request may take to come in, and its answer to go out
+_connectiontimeout = 10
+# how soon to try again sending an answer the socket buffer had no room for
+_sendretry = 0.01
+_notfound = ('HTTP/1.0 404 Not Found\r\nContent-Type: text/plain\r\n'
+             'Content-Length: 10\r\nConnection: close\r\n\r\nnot found\n')
+
+
+def _histogram(lines, name, text, histogram):
+    lines.append('# HELP %s %s' % (name, text))
+    lines.append('# TYPE %s histogram' % name)
+    for bound, count in histogram['buckets']:
+        if bound == float('inf'):
+            bound = '+Inf'
+        lines.append('%s_bucket{le="%s"} %d' % (name, bound, count))
+    lines.append('%s_sum %r' % (name, histogram['sum']))
+    lines.append('%s_count %d' % (name, histogram['count']))
+
+
+def _metric(lines, name, kind, text, samples):
+    lines.append('# HELP %s %s' % (name, text))
+    lines.append('# TYPE %s %s' % (name, kind))
+    for labels, value in samples:
+        lines.append('%s%s %s' % (name, labels, value))
+
+
+def render():
+    """The state of the session layer in Prometheus text format
+    """
+    snapshot = session.Session.get_metrics(perbmc=False)
+    scope = session.Session.pacer.globalscope
+    logins = session.Session.loginscheduler.state()
+    lines = []
+    _metric(lines, 'pyghmi_sessions', 'gauge', 'Sessions logged in',
+            [('', len(session.Session.sessionpool))])
+    _metric(lines, 'pyghmi_packets_inflight', 'gauge',
+            'Requests awaiting an answer', [('', scope.inflight)])
+    _metric(lines, 'pyghmi_packets_inflight_limit', 'gauge',
+            'Requests allowed to await an answer at once, maxpending',
+            [('', session.Session.maxpending)])
+    _metric(lines, 'pyghmi_packets_inflight_window', 'gauge',
+            'Requests allowed to await an answer as of recent losses',
+            [('', int(scope.window))])
+    _metric(lines, 'pyghmi_commands_total', 'counter', 'Commands answered',
+            [('', snapshot['commands'])])
+    _metric(lines, 'pyghmi_retransmits_total', 'counter',
+            'Packets sent again for want of an answer',
+            [('', snapshot['retries'])])
+    _metric(lines, 'pyghmi_timeouts_total', 'counter',
+            'Commands given up on for want of an answer',
+            [('', snapshot['timeouts'])])
+    _metric(lines, 'pyghmi_dropped_packets_total', 'counter',
+            'Packets received and thrown away',
+            [('{reason="%s"}' % reason, count)
+             for reason, count in sorted(snapshot['drops'].items())])
+    _metric(lines, 'pyghmi_login_attempts_total', 'counter',
+            'Logins started', [('', snapshot['loginattempts'])])
+    _metric(lines, 'pyghmi_logins_total', 'counter', 'Logins come to an end',
+            [('{result="success"}', snapshot['logins']),
+             ('{result="failure"}', snapshot['loginfailures'])])
+    _metric(lines, 'pyghmi_logins_active', 'gauge', 'Logins under way',
+            [('', logins['active'])])
+    _metric(lines, 'pyghmi_logins_queued', 'gauge',
+            'Logins waiting to start or to be retried',
+            [('', logins['queued'] + logins['backingoff'])])
+    _histogram(lines, 'pyghmi_command_latency_seconds',
+               'Time from first sending a command to its answer',
+               snapshot['commandlatency'])
+    _histogram(lines, 'pyghmi_login_latency_seconds',
+               'Time taken by logins that succeeded',
+               snapshot['loginlatency'])
+    _histogram(lines, 'pyghmi_loop_iteration_seconds',
+               'Time taken by a pass of the event loop once woken up',
+               snapshot['looplatency'])
+    return '\n'.join(lines) + '\n'
+
+
+class _Connection(object):
+    def __init__(self, exporter, conn):
+        self.exporter = exporter
+        self.conn = conn
+        self.request = ''
+        self.answer = None
+        self.timer = session.Session.timerheap.schedule(
+            session._monotonic_time() + _connectiontimeout, self.close)
+        session.Session.register_handle_callback(conn, self._readable)
+
+    def _readable(self, conn):
+        try:
+            data = conn.recv(4096)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            return self.close()
+        if not data:
+            return self.close()
+        self.request += data
+        if '\r\n\r\n' not in self.request and '\n\n' not in self.request:
+            if len(self.request) > 65536:  # not a request we would answer
+                self.close()
+            return
+        session.Session.unregister_handle_callback(conn)
+        self.answer = self.exporter.answer(self.request)
+        self._send()
+
+    def _send(self):
+        if self.conn is None:  # timed out in the meantime
+            return
+        try:
+            sent = self.conn.send(self.answer)
+        except socket.error as err:
+            if err.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return self.close()
+            sent = 0
+        self.answer = self.answer[sent:]
+        if not self.answer:
+            return self.close()
+        session.Session.timerheap.schedule(
+            session._monotonic_time() + _sendretry, self._send)
+
+    def close(self):
+        if self.conn is None:
+            return
+        session.Session.timerheap.cancel(self.timer)
+        if self.answer is None:  # still reading the request
+            session.Session.unregister_handle_callback(self.conn)
+        self.conn.close()
+        self.conn = None
+        self.exporter.connections.discard(self)
+
+
+class MetricsExporter(object):
+    """An HTTP endpoint serving render() at /metrics
+
+    It is served by the session event loop, so only while something is
+    calling Session.wait_for_rsp.
+
+    :param address: address to listen on, loopback by default
+    :param port: port to listen on, 0 to have one picked, see the port
+                 attribute for which
+    """
+
+    def __init__(self, address='127.0.0.1', port=9623):
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((address, port))
+        self.listener.listen(16)
+        self.listener.setblocking(0)
+        self.port = self.listener.getsockname()[1]
+        self.connections = set()
+        session.Session.register_handle_callback(self.listener,
+                                                 self._accept)
+
+    def _accept(self, listener):
+        try:
+            conn, _ = listener.accept()
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        conn.setblocking(0)
+        self.connections.add(_Connection(self, conn))
+
+    def answer(self, request):
+        """The full HTTP response to request
+        """
+        fields = request.split(None, 2)
+        if len(fields) < 2 or fields[0] != 'GET' or \
+                fields[1].split('?')[0] not in ('/', '/metrics'):
+            return _notfound
+        body = render()
+        return ('HTTP/1.0 200 OK\r\n'
+                'Content-Type: text/plain; version=0.0.4\r\n'
+                'Content-Length: %d\r\nConnection: close\r\n\r\n%s' %
+                (len(body), body))
+
+    def close(self):
+        """Stop serving, closing connections still open
+        """
+        for connection in list(self.connections):
+            connection.close()
+        session.Session.unregister_handle_callback(self.listener)
+        self.listener.close()
@@ -0,0 +1,194 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the scheduling of session logins
+#
+# Each login is a handshake of several round trips, and a BMC asked for too
+# many of them at once turns them away or drops them.  Handshakes are
+# therefore started a limited number at a time, those that callers are
+# blocked on first, and those turned away for being busy are tried again
+# after a jittered, exponentially growing delay.
+
+import collections
+import random
+
+
+class LoginScheduler(object):
+    """Logins in progress, queued to start and waiting to be retried
+
+    Sessions are started with their _begin_login method and report back
+    through finished.
+
+    :param timerheap: TimerHeap to schedule retries in
+    :param clock: function returning the current time in seconds
+    :param maxactive: handshakes to have in progress at once
+    :param retries: times to retry a login turned away for being busy
+    :param backoff: seconds to wait before the first retry, doubling with
+                    each one after
+    :param maxbackoff: longest to wait before a retry
+    """
+
+    def __init__(self, timerheap, clock, maxactive=64, retries=5, backoff=1.0,
+                 maxbackoff=30.0):
+        self.timerheap = timerheap
+        self.clock = clock
+        self.maxactive = maxactive
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        # sessions may sit in both queues once expedited, the queued set
+        # says whether they are still to be started
+        self.urgent = collections.deque()
+        self.normal = collections.deque()
+        self.queued = set()
+        self.waitedon = set()
+        self.active = set()
+        self.backingoff = {}
+        self.attempts = {}
+        self.pumping = False
+        # when the current wave of logins started and how long the last one
+        # took to get through
+        self.wavestart = None
+        self.lastwave = None
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+
+    def submit(self, session, urgent=False):
+        """Queue session to log in
+
+        :param urgent: whether a caller is blocked until it has, which puts
+                       it ahead of those that are not
+        """
+        if self.wavestart is None:
+            self.wavestart = self.clock()
+        if urgent:
+            self.waitedon.add(session)
+        if session in self.active or session in self.backingoff:
+            return
+        if session in self.queued:
+            if urgent:
+                self.urgent.append(session)
+            return
+        self.queued.add(session)
+        if session in self.waitedon:
+            self.urgent.append(session)
+        else:
+            self.normal.append(session)
+        self.pump()
+
+    def expedite(self, session):
+        """Move session to the front, a caller has started waiting on it
+        """
+        self.submit(session, urgent=True)
+
+    def pending(self, session):
+        """Whether session is logging in, queued to or about to be retried
+        """
+        return (session in self.active or session in self.queued or
+                session in self.backingoff)
+
+    def _next(self):
+        for queue in (self.urgent, self.normal):
+            while queue:
+                session = queue.popleft()
+                if session in self.queued:
+                    self.queued.discard(session)
+                    return session
+        return None
+
+    def pump(self):
+        """Start queued logins while there is room
+        """
+        if self.pumping:  # a login started below came straight back
+            return
+        self.pumping = True
+        try:
+            while len(self.active) < self.maxactive:
+                session = self._next()
+                if session is None:
+                    break
+                self.active.add(session)
+                try:
+                    session._begin_login()
+                except Exception:
+                    self.active.discard(session)
+                    raise
+        finally:
+            self.pumping = False
+        self._check_idle()
+
+    def finished(self, session, success, busy=False):
+        """Account for a login that has come to an end
+
+        :param busy: whether it failed because the BMC was too busy, or did
+                     not answer, so that trying again later may work
+        :returns: True if the outcome stands, False if the login is to be
+                  retried and the caller should hear nothing of it yet
+        """
+        if session not in self.active:  # a stray late answer, already told
+            return True
+        self.active.discard(session)
+        attempts = self.attempts.get(session, 0)
+        if not success and busy and attempts < self.retries:
+            self.attempts[session] = attempts + 1
+            self.retried += 1
+            delay = min(self.backoff * (2 ** attempts), self.maxbackoff)
+            delay *= 0.5 + random.random() / 2  # jitter to break up waves
+            self.backingoff[session] = self.timerheap.schedule(
+                self.clock() + delay, self._retry, session)
+            self.pump()
+            return False
+        self.attempts.pop(session, None)
+        self.waitedon.discard(session)
+        if success:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.pump()
+        return True
+
+    def _retry(self, session):
+        del self.backingoff[session]
+        self.submit(session, urgent=session in self.waitedon)
+
+    def _check_idle(self):
+        if (self.wavestart is None or self.active or self.queued or
+                self.backingoff):
+            return
+        self.lastwave = self.clock() - self.wavestart
+        self.wavestart = None
+
+    def state(self):
+        """The scheduler state as a dict, for inspection
+
+        wave is how long the logins under way have been at it, lastwave how
+        long those before took from the first being asked for until all had
+        logged in or failed.
+        """
+        wave = None
+        if self.wavestart is not None:
+            wave = self.clock() - self.wavestart
+        return {
+            'active': len(self.active),
+            'queued': len(self.queued),
+            'backingoff': len(self.backingoff),
+            'maxactive': self.maxactive,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'retried': self.retried,
+            'wave': wave,
+            'lastwave': self.lastwave,
+        }
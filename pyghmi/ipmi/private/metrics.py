@@ -0,0 +1,201 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the counters and latency histograms of the session layer
+#
+# Counts are kept per BMC and for all of them together, as are histograms of
+# how long commands and logins took; the latter are also kept by netfn and
+# command for all BMCs together.  Histograms have fixed buckets, so keeping
+# them up to date costs a bisect and an increment and allocates nothing.
+
+import bisect
+
+# upper bounds in seconds of the latency buckets, roughly doubling from a
+# millisecond to a minute, past which it goes into the last bucket
+buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5,
+           10, 20, 60)
+# the same for passes of the event loop, from ten microseconds to a second
+loopbuckets = (0.00001, 0.00002, 0.00005, 0.0001, 0.0002, 0.0005, 0.001,
+               0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1)
+
+# why packets were dropped on receipt
+dropreasons = (
+    'unknownpeer',  # from an address no session is talking to
+    'replay',  # remote sequence number seen before or out of window
+    'authtype',  # IPMI 1.5 authentication type not the one of the session
+    'sessionid',  # session id not the one of the session
+    'authcode',  # IPMI 1.5 authcode did not check out
+    'integrity',  # RMCP+ integrity check failed or was missing
+    'unexpected',  # no request outstanding that it answers
+    'stale',  # RMCP+ handshake message arriving out of turn
+)
+
+
+class Histogram(object):
+    """Counts of observed values in fixed buckets, with their sum
+
+    :param bounds: ascending upper bounds of the buckets, values past the
+                   last go in an extra bucket of their own
+    """
+
+    def __init__(self, bounds=buckets):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def state(self):
+        """The histogram as a dict, counts being cumulative by upper bound
+        """
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            running += count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'count': self.total, 'sum': self.sum}
+
+
+class Counters(object):
+    """Counters and latency histograms of one BMC, or of all of them
+    """
+
+    def __init__(self):
+        self.commands = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.loginattempts = 0
+        self.logins = 0
+        self.loginfailures = 0
+        self.drops = dict.fromkeys(dropreasons, 0)
+        self.commandlatency = Histogram()
+        self.loginlatency = Histogram()
+
+    def state(self):
+        return {
+            'commands': self.commands,
+            'retries': self.retries,
+            'timeouts': self.timeouts,
+            'loginattempts': self.loginattempts,
+            'logins': self.logins,
+            'loginfailures': self.loginfailures,
+            'drops': dict(self.drops),
+            'commandlatency': self.commandlatency.state(),
+            'loginlatency': self.loginlatency.state(),
+        }
+
+
+class BmcMetrics(object):
+    """What sessions with a BMC record, passed on to the registry total
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.counters = Counters()
+
+    def command(self, netfn, command, latency):
+        """Account for a command answered after latency seconds
+        """
+        self.counters.commands += 1
+        self.counters.commandlatency.observe(latency)
+        total = self.registry.total
+        total.commands += 1
+        total.commandlatency.observe(latency)
+        self.registry.bycommand(netfn, command).observe(latency)
+
+    def retry(self):
+        self.counters.retries += 1
+        self.registry.total.retries += 1
+
+    def timeout(self):
+        self.counters.timeouts += 1
+        self.registry.total.timeouts += 1
+
+    def drop(self, reason):
+        self.counters.drops[reason] += 1
+        self.registry.total.drops[reason] += 1
+
+    def loginattempt(self):
+        self.counters.loginattempts += 1
+        self.registry.total.loginattempts += 1
+
+    def login(self, success, latency):
+        """Account for a login attempt that came to an end
+        """
+        for counters in (self.counters, self.registry.total):
+            if success:
+                counters.logins += 1
+                counters.loginlatency.observe(latency)
+            else:
+                counters.loginfailures += 1
+
+
+class MetricsRegistry(object):
+    """Metrics of every BMC talked to, and of all of them together
+    """
+
+    def __init__(self):
+        self.total = Counters()
+        self.bmcs = {}
+        self.commands = {}
+        # how long the event loop took to deal with what it woke up to
+        self.looplatency = Histogram(loopbuckets)
+
+    def bmc(self, bmc, port):
+        """The metrics of a BMC, kept across sessions with it
+        """
+        # a tuple, as IPv6 addresses would make 'host:port' ambiguous
+        key = (bmc, port)
+        try:
+            return self.bmcs[key]
+        except KeyError:
+            self.bmcs[key] = BmcMetrics(self)
+            return self.bmcs[key]
+
+    def bycommand(self, netfn, command):
+        # keyed by an int rather than a tuple, which would have to be made
+        # for every command
+        key = (netfn << 8) | command
+        try:
+            return self.commands[key]
+        except KeyError:
+            self.commands[key] = Histogram()
+            return self.commands[key]
+
+    def drop(self, reason):
+        """Account for a packet dropped before a BMC could be told apart
+        """
+        self.total.drops[reason] += 1
+
+    def state(self, perbmc=True):
+        """A snapshot of the metrics as a dict
+
+        :param perbmc: whether to include every BMC, 'bmcs' maps
+                       (host, port) to their metrics
+        """
+        snapshot = self.total.state()
+        snapshot['looplatency'] = self.looplatency.state()
+        snapshot['bycommand'] = dict(
+            ((key >> 8, key & 0xff), histogram.state())
+            for key, histogram in self.commands.iteritems())
+        if perbmc:
+            snapshot['bmcs'] = dict(
+                (key, metrics.counters.state())
+                for key, metrics in self.bmcs.iteritems())
+        return snapshot
@@ -0,0 +1,313 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the pacing of packets sent by the session layer
+#
+# Packets are let out through scopes, one for everything and one for each
+# subnet BMCs are on, each with a token bucket limiting packets per second
+# and a congestion window limiting requests awaiting an answer.  Both back
+# off AIMD style: replies widen the window and raise the rate additively,
+# a timeout halves them, at most once per holdoff so that a burst of losses
+# counts as one congestion event.  Networks lose the odd packet congested
+# or not, so timeouts only count as congestion while they make up a fair
+# share of the requests that landed over the last holdoff or two.
+#
+# Losses are told apart by BMC.  A BMC that has never answered, or has not
+# for a few requests in a row, is taken to be down or not there at all and
+# its losses hold nothing back.  Those of the others back off the subnet
+# they are on, while the global scope only backs off once many BMCs lose
+# packets at once, which points at congestion on our side of the network.
+
+import socket
+
+# shortest a subnet window is allowed to get, and the rate as a share of the
+# configured one
+_minwindow = 4
+_minratefactor = 0.05
+# share of recent requests that have to be lost to back off, and how many
+# at the least
+_lossshare = 0.5
+_minlosses = 8
+# losses in a row after which a BMC is taken to be down rather than congested
+_deadstreak = 3
+
+
+class Scope(object):
+    """Send rate and requests in flight towards a group of BMCs
+
+    :param rate: packets per second to let out at most, None for no limit
+    :param limit: requests to have awaiting an answer at most
+    :param clock: function returning the current time in seconds
+    :param initialwindow: requests allowed in flight before any reply
+    :param holdoff: seconds after a backoff in which losses are not counted
+                    again
+    :param minwindow: shortest the window gets when backing off, unless the
+                      limit or the window already are shorter
+    """
+
+    def __init__(self, rate, limit, clock, initialwindow=16, holdoff=1.0,
+                 minwindow=_minwindow):
+        self.clock = clock
+        self.maxrate = rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.stamp = clock()
+        self.limit = limit
+        self.window = float(initialwindow)
+        # the window grows by one per reply until the first loss, and by one
+        # per window of replies after
+        self.threshold = None
+        self.holdoff = holdoff
+        self.minwindow = minwindow
+        self.recovery = None
+        # requests answered and lost in the holdoff long period under way
+        # and in the one before, and when the period started
+        self.period = None
+        self.tally = [0, 0]
+        self.lasttally = [0, 0]
+        self.inflight = 0
+        self.answered = 0
+        self.lost = 0
+        self.backoffs = 0
+
+    def _refill(self, now):
+        if self.rate is None:
+            return
+        burst = max(self.rate / 10.0, 1.0)  # about 100ms worth
+        self.tokens = min(self.tokens + (now - self.stamp) * self.rate,
+                          burst)
+        self.stamp = now
+
+    def delay(self, now):
+        """Seconds to wait before a new request may go out
+
+        :returns: 0 if it may go now, None if it has to wait for a request in
+                  flight to be answered or time out
+        """
+        if self.inflight >= min(int(self.window), self.limit):
+            return None
+        if self.rate is None:
+            return 0
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def sent(self, now, newflight):
+        """Account for a packet sent, which may be a new request in flight
+
+        Packets sent without waiting, retransmissions for instance, may drive
+        the bucket below zero and so hold up what follows them.
+        """
+        if newflight:
+            self.inflight += 1
+        if self.rate is not None:
+            self._refill(now)
+            self.tokens -= 1
+
+    def _count(self, now, lost):
+        if self.period is None or now - self.period >= self.holdoff:
+            if self.period is None or now - self.period >= 2 * self.holdoff:
+                self.lasttally = [0, 0]
+            else:
+                self.lasttally = self.tally
+            self.tally = [0, 0]
+            self.period = now
+        self.tally[lost] += 1
+
+    def landed(self, now, answered):
+        """A request is no longer in flight, having been answered or not
+        """
+        self.inflight -= 1
+        if not answered:
+            return
+        self.answered += 1
+        self._count(now, False)
+        if self.threshold is None or self.window < self.threshold:
+            self.window += 1
+        else:
+            self.window += 1 / self.window
+        self.window = min(self.window, self.limit)
+        if self.rate is not None:
+            # one more packet per second for each reply
+            self.rate = min(self.rate + 1, self.maxrate)
+
+    def loss(self, now, congested=True):
+        """A packet went unanswered, back off unless just done so
+
+        :param congested: whether the loss may be a sign of congestion, or
+                          is only counted
+        """
+        self.lost += 1
+        if not congested:
+            return
+        self._count(now, True)
+        answered = self.tally[0] + self.lasttally[0]
+        lost = self.tally[1] + self.lasttally[1]
+        if lost < _minlosses or lost < (answered + lost) * _lossshare:
+            return
+        if self.recovery is not None and now < self.recovery:
+            return
+        self.recovery = now + self.holdoff
+        self.backoffs += 1
+        floor = min(self.minwindow, max(self.limit, 1), self.window)
+        self.window = max(self.window / 2, floor)
+        self.threshold = self.window
+        if self.rate is not None:
+            self.rate = max(self.rate / 2, self.maxrate * _minratefactor)
+
+    def state(self):
+        """The scope state as a dict, for inspection
+        """
+        return {
+            'rate': self.rate,
+            'maxrate': self.maxrate,
+            'window': self.window,
+            'limit': self.limit,
+            'inflight': self.inflight,
+            'answered': self.answered,
+            'lost': self.lost,
+            'backoffs': self.backoffs,
+        }
+
+
+def subnet_of(sockaddr, prefix4=24, prefix6=64):
+    """The subnet an AF_INET6 sockaddr is on, as a hashable key
+
+    IPv4 addresses, which the session socket sees mapped into IPv6, are
+    taken to be on a /prefix4 and others on a /prefix6.
+    """
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, sockaddr[0].split('%')[0])
+    except (socket.error, ValueError):
+        return None
+    if packed.startswith('\x00' * 10 + '\xff\xff'):
+        bits = 96 + prefix4
+    else:
+        bits = prefix6
+    whole, partial = divmod(bits, 8)
+    key = packed[:whole]
+    if partial:
+        key += chr(ord(packed[whole]) & (0xff << (8 - partial)) & 0xff)
+    return key, bits
+
+
+class Pacer(object):
+    """The global scope and those of each subnet, created as BMCs show up
+
+    :param clock: function returning the current time in seconds
+    :param rate: packets per second let out overall, None for no limit
+    :param limit: requests in flight overall
+    :param subnetrate: packets per second let out to any one subnet
+    :param subnetlimit: requests in flight to any one subnet
+    :param minwindow: shortest the global window gets when backing off
+    :param quorum: how many BMCs have to lose packets within a holdoff of
+                   each other for the global scope to back off
+    """
+
+    def __init__(self, clock, rate, limit, subnetrate, subnetlimit,
+                 minwindow=64, quorum=16):
+        self.clock = clock
+        self.subnetrate = subnetrate
+        self.subnetlimit = subnetlimit
+        self.globalscope = Scope(rate, limit, clock,
+                                 initialwindow=max(minwindow, 16),
+                                 minwindow=minwindow)
+        self.subnets = {}
+        self.quorum = quorum
+        # losses in a row of each BMC that has answered so far, and when BMCs
+        # that are answering lost a packet lately
+        self.streaks = {}
+        self.lossypeers = {}
+
+    def scopes(self, subnet):
+        """The scopes a packet to a BMC on subnet passes through
+        """
+        if subnet is None:
+            return (self.globalscope,)
+        if subnet not in self.subnets:
+            self.subnets[subnet] = Scope(self.subnetrate, self.subnetlimit,
+                                         self.clock)
+        return (self.globalscope, self.subnets[subnet])
+
+    def delay(self, scopes):
+        """Seconds until a new request may go out through all of scopes
+
+        :returns: 0 if now, None if a request in flight has to land first
+        """
+        now = self.clock()
+        longest = 0
+        for scope in scopes:
+            delay = scope.delay(now)
+            if delay is None:
+                return None
+            longest = max(longest, delay)
+        return longest
+
+    def sent(self, scopes, newflight):
+        now = self.clock()
+        for scope in scopes:
+            scope.sent(now, newflight)
+
+    def landed(self, scopes, answered, peer=None):
+        now = self.clock()
+        for scope in scopes:
+            scope.landed(now, answered)
+        if answered and peer is not None:
+            self.streaks[peer] = 0
+
+    def loss(self, scopes, peer=None):
+        """A packet to peer went unanswered
+
+        :param peer: hashable naming the BMC, losses of unnamed ones are
+                     only counted
+        """
+        now = self.clock()
+        streak = self.streaks.get(peer)
+        congested = streak is not None and streak < _deadstreak
+        if streak is not None:
+            self.streaks[peer] = streak + 1
+        widespread = False
+        if congested:
+            lossy = self.lossypeers
+            lossy[peer] = now
+            if len(lossy) >= self.quorum:
+                holdoff = self.globalscope.holdoff
+                for key, stamp in lossy.items():
+                    if now - stamp > holdoff:
+                        del lossy[key]
+            widespread = len(lossy) >= self.quorum
+            if widespread:
+                lossy.clear()
+        for scope in scopes:
+            if scope is self.globalscope:
+                scope.loss(now, widespread)
+            else:
+                scope.loss(now, congested)
+
+    def state(self):
+        """State of the global scope and of each subnet scope, by subnet
+        """
+        subnets = {}
+        for (key, bits), scope in self.subnets.iteritems():
+            if bits > 96:  # IPv4 mapped
+                network = socket.inet_ntop(
+                    socket.AF_INET, key[12:].ljust(4, '\x00'))
+                bits -= 96
+            else:
+                network = socket.inet_ntop(socket.AF_INET6,
+                                           key.ljust(16, '\x00'))
+            subnets['%s/%d' % (network, bits)] = scope.state()
+        return {'global': self.globalscope.state(), 'subnets': subnets}
@@ -0,0 +1,130 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides readiness notification backends for the session event loop
+
+import errno
+import select
+
+
+def _fileno(handle):
+    if isinstance(handle, int):
+        return handle
+    return handle.fileno()
+
+
+class SelectPoller(object):
+    """Portable backend on top of select.select
+
+    select can not watch file descriptors numbered 1024 or higher, so this is
+    only used when nothing better is offered by the platform.
+    """
+
+    def __init__(self):
+        self.fds = set()
+
+    def register(self, handle):
+        self.fds.add(_fileno(handle))
+
+    def unregister(self, handle):
+        self.fds.discard(_fileno(handle))
+
+    def fileno(self):
+        return None
+
+    def poll(self, timeout=None):
+        """Wait for input on any registered handle
+
+        :param timeout: seconds to wait, None to wait indefinitely
+        :returns: list of file descriptors ready for reading
+        """
+        try:
+            rdylist, _, _ = select.select(self.fds, (), (), timeout)
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+        return rdylist
+
+
+class PollPoller(object):
+    """Backend on top of select.poll, with no limit on descriptor numbers
+    """
+
+    def __init__(self):
+        self.poller = select.poll()
+
+    def register(self, handle):
+        self.poller.register(_fileno(handle), select.POLLIN)
+
+    def unregister(self, handle):
+        self.poller.unregister(_fileno(handle))
+
+    def fileno(self):
+        return None
+
+    def poll(self, timeout=None):
+        if timeout is not None:
+            # poll wants milliseconds, round up so that a timeout that is
+            # almost due does not turn into a busy loop
+            timeout = int(timeout * 1000 + 0.999)
+        try:
+            return [fd for fd, _ in self.poller.poll(timeout)]
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+class EpollPoller(object):
+    """Linux epoll backend
+
+    Handles are registered with the kernel once, so the cost of a poll does
+    not grow with the number of handles being watched.
+    """
+
+    def __init__(self):
+        self.poller = select.epoll()
+
+    def register(self, handle):
+        self.poller.register(_fileno(handle), select.EPOLLIN)
+
+    def unregister(self, handle):
+        self.poller.unregister(_fileno(handle))
+
+    def fileno(self):
+        """The epoll descriptor itself, readable whenever a handle is ready
+        """
+        return self.poller.fileno()
+
+    def poll(self, timeout=None):
+        if timeout is None:
+            timeout = -1
+        try:
+            return [fd for fd, _ in self.poller.poll(timeout)]
+        except IOError as err:
+            if err.errno == errno.EINTR:
+                return []
+            raise
+
+
+def get_poller():
+    """Return an instance of the best backend available on this platform
+    """
+    if hasattr(select, 'epoll'):
+        return EpollPoller()
+    if hasattr(select, 'poll'):
+        return PollPoller()
+    return SelectPoller()
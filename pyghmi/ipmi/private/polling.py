@@ -0,0 +1,90 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the spacing of polls made while waiting on BMCs to change
+# state
+#
+# Each wait polls quickly at first, as most changes are over soon, and less
+# often the longer it goes on, with jitter so that waits started together
+# drift apart.  On top of that the polls of every wait share a budget of
+# polls per second, so that thousands of BMCs waiting at once do not add up
+# to a flood.
+
+import heapq
+import math
+import random
+import time
+
+
+def backoff(polls, initial, ceiling, factor=1.5):
+    """Seconds to wait before the next poll
+
+    :param polls: polls made so far
+    :param initial: seconds before the first poll
+    :param ceiling: seconds between polls at most, before jitter
+    :param factor: growth of the interval from one poll to the next
+    :returns: the interval, jittered by up to half either way
+    """
+    interval = ceiling
+    if initial < ceiling:
+        # the ceiling is reached after this many polls, and factor ** polls
+        # would overflow for a wait that goes on long enough
+        polls = min(polls, int(math.ceil(math.log(ceiling / float(initial),
+                                                  factor))))
+        interval = min(initial * factor ** polls, ceiling)
+    return interval * (0.5 + random.random())
+
+
+class PollBudget(object):
+    """Polls per second allowed across all waits
+
+    Time is cut into slots of 1 / rate seconds, each taking one poll.
+    Rather than refuse a poll over budget, it is put off until the next free
+    slot, so every poll goes out in time, just no more than rate of them a
+    second.  A poll booked far ahead does not hold up those wanted sooner.
+
+    :param rate: polls per second at most, None for no limit
+    :param clock: function returning the current time in seconds, as the
+                  times slots are asked for are given in
+    """
+
+    def __init__(self, rate, clock=time.time):
+        self.rate = rate
+        self.clock = clock
+        # indexes of the slots taken, and the same as a heap to let go of
+        # those in the past by
+        self.taken = set()
+        self.booked = []
+
+    def slot(self, when):
+        """Take the earliest free slot at or after when
+
+        :param when: time the poll would like to go out
+        :returns: time it may go out
+        """
+        if self.rate is None:
+            return when
+        current = int(self.clock() * self.rate)
+        while self.booked and self.booked[0] < current:
+            self.taken.discard(heapq.heappop(self.booked))
+        wanted = int(when * self.rate)
+        index = wanted
+        while index in self.taken:
+            index += 1
+        self.taken.add(index)
+        heapq.heappush(self.booked, index)
+        if index == wanted:
+            return when
+        return float(index) / self.rate
@@ -0,0 +1,242 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the cache of BMC addresses sessions send to
+#
+# getaddrinfo blocks for as long as the name service takes to answer, which
+# would hold up every session sharing the event loop.  Sessions therefore only
+# read addresses from here.  What is not cached is looked up on a pool of
+# threads, whose answers the event loop picks up once the descriptor of the
+# cache turns readable, or ahead of time for a whole list of BMCs with
+# preresolve.
+
+import errno
+import fcntl
+import os
+import Queue
+import socket
+import threading
+import time
+
+
+def _tosockaddr(res):
+    """Give the sockaddr of a getaddrinfo result in AF_INET6 terms
+    """
+    sockaddr = res[4]
+    if res[0] == socket.AF_INET:  # convert the sockaddr to AF_INET6
+        newhost = '::ffff:' + sockaddr[0]
+        sockaddr = (newhost, sockaddr[1], 0, 0)
+    return sockaddr
+
+
+class ResolverCache(object):
+    """Addresses of BMCs by name and port, each kept for a time to live
+
+    Failed lookups are remembered too, for negativettl seconds, so that an
+    unresolvable name is not asked after again on every attempt.
+
+    :param ttl: seconds a successful lookup is good for
+    :param negativettl: seconds a failed lookup is good for
+    :param getaddrinfo: function to do lookups with, socket.getaddrinfo
+                        unless specified
+    :param clock: function returning the current time in seconds
+    :param workers: how many threads resolve asks to look up names at once
+    """
+
+    def __init__(self, ttl=300, negativettl=30, getaddrinfo=None,
+                 clock=time.time, workers=16):
+        self.ttl = ttl
+        self.negativettl = negativettl
+        if getaddrinfo is None:
+            getaddrinfo = socket.getaddrinfo
+        self.getaddrinfo = getaddrinfo
+        self.clock = clock
+        self.workers = workers
+        # (host, port) -> (expiry, tuple of sockaddrs or socket.gaierror)
+        self.entries = {}
+        # callbacks of the lookups under way by (host, port), the lookups
+        # for the pool to make and the answers it has made, and the pipe it
+        # wakes the event loop up through, all set up on first use
+        self.waiters = {}
+        self.requests = None
+        self.answers = None
+        self.threads = []
+        self.wakeup = None
+
+    def _getaddrinfo(self, host, port):
+        try:
+            result = tuple(
+                _tosockaddr(res) for res in
+                self.getaddrinfo(host, port, 0, socket.SOCK_DGRAM))
+            expiry = self.clock() + self.ttl
+        except socket.gaierror as err:
+            result = err
+            expiry = self.clock() + self.negativettl
+        return expiry, result
+
+    def _resolve(self, host, port):
+        entry = self._getaddrinfo(host, port)
+        self.entries[(host, port)] = entry
+        return entry[1]
+
+    def current(self, host, port):
+        """Whether what is cached for host has yet to outlive its ttl
+        """
+        entry = self.entries.get((host, port))
+        return entry is not None and entry[0] > self.clock()
+
+    def resolve(self, host, port, callback):
+        """Have callback called with the sockaddrs of host, without blocking
+
+        A current entry is handed to callback straight away.  Otherwise the
+        name is looked up on the pool of threads and callback is called by
+        complete, once the lookup is done, as are those of any other callers
+        after the same name meanwhile.
+
+        :param callback: function taking a tuple of AF_INET6 sockaddrs, or
+                         the socket.gaierror the lookup failed with
+        """
+        key = (host, port)
+        if key in self.waiters:
+            self.waiters[key].append(callback)
+            return
+        if self.current(host, port):
+            callback(self.entries[key][1])
+            return
+        self._startpool()
+        self.waiters[key] = [callback]
+        self.requests.put(key)
+
+    def pending(self):
+        """Whether lookups asked for by resolve are still under way
+        """
+        return bool(self.waiters)
+
+    def fileno(self):
+        """Descriptor that turns readable when complete has work to do
+        """
+        self._startpool()
+        return self.wakeup[0]
+
+    def complete(self):
+        """Cache the lookups the pool has made and call their callbacks
+        """
+        if self.wakeup is None:
+            return
+        try:
+            while os.read(self.wakeup[0], 4096):
+                pass
+        except OSError as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        while True:
+            try:
+                key, entry = self.answers.get_nowait()
+            except Queue.Empty:
+                return
+            self.entries[key] = entry
+            for callback in self.waiters.pop(key, ()):
+                callback(entry[1])
+
+    def _startpool(self):
+        if self.wakeup is not None:
+            return
+        self.wakeup = os.pipe()
+        for fd in self.wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.requests = Queue.Queue()
+        self.answers = Queue.Queue()
+        for _ in xrange(self.workers):
+            thread = threading.Thread(target=self._lookups)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _lookups(self):
+        while True:
+            host, port = self.requests.get()
+            self.answers.put(((host, port), self._getaddrinfo(host, port)))
+            try:
+                os.write(self.wakeup[1], 'x')
+            except OSError as err:
+                # a full pipe will wake the event loop up all the same
+                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+
+    def lookup(self, host, port):
+        """Return the sockaddrs of host, looking them up if need be
+
+        This blocks when nothing current is cached for host, sessions go
+        through resolve instead.
+
+        :returns: tuple of AF_INET6 sockaddrs
+        :raises: socket.gaierror if host does not resolve
+        """
+        entry = self.entries.get((host, port))
+        if entry is None or entry[0] <= self.clock():
+            result = self._resolve(host, port)
+        else:
+            result = entry[1]
+        if isinstance(result, socket.gaierror):
+            raise result
+        return result
+
+    def cached(self, host, port):
+        """Return the sockaddrs of host last looked up, however old
+
+        This never blocks.
+
+        :returns: tuple of AF_INET6 sockaddrs
+        :raises: socket.gaierror if the last lookup failed or none was made
+        """
+        entry = self.entries.get((host, port))
+        if entry is None:
+            raise socket.gaierror(socket.EAI_NONAME,
+                                  '%s has not been looked up' % host)
+        if isinstance(entry[1], socket.gaierror):
+            raise entry[1]
+        return entry[1]
+
+    def preresolve(self, hosts, port=623, workers=16):
+        """Look up a list of hosts concurrently, refreshing the cache
+
+        :param hosts: iterable of names or addresses
+        :param workers: how many lookups to have going at once
+        :returns: dict of host to tuple of sockaddrs, or to the
+                  socket.gaierror its lookup failed with
+        """
+        work = Queue.Queue()
+        hosts = list(hosts)
+        for host in hosts:
+            work.put(host)
+        results = {}
+
+        def worker():
+            while True:
+                try:
+                    host = work.get_nowait()
+                except Queue.Empty:
+                    return
+                results[host] = self._resolve(host, port)
+        threads = []
+        for _ in xrange(min(workers, len(hosts))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
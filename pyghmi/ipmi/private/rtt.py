@@ -0,0 +1,82 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the retransmission timeout estimate for a BMC
+#
+# The estimate follows the Jacobson/Karels algorithm as specified for TCP in
+# RFC 6298: a smoothed round trip time and its mean deviation are kept up to
+# date from measured replies, and the timeout is the former plus four times
+# the latter.  Only replies to packets sent once are measured, as it can not
+# be told which transmission a reply to a retransmitted packet answers.
+
+# gains for the smoothed round trip time and its variance, per RFC 6298
+_alpha = 0.125
+_beta = 0.25
+# resolution of the session clock, os.times ticks at 100 Hz
+_granularity = 0.01
+
+
+class RttEstimator(object):
+    """Round trip time statistics and retransmission timeout of a BMC
+
+    :param initial: timeout to use until a round trip has been measured
+    :param floor: shortest timeout to ever use
+    :param ceiling: longest timeout to ever use
+    """
+
+    def __init__(self, initial, floor, ceiling):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+        self.samples = 0
+        self.backoffs = 0
+
+    def sample(self, rtt):
+        """Account for the round trip time of a packet sent once
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = ((1 - _beta) * self.rttvar +
+                           _beta * abs(self.srtt - rtt))
+            self.srtt = (1 - _alpha) * self.srtt + _alpha * rtt
+        self.samples += 1
+        self.rto = min(max(self.srtt + max(_granularity, 4 * self.rttvar),
+                           self.floor), self.ceiling)
+
+    def backoff(self, timeout):
+        """Return the timeout to wait after timeout expired with no reply
+
+        The timeout doubles with each retransmission of a packet, and sticks
+        for the packets after it until a reply can be measured again.
+        """
+        self.backoffs += 1
+        timeout = min(timeout * 2, self.ceiling)
+        self.rto = max(self.rto, timeout)
+        return timeout
+
+    def state(self):
+        """The estimator state as a dict, for inspection
+        """
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'rto': self.rto,
+            'samples': self.samples,
+            'backoffs': self.backoffs,
+        }
@@ -17,20 +17,29 @@
 
 import atexit
 import collections
-import hashlib
+import errno
 import os
 import random
-import select
 import socket
 import struct
 import time
 
-from Crypto.Cipher import AES
 from Crypto.Hash import HMAC
 from Crypto.Hash import SHA
 
 import pyghmi.exceptions as exc
+from pyghmi.ipmi.private import batchio
+from pyghmi.ipmi.private import capabilities
+from pyghmi.ipmi.private import codec
 from pyghmi.ipmi.private import constants
+from pyghmi.ipmi.private import cryptobackend
+from pyghmi.ipmi.private import logins
+from pyghmi.ipmi.private import metrics
+from pyghmi.ipmi.private import pacing
+from pyghmi.ipmi.private import poller
+from pyghmi.ipmi.private import resolver
+from pyghmi.ipmi.private import rtt
+from pyghmi.ipmi.private import timers
 
 
 initialtimeout = 0.5  # minimum timeout for first packet to retry in any given
@@ -54,29 +63,6 @@ def _monotonic_time():
     #TODO(jbjohnso): Windows variant
 
 
-def _poller(readhandles, timeout=0):
-    rdylist, _, _ = select.select(readhandles, (), (), timeout)
-    return rdylist
-
-
-def _aespad(data):
-    """ipmi demands a certain pad scheme,
-    per table 13-20 AES-CBC encrypted payload fields.
-    """
-    newdata = list(data)
-    currlen = len(data) + 1  # need to count the pad length field as well
-    neededpad = currlen % 16
-    if neededpad:  # if it happens to be zero, hurray, but otherwise invert the
-                  # sense of the padding
-        neededpad = 16 - neededpad
-    padval = 1
-    while padval <= neededpad:
-        newdata.append(padval)
-        padval += 1
-    newdata.append(neededpad)
-    return newdata
-
-
 def call_with_optional_args(callback, *args):
     """In order to simplify things, in a number of places there is a callback
     facility and optional arguments to pass in.  An object-oriented caller may
@@ -109,6 +95,112 @@ def get_ipmi_error(response, suffix=""):
     return res
 
 
+class _ReplayWindow(object):
+    """Sequence numbers seen from a BMC, the latest 32 of them
+
+    Answers to pipelined commands may pass each other on the wire, so rather
+    than insisting that each sequence number is higher than the last, any
+    number not seen before within the window is accepted.  Zero is what a
+    BMC uses outside of a session and is always accepted.
+    """
+
+    def __init__(self):
+        self.highest = 0
+        self.seen = 0
+
+    def fresh(self, seqnumber):
+        if seqnumber == 0 or seqnumber > self.highest:
+            return True
+        offset = self.highest - seqnumber
+        return offset < 32 and not self.seen & (1 << offset)
+
+    def record(self, seqnumber):
+        if seqnumber == 0:
+            return
+        if seqnumber > self.highest:
+            shift = seqnumber - self.highest
+            if shift < 32:
+                self.seen = ((self.seen << shift) | 1) & 0xffffffff
+            else:
+                self.seen = 1
+            self.highest = seqnumber
+            if seqnumber == 0xffffffff:  # the BMC is about to wrap around
+                self.highest = 0
+                self.seen = 0
+        else:
+            self.seen |= 1 << (self.highest - seqnumber)
+
+
+class _PoolSocket(object):
+    """One UDP socket of the pool shared by sessions
+
+    Each socket gets its own receive buffer, which adds to the budget of
+    requests in flight, along with the queue and buffers to do batched I/O.
+    """
+
+    def __init__(self, recvbatchsize, sendbatchsize):
+        # INET6 can do IPv4 if you are nice to it
+        self.socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        self.socket.setblocking(0)  # the event loop reads until EAGAIN
+        try:  # we will try to fixup our receive buffer size if we are smaller
+             # than allowed.
+            maxmf = open("/proc/sys/net/core/rmem_max")
+            rmemmax = int(maxmf.read())
+            rmemmax = rmemmax / 2
+            curmax = self.socket.getsockopt(socket.SOL_SOCKET,
+                                            socket.SO_RCVBUF)
+            curmax = curmax / 2
+            if (rmemmax > curmax):
+                self.socket.setsockopt(socket.SOL_SOCKET,
+                                       socket.SO_RCVBUF,
+                                       rmemmax)
+        except Exception:
+            # FIXME: be more selective in catching exceptions
+            pass
+        curmax = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        curmax = curmax / 2
+        self.maxpending = curmax / 1000
+        # pessimistically assume 1 kilobyte messages,
+        # which is way larger than almost all ipmi datagrams.
+        # Sysadmins may still tune /proc/sys/net/core/rmem_max up, but the
+        # pool already gives a budget this size per socket
+        self.recvbatchsize = recvbatchsize
+        self.receivers = []
+        self.recvdepth = 0
+        self.sender = batchio.get_sender(self.socket, sendbatchsize)
+        self.txqueue = []
+
+    def flush(self):
+        txqueue = self.txqueue
+        self.txqueue = []
+        self.sender.send(txqueue)
+
+    def process(self):
+        """Read and route every datagram queued on the socket
+
+        The socket is non-blocking, so batches are read until EAGAIN rather
+        than asking the poller before each datagram.  Packets are queued
+        before being processed to keep things off RCVBUF.
+        """
+        # a batch lives in buffers that the next read reuses, and callbacks
+        # may re-enter the event loop before their batch is done, so each
+        # level of nesting reads into buffers of its own
+        if len(self.receivers) <= self.recvdepth:
+            self.receivers.append(
+                batchio.get_receiver(self.socket, self.recvbatchsize))
+        receiver = self.receivers[self.recvdepth]
+        self.recvdepth += 1
+        try:
+            pktqueue = receiver.recv()
+            while pktqueue:  # if the somewhat lengthy queue processing takes
+                             # long enough for packets to come in, be eager
+                for data, sockaddr in pktqueue:
+                    Session._route_ipmiresponse(sockaddr, data)
+                pktqueue = receiver.recv()
+        finally:
+            self.recvdepth -= 1
+
+
 class Session(object):
     """A class to manage common IPMI session logistics
 
@@ -117,7 +209,7 @@ class Session(object):
 
     For those that do have to worry, the main interesting thing is that the
     event loop can go one of two ways.  Either a larger manager can query using
-    class methods
+    class methods (get_timeout and get_handles)
     the soonest timeout deadline and the filehandles to poll and assume
     responsibility for the polling, or it can register filehandles to be
     watched.  This is primarily of interest to Console class, which may have an
@@ -136,6 +228,91 @@ class Session(object):
     keepalive_sessions = {}
     peeraddr_to_nodes = {}
     iterwaiters = []
+    # retransmit and keepalive deadlines for every session, the dicts above
+    # map sessions to their Timer in here
+    timerheap = timers.TimerHeap()
+    # poller backend for the event loop, a class with register, unregister
+    # and poll like those in pyghmi.ipmi.private.poller.  If left as None, the
+    # best available on the platform is used
+    pollerclass = None
+    # cryptography backend for established RMCP+ sessions, a class like those
+    # in pyghmi.ipmi.private.cryptobackend.  If left as None, the default one
+    # is used
+    cryptoclass = None
+    # how many datagrams the event loop takes off the socket at a time
+    recvbatchsize = 64
+    # datagrams are queued as sessions transmit and sent in bulk, sendbatchsize
+    # at a time or once per pass of the event loop, whichever comes first.
+    # Set sendbatching to False to send each one immediately
+    sendbatching = True
+    sendbatchsize = 64
+    # sessions are spread across this many sockets by hashing the BMC
+    # address, each socket bringing its own receive buffer
+    socketpoolsize = 16
+    # how many IPMI commands a logged in session may have outstanding at
+    # once, told apart by their sequence numbers.  Set on a session to have
+    # its commands pipelined; there are 64 sequence numbers to go around
+    pipelinewindow = 1
+    # pipelined commands awaiting an answer across all sessions
+    pipelinedrequests = 0
+    # addresses of BMCs, only ever read from the cache.  Those not cached
+    # are looked up on the pool of threads of the cache as sessions are set
+    # up, the event loop picking up the answers, or ahead of time through
+    # preresolve.  resolving_sessions holds the sessions waiting on their
+    # address by (bmc, port), resolverwatched the cache whose descriptor the
+    # event loop watches
+    resolvercache = resolver.ResolverCache(clock=_monotonic_time)
+    resolving_sessions = {}
+    resolverwatched = None
+    resolverfd = None
+    # retransmission timeouts follow the round trip times measured for each
+    # BMC, backing off exponentially when packets go unanswered, within
+    # retryfloor and retryceiling seconds.  A packet is given up on once
+    # retrydeadline seconds have passed since it was first sent
+    retryfloor = 0.2
+    retryceiling = 4
+    retrydeadline = 15
+    # new requests are paced to at most maxrate packets per second overall
+    # and subnetmaxrate to any one subnet, and held back while maxpending
+    # requests overall or subnetmaxpending to a subnet await an answer.
+    # Rates and windows are halved when packets go unanswered and grow back
+    # with replies.  None is no limit on the rate.  BMCs are grouped by
+    # subnetprefix bits for IPv4 and subnetprefix6 for IPv6.  Packets lost
+    # to BMCs that do not answer at all hold nothing back, and the overall
+    # window is halved only once lossquorum BMCs lose packets at once, down
+    # to minpending at the least
+    maxrate = None
+    subnetmaxrate = 1000
+    subnetmaxpending = 128
+    minpending = 64
+    lossquorum = 16
+    # sessions with packets the pacer held back, oldest first, sent from the
+    # event loop as the pacer lets them out
+    pacedsessions = collections.OrderedDict()
+    subnetprefix = 24
+    subnetprefix6 = 64
+    # logins are started a few at a time, those a caller is blocked on first,
+    # and retried after a while when BMCs turn them away as too busy
+    loginscheduler = logins.LoginScheduler(timerheap, _monotonic_time)
+    # what BMCs are capable of, learned at login so that the next one can go
+    # straight to opening the session.  Replace with a CapabilityCache given
+    # a path to keep it across restarts
+    capabilitycache = capabilities.CapabilityCache()
+    # logged in sessions, least recently used first.  Past maxsessions of
+    # them, or once idle for idletimeout seconds, sessions are logged out to
+    # spare keepalives and BMC session slots, and log back in when next used.
+    # None is no limit.  idle_sessions maps sessions to their idle Timer
+    sessionpool = collections.OrderedDict()
+    idle_sessions = {}
+    maxsessions = None
+    idletimeout = None
+    trimming = False
+    # counters and latency histograms of every BMC and of all of them, see
+    # get_metrics
+    metricsregistry = metrics.MetricsRegistry()
+    # set to a tracing.Tracer to have a sample of commands timed as they go
+    # through each step, from raw_command to their callback
+    tracer = None
     # Upon exit of python, make sure we play nice with BMCs by assuring closed
     # sessions for all that we tracked
 
@@ -144,43 +321,49 @@ class Session(object):
         for session in cls.bmc_handlers.itervalues():
             session.cleaningup = True
             session.logout()
+        cls._flush_txqueues()
+        cls.capabilitycache.save()
 
     @classmethod
     def _createsocket(cls):
         atexit.register(cls._cleanup)
-        cls.socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)  # INET6
-                                    # can do IPv4 if you are nice to it
-        try:  # we will try to fixup our receive buffer size if we are smaller
-             # than allowed.
-            maxmf = open("/proc/sys/net/core/rmem_max")
-            rmemmax = int(maxmf.read())
-            rmemmax = rmemmax / 2
-            curmax = cls.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-            curmax = curmax / 2
-            if (rmemmax > curmax):
-                cls.socket.setsockopt(socket.SOL_SOCKET,
-                                      socket.SO_RCVBUF,
-                                      rmemmax)
-        except Exception:
-            # FIXME: be more selective in catching exceptions
-            pass
+        if cls.pollerclass is None:
+            cls.iopoller = poller.get_poller()
+        else:
+            cls.iopoller = cls.pollerclass()
+        if cls.cryptoclass is None:
+            cls.crypto = cryptobackend.get_backend()
+        else:
+            cls.crypto = cls.cryptoclass()
+        cls.readersockets = []
+        cls.socketpool = [None] * cls.socketpoolsize
+        cls.socketfds = {}
+        # we throttle such that we never have more requests awaiting an answer
+        # than the receive buffers should be able to handle, the budget grows
+        # with the pool
+        cls.maxpending = 0
+        cls.pacer = pacing.Pacer(_monotonic_time, cls.maxrate, 0,
+                                 cls.subnetmaxrate, cls.subnetmaxpending,
+                                 cls.minpending, cls.lossquorum)
 
-        curmax = cls.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-        cls.readersockets = [cls.socket]
-        curmax = curmax / 2
-        # we throttle such that we never have no more outstanding packets than
-        # our receive buffer should be able to handle
-        cls.pending = 0
-        cls.maxpending = curmax / 1000
-        # pessimistically assume 1 kilobyte messages,
-        # which is way larger than almost all ipmi datagrams.
-        # For faster performance, sysadmins may want to examine and tune
-        # /proc/sys/net/core/rmem_max up.  This allows the module to request
-        # more, but does not increase buffers for applications that do less
-        # creative things
-        # TODO(jbjohnso): perhaps spread sessions across a socket pool when
-        # rmem_max is small, still get ~65/socket, but avoid long queues that
-        # might happen with low rmem_max and putting thousands of nodes in line
+    @classmethod
+    def _assignsocket(cls, bmc, port):
+        """Pick the socket of the pool a BMC will be talked to through
+
+        Sockets are created as sessions land on them, so the pool and the
+        number of packets allowed in flight grow together up to
+        socketpoolsize sockets.
+        """
+        idx = hash((bmc, port)) % len(cls.socketpool)
+        if cls.socketpool[idx] is None:
+            iosocket = _PoolSocket(cls.recvbatchsize, cls.sendbatchsize)
+            cls.socketpool[idx] = iosocket
+            cls.socketfds[iosocket.socket.fileno()] = iosocket
+            cls.readersockets.append(iosocket.socket)
+            cls.iopoller.register(iosocket.socket)
+            cls.maxpending += iosocket.maxpending
+            cls.pacer.globalscope.limit = cls.maxpending
+        return cls.socketpool[idx]
 
     def _sync_login(self, response):
         """Handle synchronous callers in liue of
@@ -196,22 +379,23 @@ class Session(object):
                 port=623,
                 kg=None,
                 onlogon=None):
-        trueself = None
-        for res in socket.getaddrinfo(bmc, port, 0, socket.SOCK_DGRAM):
-            sockaddr = res[4]
-            if (res[0] == socket.AF_INET):  # convert the sockaddr to AF_INET6
-                newhost = '::ffff:' + sockaddr[0]
-                sockaddr = (newhost, sockaddr[1], 0, 0)
-            if sockaddr in cls.bmc_handlers:
-                self = cls.bmc_handlers[sockaddr]
-                if (self.bmc == bmc and self.userid == userid and
-                        self.password == password and self.kgo == kg):
-                    trueself = self
-                else:
-                    del cls.bmc_handlers[sockaddr]
-            if trueself:
-                return trueself
+        # a session set up for the BMC before is found by the address it
+        # was last known at, or by name while that is still being looked up
+        for self in cls.resolving_sessions.get((bmc, port), ()):
+            if (self.userid == userid and self.password == password and
+                    self.kgo == kg):
+                return self
+        try:
+            sockaddr = cls.resolvercache.cached(bmc, port)[0]
+        except socket.gaierror:
             return object.__new__(cls)
+        if sockaddr in cls.bmc_handlers:
+            self = cls.bmc_handlers[sockaddr]
+            if (self.bmc == bmc and self.userid == userid and
+                    self.password == password and self.kgo == kg):
+                return self
+            del cls.bmc_handlers[sockaddr]
+        return object.__new__(cls)
 
     def __init__(self,
                  bmc,
@@ -222,7 +406,20 @@ class Session(object):
                  onlogon=None):
         if hasattr(self, 'initialized'):
             # new found an existing session, do not corrupt it
+            if self.evicted:
+                # logged out to make room in the pool, log back in
+                self._reuse_evicted(onlogon)
+                return
+            if onlogon is None and self.resolving:
+                # it logs in once its address is known
+                self._wait_resolved()
+            if not (self.logged or self.resolving or
+                    Session.loginscheduler.pending(self)):
+                # its last login failed, have another go for this caller
+                self.login()
             if onlogon is None:
+                if not self.logged:
+                    Session.loginscheduler.expedite(self)
                 while not self.logged:
                     Session.wait_for_rsp()
             else:
@@ -240,26 +437,154 @@ class Session(object):
         self.password = password
         self.nowait = False
         self.pendingpayloads = collections.deque([])
+        # commands issued with a callback while another is outstanding, run
+        # in order as the session frees up
+        self.pendingcommands = collections.deque([])
+        # pipelined commands in flight, by the (netfn, command, seqlun) their
+        # response will carry
+        self.pipelined = {}
         self.kgo = kg
         if kg is not None:
             self.kg = kg
         else:
             self.kg = password
         self.port = port
+        # kept across logins, the BMC is the same one after all
+        self.metrics = Session.metricsregistry.bmc(bmc, port)
+        self.rtt = rtt.RttEstimator(initialtimeout + (0.5 * random.random()),
+                                    self.retryfloor, self.retryceiling)
+        # whether logged out to make room in the session pool, and logging
+        # back in to be used again
+        self.evicted = False
+        self.reviving = False
+        # when the login attempt under way started
+        self.loginstart = None
+        # timeline of the unpipelined command under way if it is traced, and
+        # stamps of the packet being received to add to whichever it answers
+        self.trace = None
+        self.rxmarks = []
+        # when the payload awaiting an answer was first and last sent, and
+        # whether it had to be sent more than once
+        self.firstxmit = None
+        self.xmittime = None
+        self.retransmitted = False
+        # last power state read from the BMC and when, for every Command on
+        # this session to reuse, None once a chassis control has been sent.
+        # Every chassis control starts a new generation, reads sent before
+        # it are not cached when their answer comes in after it
+        self.powerstate = None
+        self.powergeneration = 0
+        # logins of sessions whose constructor blocks until logged in go
+        # ahead of the others queued with the login scheduler
+        self.urgentlogin = onlogon is None
         if (onlogon is None):
             self.async = False
             self.logonwaiters = [self._sync_login]
         else:
             self.async = True
             self.logonwaiters = [onlogon]
-        if not hasattr(Session, 'socket'):
+        if not hasattr(Session, 'socketpool'):
             self._createsocket()
-        self.login()
+        self.iosocket = Session._assignsocket(bmc, port)
+        # those of the subnet of the BMC once its address is known
+        self.pacescopes = Session.pacer.scopes(None)
+        # whether the payload awaiting an answer counts as in flight
+        self.inflight = False
+        self._initsession()
+        # the login starts once the address of the BMC is known, which may
+        # take a lookup on the pool of the resolver cache
+        self.resolving = True
+        self.resolveerror = None
+        Session.resolving_sessions.setdefault((bmc, port), []).append(self)
+        Session._resolve(bmc, port, self._resolved)
         if not self.async:
+            self._wait_resolved()
             while not self.logged:
                 Session.wait_for_rsp()
 
+    @classmethod
+    def _resolve(cls, bmc, port, callback):
+        cache = cls.resolvercache
+        if (cls.resolverwatched is not cache and
+                not cache.current(bmc, port)):
+            # a lookup is to be made, have the event loop watch for it
+            if cls.resolverwatched is not None:
+                cls.iopoller.unregister(cls.resolverwatched)
+                cls.readersockets.remove(cls.resolverwatched)
+            cls.iopoller.register(cache)
+            cls.readersockets.append(cache)
+            cls.resolverfd = cache.fileno()
+            cls.resolverwatched = cache
+        cache.resolve(bmc, port, callback)
+
+    def _resolved(self, result):
+        self.resolving = False
+        key = (self.bmc, self.port)
+        Session.resolving_sessions[key].remove(self)
+        if not Session.resolving_sessions[key]:
+            del Session.resolving_sessions[key]
+        if isinstance(result, socket.gaierror):
+            self.resolveerror = result
+            # a blocked caller has it raised by _wait_resolved instead
+            waiters = [waiter for waiter in self.logonwaiters
+                       if waiter != self._sync_login]
+            self.logonwaiters = []
+            while waiters:
+                waiters.pop()({'error': str(result)})
+            return
+        for sockaddr in result:
+            Session.bmc_handlers[sockaddr] = self
+        self.pacescopes = Session.pacer.scopes(self._subnet())
+        self.login()
+
+    def _wait_resolved(self):
+        while self.resolving:
+            Session.wait_for_rsp()
+        if self.resolveerror is not None:
+            raise self.resolveerror
+
+    def _reuse_evicted(self, onlogon):
+        """Have an evicted session that new found log back in for a caller
+        """
+        self._revive()
+        if onlogon is None:
+            if self.reviving:
+                Session.loginscheduler.expedite(self)
+            while self.reviving:
+                Session.wait_for_rsp()
+            if self.evicted:
+                raise exc.IpmiException(self.reviveerror)
+        elif self.reviving:
+            # after the revival itself, which the waiters are popped off for
+            self.logonwaiters.insert(0, onlogon)
+        else:
+            onlogon({'error': self.reviveerror})
+
+    def _subnet(self):
+        try:
+            sockaddrs = Session.resolvercache.cached(self.bmc, self.port)
+        except socket.gaierror:
+            return None
+        return pacing.subnet_of(sockaddrs[0], self.subnetprefix,
+                                self.subnetprefix6)
+
     def onlogon(self, parameter):
+        success = 'error' not in parameter
+        if self.loginstart is not None:
+            self.metrics.login(success, _monotonic_time() - self.loginstart)
+            self.loginstart = None
+        if (not success and self.capsfromcache and not self.loginbusy and
+                self.sessioncontext != 'FAILED'):
+            # what was known of the BMC may be what made it fail, find out
+            # afresh before giving up
+            Session.capabilitycache.forget(self.bmc, self.port)
+            self._halt_login()
+            self._begin_login()
+            return
+        if not success:
+            self._halt_login()
+        if not Session.loginscheduler.finished(self, success, self.loginbusy):
+            return  # to be tried again in a while
         while self.logonwaiters:
             waiter = self.logonwaiters.pop()
             waiter(parameter)
@@ -278,6 +603,12 @@ class Session(object):
         self.aeskey = None
         self.integrityalgo = 0
         self.k1 = None
+        # cipher suite the BMC took up in its open session response, if it
+        # is one of those defined
+        self.ciphersuite = None
+        # keyed contexts from the crypto backend, set up upon RAKP4
+        self.integrity = None
+        self.confidentiality = None
         self.rmcptag = 1
         self.ipmicallback = None
         self.ipmicallbackargs = None
@@ -286,7 +617,6 @@ class Session(object):
         self.sessionid = 0
         self.authtype = 0
         self.ipmiversion = 1.5
-        self.timeout = initialtimeout + (0.5 * random.random())
         self.seqlun = 0
         # NOTE(jbjohnso): per IPMI table 5-4, software ids in the ipmi spec may
         #                 be 0x81 through 0x8d.  We'll stick with 0x81 for now,
@@ -294,6 +624,11 @@ class Session(object):
         self.rqaddr = 0x81
 
         self.logged = 0
+        # whether the login failed for the BMC being busy, or not answering,
+        # and is worth retrying
+        self.loginbusy = False
+        # whether the login skipped asking what the BMC is capable of
+        self.capsfromcache = False
         # NOTE(jbjohnso): when we confirm a working sockaddr, put it here to
         #                 skip getaddrinfo
         self.sockaddr = None
@@ -306,6 +641,9 @@ class Session(object):
         #                 this should gracefully be backwards compat, but some
         #                 1.5 implementations checked reserved bits
         self.ipmi15only = 0
+        self.remseqwindow = _ReplayWindow()
+        # packets the pacer has not let out yet, in the order they are to go
+        self.heldpackets = collections.deque()
         self.sol_handler = None
         # NOTE(jbjohnso): This is the callback handler for any SOL payload
 
@@ -334,14 +672,16 @@ class Session(object):
             self.seqlun += 4  # the last two bits are lun, so add 4 to add 1
             self.seqlun &= 0xff  # we only have one byte, wrap when exceeded
             seqincrement -= 1
-        header = [0x20, netfn << 2]
-            #figure 13-4, first two bytes are rsaddr and
-                               # netfn, rsaddr is always 0x20 since we are
-                               # addressing BMC
-        reqbody = [self.rqaddr, self.seqlun, command] + list(data)
-        headsum = self._checksum(*header)
-        bodysum = self._checksum(*reqbody)
-        payload = header + [headsum] + reqbody + [bodysum]
+        return self._frame_ipmi_request(netfn, command, self.seqlun, data)
+
+    def _frame_ipmi_request(self, netfn, command, seqlun, data):
+        #figure 13-4, first two bytes are rsaddr and netfn, rsaddr is always
+        # 0x20 since we are addressing BMC
+        headsum = self._checksum(0x20, netfn << 2)
+        payload = bytearray((0x20, netfn << 2, headsum,
+                             self.rqaddr, seqlun, command))
+        payload.extend(data)
+        payload.append(self._checksum(*payload[3:]))
         return payload
 
     def _generic_callback(self, response):
@@ -358,9 +698,47 @@ class Session(object):
                     callback=None,
                     callback_args=None,
                     delay_xmit=None):
-        while self.incommand:
+        if netfn == 0 and command == 2:
+            # chassis control, the power state last read will not hold
+            self.powerstate = None
+            self.powergeneration += 1
+        if self.evicted:
+            # logged out to make room in the pool, log back in first
+            self._revive()
+            if self.reviving and callback is not None:
+                self.pendingcommands.append((netfn, command, data, retry,
+                                             callback, callback_args,
+                                             delay_xmit))
+                return
+            if self.reviving:
+                Session.loginscheduler.expedite(self)
+            while self.reviving:
+                Session.wait_for_rsp()
+            if self.evicted:
+                response = {'error': self.reviveerror}
+                if callback is None:
+                    return response
+                call_with_optional_args(callback, response, callback_args)
+                return
+        if callback != self._keepalive_response:  # keepalives are not use
+            self._touch()
+        if retry and self.logged and self.pipelinewindow > 1:
+            return self._pipelined_command(netfn, command, data, callback,
+                                           callback_args, delay_xmit)
+        # the logout sent on exit goes out right away, whatever is under way,
+        # as there is no event loop left to wait on
+        if self.incommand and callback is not None and not self.cleaningup:
+            # the caller is not waiting on us, so rather than spinning the
+            # event loop until the session is free, get to it when it is
+            self.pendingcommands.append((netfn, command, data, retry,
+                                         callback, callback_args,
+                                         delay_xmit))
+            return
+        while self.incommand and not self.cleaningup:
             Session.wait_for_rsp()
         self.incommand = True
+        # traced from here, once it goes out rather than while queued
+        self.trace = self._start_trace(netfn, command)
         self.ipmicallbackargs = callback_args
         if callback is None:
             self.lastresponse = None
@@ -385,16 +763,191 @@ class Session(object):
                 Session.wait_for_rsp(timeout=timeout)
             return self.lastresponse
 
+    def _next_command(self):
+        """Start queued commands for as long as the session has room
+        """
+        if self.evicted:  # held until logged back in
+            return
+        while self.pendingcommands:
+            retry = self.pendingcommands[0][3]
+            if retry and self.logged and self.pipelinewindow > 1:
+                if len(self.pipelined) >= self.pipelinewindow:
+                    return
+            elif self.incommand:
+                return
+            self.raw_command(*self.pendingcommands.popleft())
+
+    def _start_trace(self, netfn, command):
+        if Session.tracer is None:
+            return None
+        return Session.tracer.start(self.bmc, self.port, netfn, command)
+
+    def _pipelined_command(self, netfn, command, data, callback,
+                           callback_args, delay_xmit):
+        """Send a command alongside others outstanding on the session
+
+        Each command has a sequence number, retry timer and callback of its
+        own, so answers are taken in whatever order they come back.
+        """
+        if len(self.pipelined) >= self.pipelinewindow:
+            if callback is not None:
+                self.pendingcommands.append((netfn, command, data, True,
+                                             callback, callback_args,
+                                             delay_xmit))
+                return
+            while len(self.pipelined) >= self.pipelinewindow:
+                Session.wait_for_rsp()
+        trace = self._start_trace(netfn, command)
+        seqlun = self._pipelined_seqlun(netfn, command)
+        request = {
+            'key': (netfn + 1, command, seqlun),
+            'payload': self._frame_ipmi_request(netfn, command, seqlun, data),
+            'callback': callback,
+            'callback_args': callback_args,
+            'timeout': self.rtt.rto,
+            'timer': None,
+            'firstxmit': None,
+            'xmittime': None,
+            'sent': False,
+            'retried': False,
+            'trace': trace,
+        }
+        if trace is not None:
+            trace.mark('payload')
+        self.pipelined[request['key']] = request
+        Session.pipelinedrequests += 1
+        if delay_xmit is not None:
+            self._arm_request(request, delay_xmit)
+        else:
+            self._xmit_request(request)
+        if callback is None:
+            while 'response' not in request:
+                Session.wait_for_rsp()
+            return request['response']
+
+    def _pipelined_seqlun(self, netfn, command):
+        """Pick a sequence number no outstanding request is going to answer
+        """
+        fallback = None
+        for _ in xrange(64):
+            seqlun = self.seqlun
+            self.seqlun = (seqlun + 4) & 0xff  # the last two bits are lun
+            key = (netfn + 1, command, seqlun)
+            if key in self.pipelined:
+                continue
+            if not self.tabooseq.get(key):
+                return seqlun
+            # Allow taboo to eventually expire after a few rounds
+            self.tabooseq[key] -= 1
+            if fallback is None:
+                fallback = seqlun
+        return fallback
+
+    def _xmit_request(self, request, throttle=True):
+        if throttle and not self.nowait and self._hold(request=request):
+            return
+        trace = request['trace']
+        if trace is not None:
+            trace.mark('throttle')
+        request['xmittime'] = _monotonic_time()
+        if not request['sent']:
+            request['firstxmit'] = request['xmittime']
+        Session.pacer.sent(self.pacescopes, not request['sent'])
+        request['sent'] = True
+        netpacket = self._make_netpacket(request['payload'],
+                                         constants.payload_types['ipmi'])
+        if trace is not None:
+            trace.mark('encrypt')
+        if self.sequencenumber:
+            self.sequencenumber += 1
+        if self in Session.keepalive_sessions:
+            self._arm_keepalive()
+        self._arm_request(request, request['timeout'])
+        self._sendto(netpacket, self.sockaddr)
+        if trace is not None:
+            trace.mark('xmit')
+
+    def _arm_request(self, request, delay):
+        request['timer'] = Session.timerheap.schedule(
+            _monotonic_time() + delay, self._request_expired, request)
+
+    def _request_expired(self, request):
+        request['timer'] = None
+        if not request['sent']:  # held back by delay_xmit, now is the time
+            self._xmit_request(request, throttle=False)
+            return
+        Session.pacer.loss(self.pacescopes, (self.bmc, self.port))
+        elapsed = _monotonic_time() - request['firstxmit']
+        if elapsed >= self.retrydeadline:
+            self.metrics.timeout()
+            self._finish_request(request, {'error': 'timeout'},
+                                 answered=False)
+            return
+        request['timeout'] = min(self.rtt.backoff(request['timeout']),
+                                 self.retrydeadline - elapsed)
+        # act as if the command is idempotent, as with unpipelined commands,
+        # and remember the ambiguity on the wire
+        request['retried'] = True
+        self.metrics.retry()
+        if request['trace'] is not None:
+            request['trace'].mark('retransmit')
+        self._xmit_request(request, throttle=False)
+
+    def _pipelined_response(self, request, payload):
+        self.metrics.command(request['key'][0] - 1, request['key'][1],
+                             _monotonic_time() - request['firstxmit'])
+        if request['retried']:
+            # try to skip it for at most 16 cycles of overflow
+            self.tabooseq[request['key']] = 16
+        else:
+            self.rtt.sample(_monotonic_time() - request['xmittime'])
+        response = {
+            'netfn': payload[1] >> 2,
+            'command': payload[5],
+            'code': payload[6],
+            'data': list(payload[7:-1]),  # drop the trailing checksum
+        }
+        if request['trace'] is not None:
+            request['trace'].marks.extend(self.rxmarks)
+            request['trace'].mark('parse')
+        self._finish_request(request, response)
+
+    def _finish_request(self, request, response, answered=True):
+        del self.pipelined[request['key']]
+        Session.pipelinedrequests -= 1
+        if request['sent']:
+            Session.pacer.landed(self.pacescopes, answered,
+                                 (self.bmc, self.port))
+        if request['timer'] is not None:
+            Session.timerheap.cancel(request['timer'])
+            request['timer'] = None
+        if request['callback'] is None:
+            errorstr = get_ipmi_error(response)
+            if errorstr:
+                response['error'] = errorstr
+            self.lastresponse = response
+            request['response'] = response
+        else:
+            call_with_optional_args(request['callback'],
+                                    response,
+                                    request['callback_args'])
+        if request['trace'] is not None:
+            request['trace'].finish('answered' if answered else 'timeout')
+        self._next_command()
+
     def _send_ipmi_net_payload(self, netfn, command, data, retry=True,
                                delay_xmit=None):
         ipmipayload = self._make_ipmi_payload(netfn, command, data)
+        if self.trace is not None:
+            self.trace.mark('payload')
         payload_type = constants.payload_types['ipmi']
         self.send_payload(payload=ipmipayload, payload_type=payload_type,
                           retry=retry, delay_xmit=delay_xmit)
 
     def send_payload(self, payload=None, payload_type=None, retry=True,
                      delay_xmit=None):
-        if payload is not None and self.lastpayload is not None:
+        if (payload is not None and self.lastpayload is not None and
+                not self.cleaningup):
                              #we already have a packet outgoing, make this
                              # a pending payload
                              # this way a simplistic BMC won't get confused
@@ -407,117 +960,64 @@ class Session(object):
             payload_type = self.last_payload_type
         if payload is None:
             payload = self.lastpayload
-        message = [0x6, 0, 0xff, 0x07]  # constant RMCP header for IPMI
+        elif not self.nowait:
+            # a new exchange, as opposed to one being retried by _timedout,
+            # its latency counting from here whether it is retried or not
+            self.firstxmit = _monotonic_time()
+            self.xmittime = None
+            self.retransmitted = False
+            if retry:
+                self.timeout = self.rtt.rto
         if retry:
             self.lastpayload = payload
             self.last_payload_type = payload_type
-        message.append(self.authtype)
-        baretype = payload_type
-        if self.integrityalgo:
-            payload_type |= 0b01000000
-        if self.confalgo:
-            payload_type |= 0b10000000
-        if (self.ipmiversion == 2.0):
-            message.append(payload_type)
-            if (baretype == 2):
-                #TODO(jbjohnso): OEM payload types
-                raise NotImplementedError("OEM Payloads")
-            elif baretype not in constants.payload_types.values():
-                raise NotImplementedError(
-                    "Unrecognized payload type %d" % baretype)
-            message += struct.unpack("!4B", struct.pack("<I", self.sessionid))
-        message += struct.unpack("!4B", struct.pack("<I", self.sequencenumber))
-        if (self.ipmiversion == 1.5):
-            message += struct.unpack("!4B", struct.pack("<I", self.sessionid))
-            if not self.authtype == 0:
-                message += self._ipmi15authcode(payload)
-            message.append(len(payload))
-            message += payload
-            totlen = 34 + \
-                len(message)  # Guessing the ipmi spec means the whole
-                                   # packet and assume no tag in old 1.5 world
-            if (totlen in (56, 84, 112, 128, 156)):
-                message.append(0)  # Legacy pad as mandated by ipmi spec
-        elif self.ipmiversion == 2.0:
-            psize = len(payload)
-            if self.confalgo:
-                pad = (
-                    psize + 1) % 16  # pad has to cope with one byte field like
-                                   # the _aespad function
-                if pad:  # if no pad needed, then we take no more action
-                    pad = 16 - pad
-                newpsize = psize + pad + \
-                    17  # new payload size grew according to pad
-                                      # size, plus pad length, plus 16 byte IV
-                                      #(Table 13-20)
-                message.append(newpsize & 0xff)
-                message.append(newpsize >> 8)
-                iv = os.urandom(16)
-                message += list(struct.unpack("16B", iv))
-                payloadtocrypt = _aespad(payload)
-                crypter = AES.new(self.aeskey, AES.MODE_CBC, iv)
-                crypted = crypter.encrypt(struct.pack("%dB" %
-                                                      len(payloadtocrypt),
-                                                      *payloadtocrypt))
-                crypted = list(struct.unpack("%dB" % len(crypted), crypted))
-                message += crypted
-            else:  # no confidetiality algorithm
-                message.append(psize & 0xff)
-                message.append(psize >> 8)
-                message += list(payload)
-            if self.integrityalgo:  # see table 13-8,
-                                   # RMCP+ packet format
-                                   # TODO(jbjohnso): SHA256 which is now
-                                   # allowed
-                neededpad = (len(message) - 2) % 4
-                if neededpad:
-                    neededpad = 4 - neededpad
-                message += [0xff] * neededpad
-                message.append(neededpad)
-                message.append(7)  # reserved, 7 is the required value for the
-                                  # specification followed
-                integdata = message[4:]
-                authcode = HMAC.new(self.k1,
-                                    struct.pack("%dB" % len(integdata),
-                                                *integdata),
-                                    SHA).digest()[:12]  # SHA1-96
-                                    # per RFC2404 truncates to 96 bits
-                message += struct.unpack("12B", authcode)
-        self.netpacket = struct.pack("!%dB" % len(message), *message)
+        self.netpacket = self._make_netpacket(payload, payload_type)
+        if self.trace is not None:
+            self.trace.mark('encrypt')
         #advance idle timer since we don't need keepalive while sending packets
         #out naturally
         if self in Session.keepalive_sessions:
-            Session.keepalive_sessions[self]['timeout'] = _monotonic_time() + \
-                25 + (random.random() * 4.9)
+            self._arm_keepalive()
         self._xmit_packet(retry, delay_xmit=delay_xmit)
 
+    def _make_netpacket(self, payload, payload_type):
+        """Frame a payload for the wire as of the current sequence number
+        """
+        if self.ipmiversion == 1.5:
+            return codec.encode_ipmi15(self.authtype, self.sequencenumber,
+                                       self.sessionid, payload,
+                                       self._ipmi15authcode(payload))
+        if payload_type == 2:
+            #TODO(jbjohnso): OEM payload types
+            raise NotImplementedError("OEM Payloads")
+        elif payload_type not in constants.payload_types.values():
+            raise NotImplementedError(
+                "Unrecognized payload type %d" % payload_type)
+        return codec.encode_rmcpplus(payload_type, self.sessionid,
+                                     self.sequencenumber, payload,
+                                     self.integrity, self.confidentiality)
+
     def _ipmi15authcode(self, payload, checkremotecode=False):
         #checkremotecode is used to verify remote code,
         #otherwise this function is used to general authcode for local
         if self.authtype == 0:  # Only for things before auth in ipmi 1.5, not
                                 # like 2.0 cipher suite 0
-            return ()
+            return ''
         password = self.password
         padneeded = 16 - len(password)
         if padneeded < 0:
             raise exc.IpmiException("Password is too long for ipmi 1.5")
         password += '\x00' * padneeded
-        passdata = struct.unpack("16B", password)
         if checkremotecode:
-            seqbytes = struct.unpack("!4B",
-                                     struct.pack("<I", self.remsequencenumber))
+            seqnumber = self.remsequencenumber
         else:
-            seqbytes = struct.unpack("!4B",
-                                     struct.pack("<I", self.sequencenumber))
-        sessdata = struct.unpack("!4B", struct.pack("<I", self.sessionid))
-        bodydata = passdata + sessdata + tuple(payload) + seqbytes + passdata
-        dgst = hashlib.md5(
-            struct.pack("%dB" % len(bodydata), *bodydata)).digest()
-        hashdata = struct.unpack("!%dB" % len(dgst), dgst)
-        return hashdata
+            seqnumber = self.sequencenumber
+        return codec.ipmi15_authcode(password, self.sessionid, seqnumber,
+                                     payload)
 
     def _got_channel_auth_cap(self, response):
         if 'error' in response:
+            self.loginbusy = True  # timed out
             self.onlogon(response)
             return
         if response['code'] == 0xcc and self.ipmi15only is not None:
@@ -528,6 +1028,7 @@ class Session(object):
         mysuffix = " while trying to get channel authentication capabalities"
         errstr = get_ipmi_error(response, suffix=mysuffix)
         if errstr:
+            self.loginbusy = self._login_busy(response)
             self.onlogon({'error': errstr})
             return
         data = response['data']
@@ -548,6 +1049,7 @@ class Session(object):
         errstr = get_ipmi_error(response,
                                 suffix=" while getting session challenge")
         if errstr:
+            self.loginbusy = self._login_busy(response)
             self.onlogon({'error': errstr})
             return
         data = response['data']
@@ -568,6 +1070,7 @@ class Session(object):
     def _activated_session(self, response):
         errstr = get_ipmi_error(response)
         if errstr:
+            self.loginbusy = self._login_busy(response)
             self.onlogon({'error': errstr})
             return
         data = response['data']
@@ -587,13 +1090,19 @@ class Session(object):
             self.privlevel, self.userid)
         errstr = get_ipmi_error(response, suffix=mysuffix)
         if errstr:
+            self.loginbusy = self._login_busy(response)
             self.onlogon({'error': errstr})
             return
+        ciphersuites = ()
+        if self.ipmiversion == 2.0 and self.ciphersuite is not None:
+            ciphersuites = (self.ciphersuite,)
+        Session.capabilitycache.record(self.bmc, self.port, self.ipmiversion,
+                                       self.ipmi15only, self.currentchannel,
+                                       ciphersuites)
         self.logged = 1
-        Session.keepalive_sessions[self] = {}
-        Session.keepalive_sessions[self]['ipmisession'] = self
-        Session.keepalive_sessions[self]['timeout'] = _monotonic_time() + \
-            25 + (random.random() * 4.9)
+        self._arm_keepalive()
+        self._touch()
+        Session._trim_pool()
         self.onlogon({'success': True})
 
     def _get_session_challenge(self):
@@ -641,9 +1150,51 @@ class Session(object):
                                         data=[0x8e, self.privlevel])
 
     def login(self):
+        self._initsession()
+        Session.loginscheduler.submit(self, urgent=self.urgentlogin)
+
+    def _begin_login(self):
+        """Start the handshake, once the login scheduler gets to it
+        """
         self.logontries = 5
         self._initsession()
-        self._get_channel_auth_cap()
+        self.loginstart = _monotonic_time()
+        self.metrics.loginattempt()
+        self._start_handshake()
+
+    def _start_handshake(self):
+        """Open the session, skipping ahead if the BMC is known already
+        """
+        caps = Session.capabilitycache.get(self.bmc, self.port)
+        if caps is None:
+            return self._get_channel_auth_cap()
+        self.capsfromcache = True
+        # a handshake that times out is reported from here, as it would be
+        # had it started out by asking
+        self.ipmicallback = self._got_channel_auth_cap
+        self.ipmiversion = caps['ipmiversion']
+        self.ipmi15only = caps['ipmi15only']
+        self.currentchannel = caps['channel']
+        if self.ipmiversion == 2.0:
+            self._open_rmcpplus_request()
+        else:
+            self._get_session_challenge()
+
+    def _halt_login(self):
+        """Keep a failed handshake from carrying on with stray answers
+        """
+        self._abandon_payloads()
+        self.sessioncontext = 'FAILED'
+        self.expectednetfn = 0x1ff
+        self.expectedcmd = 0x1ff
+
+    def _login_busy(self, response):
+        """Whether a step of the login was turned away for being busy
+        """
+        if 'error' in response:  # timed out
+            return True
+        return response['code'] in constants.login_busy_codes.get(
+            response['command'], ())
 
     @classmethod
     def wait_for_rsp(cls, timeout=None, callout=True):
@@ -663,7 +1214,6 @@ class Session(object):
         #Instance C gets to go ahead of Instance A, because
         #Instance C can get work done, but instance A cannot
 
-        curtime = _monotonic_time()
         # There ar a number of parties that each has their own timeout
         # The caller can specify a deadline in timeout argument
         # each session with active outbound payload has callback to
@@ -671,84 +1221,284 @@ class Session(object):
         # each session that is 'alive' wants to send a keepalive ever so often.
         # We want to make sure the most strict request is honored and block for
         # no more time than that, so that whatever part(ies) need to service in
-        # a deadline, will be honored
+        # a deadline, will be honored.  All of those deadlines live in one
+        # heap, so only the soonest needs to be consulted, along with when
+        # the pacer lets out the next packet it held back
+        cls._release_paced()
         if timeout != 0:
-            for session, parms in cls.waiting_sessions.iteritems():
-                if parms['timeout'] <= curtime:
-                    timeout = 0  # exit after one guaranteed pass
-                    break
-                if (timeout is not None and
-                        timeout < parms['timeout'] - curtime):
-                    continue  # timeout smaller than the current session needs
-                timeout = parms['timeout'] - curtime  # set new timeout value
-            for session, parms in cls.keepalive_sessions.iteritems():
-                if parms['timeout'] <= curtime:
-                    timeout = 0
-                    break
-                if (timeout is not None and
-                        timeout < parms['timeout'] - curtime):
-                    continue
-                timeout = parms['timeout'] - curtime
-        # If the loop above found no sessions wanting *and* the caller had no
+            deadline = cls.timerheap.next_deadline()
+            if deadline is not None:
+                deadline = max(deadline - _monotonic_time(), 0)
+                if timeout is None or deadline < timeout:
+                    timeout = deadline
+            if cls.pacedsessions:
+                delay = cls._paced_delay()
+                if delay is not None and (timeout is None or
+                                          delay < timeout):
+                    timeout = delay
+        # If no sessions are wanting *and* the caller had no
         # timeout, exit function. In this case there is no way a session
         # could be waiting so we can always return 0
         while cls.iterwaiters:
             waiter = cls.iterwaiters.pop()
             waiter({'success': True})
-        if timeout is None:
+        cls._flush_txqueues()
+        if timeout is None and not cls.resolvercache.pending():
             return 0
-        rdylist, _, _ = select.select(cls.readersockets, (), (), timeout)
-        if len(rdylist) > 0:
-            while _poller((cls.socket,)):  # if the somewhat lengthy
-                        # queue # processing takes long enough for packets to
-                        # come in, be eager
-                pktqueue = collections.deque([])
-                while _poller((cls.socket,)):  # looks rendundant, but
-                              # want # to queue and process packets to keep
-                              # things off RCVBUF
-                    rdata = cls.socket.recvfrom(3000)
-                    pktqueue.append(rdata)
-                while len(pktqueue):
-                    (data, sockaddr) = pktqueue.popleft()
-                    cls._route_ipmiresponse(sockaddr, data)
-                    while _poller((cls.socket,)):  # seems ridiculous,
-                         #but between every callback, check for packets again
-                        rdata = cls.socket.recvfrom(3000)
-                        pktqueue.append(rdata)
-            for handlepair in _poller(cls.readersockets):
-                if isinstance(handlepair, int):
-                    myhandle = handlepair
-                else:
-                    myhandle = handlepair.fileno()
-                if myhandle != cls.socket.fileno() and callout:
-                    myfile = cls._external_handlers[myhandle][1]
-                    cls._external_handlers[myhandle][0](myfile)
-        sessionstodel = []
-        for session, parms in cls.keepalive_sessions.iteritems():
-            if parms['timeout'] < curtime:
-                cls.keepalive_sessions[session]['timeout'] = 25 + \
-                    (random.random() * 4.9)
-                session._keepalive()
-        for session, parms in cls.waiting_sessions.iteritems():
-            if parms['timeout'] < curtime:  # timeout has expired, time to
-                                            # give up on it and trigger timeout
-                                            # response in the respective
-                                            # session
-                sessionstodel.append(
-                    session)  # defer deletion until after loop
-                                              # to avoid confusing the for loop
-        for session in sessionstodel:
-            cls.pending -= 1
-            cls.waiting_sessions.pop(session, None)
-            session._timedout()
-        return len(cls.waiting_sessions)
+        rdylist = cls.iopoller.poll(timeout)
+        # os.times ticks too coarsely to time a pass
+        woken = time.time()
+        for myhandle in rdylist:
+            if myhandle in cls.socketfds:
+                cls.socketfds[myhandle].process()
+            elif myhandle == cls.resolverfd:
+                cls.resolverwatched.complete()
+            elif callout and myhandle in cls._external_handlers:
+                myfile = cls._external_handlers[myhandle][1]
+                cls._external_handlers[myhandle][0](myfile)
+        # fire keepalives that are due and give up on (or retry) packets
+        # whose timeout has expired in the respective session
+        cls.timerheap.run_expired(_monotonic_time())
+        # send what the callbacks and retries above had to say right away,
+        # rather than waiting for the next time through, along with what the
+        # answers and timeouts made room for
+        cls._release_paced()
+        cls._flush_txqueues()
+        cls.metricsregistry.looplatency.observe(time.time() - woken)
+        return (len(cls.waiting_sessions) + cls.pipelinedrequests +
+                len(cls.resolving_sessions))
+
+    @classmethod
+    def get_handles(cls):
+        """Handles for an external event loop to watch for input
+
+        An application that runs its own event loop should watch these and,
+        whenever one is readable or get_timeout seconds have passed, call
+        wait_for_rsp(timeout=0).  Where the poller backend has a descriptor
+        of its own, that is all that is returned.  Otherwise the list grows
+        as sessions are created, so ask again after creating sessions.
+        """
+        if not hasattr(Session, 'socketpool'):
+            cls._createsocket()
+        fileno = cls.iopoller.fileno()
+        if fileno is not None:
+            return [fileno]
+        return list(cls.readersockets)
+
+    @classmethod
+    def get_timeout(cls):
+        """Seconds until wait_for_rsp next has retries or keepalives to do,
+        or packets held back by the pacer to send
+
+        :returns: 0 if there is work already due, None if there are no timers
+        """
+        if cls.iterwaiters:
+            return 0
+        paced = None
+        if cls.pacedsessions:
+            paced = cls._paced_delay()
+            if paced == 0:
+                return 0
+        if hasattr(Session, 'socketpool'):
+            for iosocket in cls.socketpool:
+                if iosocket is not None and iosocket.txqueue:
+                    return 0
+        deadline = cls.timerheap.next_deadline()
+        if deadline is not None:
+            deadline = max(deadline - _monotonic_time(), 0)
+        if paced is not None and (deadline is None or paced < deadline):
+            return paced
+        return deadline
+
+    @classmethod
+    def get_metrics(cls, perbmc=True):
+        """A snapshot of the counters and latency histograms of the sessions
+
+        :param perbmc: whether to include those of every BMC under 'bmcs',
+                       by (host, port), besides those of all together
+        :returns: dict with counts of commands answered, retries, timeouts,
+                  login attempts, logins and failed logins, packets dropped
+                  by reason under 'drops', and command and login latency
+                  histograms, command ones also by (netfn, command) under
+                  'bycommand'
+        """
+        return cls.metricsregistry.state(perbmc)
+
+    @classmethod
+    def _flush_txqueues(cls):
+        for iosocket in cls.socketpool:
+            if iosocket is not None and iosocket.txqueue:
+                iosocket.flush()
+
+    def _arm_keepalive(self):
+        deadline = _monotonic_time() + 25 + (random.random() * 4.9)
+        if self in Session.keepalive_sessions:
+            Session.timerheap.reschedule(Session.keepalive_sessions[self],
+                                         deadline)
+        else:
+            Session.keepalive_sessions[self] = Session.timerheap.schedule(
+                deadline, self._keepalive_expired)
+
+    def _keepalive_expired(self):
+        self._arm_keepalive()
+        self._keepalive()
+
+    def _arm_retry(self, deadline):
+        if self in Session.waiting_sessions:
+            Session.timerheap.reschedule(Session.waiting_sessions[self],
+                                         deadline)
+        else:
+            Session.waiting_sessions[self] = Session.timerheap.schedule(
+                deadline, self._retry_expired)
+
+    def _cancel_retry(self):
+        timer = Session.waiting_sessions.pop(self, None)
+        if timer is not None:
+            Session.timerheap.cancel(timer)
+
+    def _retry_expired(self):
+        del Session.waiting_sessions[self]
+        if self.inflight:
+            Session.pacer.loss(self.pacescopes, (self.bmc, self.port))
+        self._timedout()
+
+    def _exchange_over(self, answered):
+        """The payload awaiting an answer got one, or is given up on
+        """
+        self._cancel_retry()
+        if self.inflight:
+            self.inflight = False
+            Session.pacer.landed(self.pacescopes, answered,
+                                 (self.bmc, self.port))
+
+    def _touch(self):
+        """Mark a logged in session as the most recently used in the pool
+        """
+        if not self.logged:
+            return
+        Session.sessionpool.pop(self, None)
+        Session.sessionpool[self] = True
+        if self.idletimeout is None:
+            return
+        deadline = _monotonic_time() + self.idletimeout
+        if self in Session.idle_sessions:
+            Session.timerheap.reschedule(Session.idle_sessions[self],
+                                         deadline)
+        else:
+            Session.idle_sessions[self] = Session.timerheap.schedule(
+                deadline, self._idle_expired)
+
+    def _busy(self):
+        return bool(self.incommand or self.pipelined or self.pendingcommands)
+
+    def _idle_expired(self):
+        del Session.idle_sessions[self]
+        if self._busy():  # a command has been going on all along
+            self._touch()
+        else:
+            self._evict()
+
+    @classmethod
+    def _trim_pool(cls):
+        """Evict the least recently used sessions that are idle, if too many
+        """
+        # a logout may run callbacks, during which more logins finish and
+        # ask again, the loop here sees to them as well
+        if cls.maxsessions is None or cls.trimming:
+            return
+        cls.trimming = True
+        try:
+            while len(cls.sessionpool) > cls.maxsessions:
+                for session in cls.sessionpool:
+                    if not session._busy():
+                        break
+                else:  # all busy, leave it to the next login
+                    return
+                session._evict()
+        finally:
+            cls.trimming = False
+
+    def _evict(self):
+        """Log out to make room, logging back in when next used
+
+        The session stays the handler of its BMC, so that a new one for the
+        same BMC and credentials is this one rather than one to contend with
+        for the answers.
+        """
+        self.logout(callback=self._evicted)
+        # a lost answer to the logout must not hold up the next command
+        self.incommand = False
+        self.evicted = True
+
+    def _evicted(self, response):
+        pass
+
+    def _sockaddrs(self):
+        if self.sockaddr is not None:
+            return (self.sockaddr,)
+        try:
+            return Session.resolvercache.cached(self.bmc, self.port)
+        except socket.gaierror:
+            return ()
+
+    def _revive(self):
+        """Log an evicted session back in, unless already under way
+
+        A session that another has since replaced as the handler of the BMC,
+        one with other credentials, is not revived over it.
+        """
+        if self.reviving:
+            return
+        self.reviving = True
+        for sockaddr in self._sockaddrs():
+            if Session.bmc_handlers.get(sockaddr, self) is not self:
+                self._revived(
+                    {'error': 'Session replaced by another to the BMC'})
+                return
+        self.logonwaiters = [self._revived]
+        self.login()
+
+    def _revived(self, response):
+        self.reviving = False
+        if 'error' in response:
+            self.reviveerror = response['error']
+            # commands held for the login will not get anywhere
+            commands = self.pendingcommands
+            self.pendingcommands = collections.deque([])
+            for command in commands:
+                call_with_optional_args(command[4],
+                                        {'error': self.reviveerror},
+                                        command[5])
+            return
+        self.evicted = False
+        self._next_command()
 
     def _keepalive(self):
         """Performs a keepalive to avoid idle disconnect
         """
-        if self.incommand:  # if currently in command, no cause to keepalive
+        # if currently in command, no cause to keepalive
+        if self.incommand or self.pipelined:
             return
-        self.raw_command(netfn=6, command=1)
+        if self.paced():
+            # nothing is waiting on this one, so try again in a while
+            Session.timerheap.reschedule(
+                Session.keepalive_sessions[self],
+                _monotonic_time() + 1 + random.random())
+            return
+        # nothing needs the answer, so do not hold up the event loop for it
+        self.raw_command(netfn=6, command=1, callback=self._keepalive_response)
+
+    def _keepalive_response(self, response):
+        pass
+
+    def paced(self):
+        """Whether a command sent now would be held back by the pacer
+
+        Timer callbacks that nothing is waiting on check this and try again
+        later rather than send, so as not to add to what the pacer holds
+        back ahead of commands that callers are waiting on.
+        """
+        return Session.pacer.delay(self.pacescopes) != 0
 
     @classmethod
     def register_handle_callback(cls, handle, callback):
@@ -768,20 +1518,46 @@ class Session(object):
             cls._external_handlers[handle.fileno()] = (callback, handle)
         #If we don't have a socket yet, we need one for the code to behave
         #correctly from this point forward
-        if not hasattr(Session, 'socket'):
+        if not hasattr(Session, 'socketpool'):
             cls._createsocket()
         cls.readersockets += [handle]
+        cls.iopoller.register(handle)
+
+    @classmethod
+    def unregister_handle_callback(cls, handle):
+        """Stop watching a handle added by register_handle_callback
+
+        :param handle: filehandle to no longer watch, to be called before it
+                       is closed
+        """
+        if isinstance(handle, int):
+            del cls._external_handlers[handle]
+        else:
+            del cls._external_handlers[handle.fileno()]
+        cls.readersockets.remove(handle)
+        cls.iopoller.unregister(handle)
 
     @classmethod
     def _route_ipmiresponse(cls, sockaddr, data):
+        # data is a memoryview over the receive buffer, nothing may hold on
+        # to it past this call
         if not (data[0] == '\x06' and data[2:4] == '\xff\x07'):  # not ipmi
             return
         try:
-            cls.bmc_handlers[sockaddr]._handle_ipmi_packet(data,
-                                                           sockaddr=sockaddr)
-            cls.pending -= 1
+            session = cls.bmc_handlers[sockaddr]
         except KeyError:
-            pass
+            cls.metricsregistry.drop('unknownpeer')
+            return
+        outstanding = session.lastpayload
+        xmittime = session.xmittime
+        retransmitted = session.retransmitted
+        session._handle_ipmi_packet(data, sockaddr=sockaddr)
+        if (outstanding is not None and
+                session.lastpayload is not outstanding and
+                xmittime is not None and not retransmitted):
+            # the packet answered the payload the session had out, and only
+            # sent once, so this is a true measure of the round trip
+            session.rtt.sample(_monotonic_time() - xmittime)
 
     def _handle_ipmi_packet(self, data, sockaddr=None):
         if self.sockaddr is None and sockaddr is not None:
@@ -792,88 +1568,83 @@ class Session(object):
             return  # here, we might have sent an ipv4 and ipv6 packet to kick
                    # things off ignore the second reply since we have one
                    # satisfactory answer
+        if Session.tracer is not None:
+            self.rxmarks = [('receive', Session.tracer.clock())]
         if data[4] in ('\x00', '\x02'):  # This is an ipmi 1.5 paylod
-            remsequencenumber = struct.unpack('<I', data[5:9])[0]
-            if (hasattr(self, 'remsequencenumber') and
-                    remsequencenumber < self.remsequencenumber):
-                return -5  # remote sequence number is too low, reject it
+            (authtype, remsequencenumber, remsessid, authcode,
+             payload) = codec.decode_ipmi15(data)
+            if not self.remseqwindow.fresh(remsequencenumber):
+                self.metrics.drop('replay')
+                return -5  # remote sequence number is a replay, reject it
             self.remsequencenumber = remsequencenumber
-            if ord(data[4]) != self.authtype:
+            if authtype != self.authtype:
+                self.metrics.drop('authtype')
                 return -2  # BMC responded with mismatch authtype, for
                           # mutual authentication reject it. If this causes
                           # legitimate issues, it's the vendor's fault
-            remsessid = struct.unpack("<I", data[9:13])[0]
             if remsessid != self.sessionid:
+                self.metrics.drop('sessionid')
                 return -1  # does not match our session id, drop it
-            # now we need a mutable representation of the packet, rather than
-            # copying pieces of the packet over and over
-            rsp = list(struct.unpack("!%dB" % len(data), data))
-            authcode = False
-            if data[4] == '\x02':  # we have authcode in this ipmi 1.5 packet
-                authcode = data[13:29]
-                del rsp[13:29]
-                    # this is why we needed a mutable representation
-            payload = list(rsp[14:14 + rsp[13]])
-            if authcode:
+            if authcode is not None:
                 expectedauthcode = self._ipmi15authcode(payload,
                                                         checkremotecode=True)
-                expectedauthcode = struct.pack("%dB" % len(expectedauthcode),
-                                               *expectedauthcode)
-                if expectedauthcode != authcode:
+                if authcode != expectedauthcode:
+                    self.metrics.drop('authcode')
                     return
-            self._parse_ipmi_payload(payload)
+                if Session.tracer is not None:
+                    self.rxmarks.append(('verify', Session.tracer.clock()))
+            self.remseqwindow.record(remsequencenumber)
+            # the payload is taken apart in place, so it has to be mutable
+            self._parse_ipmi_payload(bytearray(payload))
         elif data[4] == '\x06':
             self._handle_ipmi2_packet(data)
         else:
             return  # unrecognized data, assume evil
 
     def _handle_ipmi2_packet(self, rawdata):
-        data = list(struct.unpack("%dB" % len(rawdata), rawdata))
-                    #now need mutable array
-        ptype = data[5] & 0b00111111
+        payload_type, sid, remseqnumber, payload = \
+            codec.decode_rmcpplus(rawdata)
+        ptype = payload_type & 0b00111111
         # the first 16 bytes are header information as can be seen in 13-8 that
         # we will toss out
         if ptype == 0x11:  # rmcp+ response
-            return self._got_rmcp_response(data[16:])
+            return self._got_rmcp_response(bytearray(rawdata[16:]))
         elif ptype == 0x13:
-            return self._got_rakp2(data[16:])
+            return self._got_rakp2(bytearray(rawdata[16:]))
         elif ptype == 0x15:
-            return self._got_rakp4(data[16:])
+            return self._got_rakp4(bytearray(rawdata[16:]))
         elif ptype == 0 or ptype == 1:  # good old ipmi payload or sol
             # If endorsing a shared secret scheme, then at the very least it
             # needs to do mutual assurance
-            if not (data[5] & 0b01000000):  # This would be the line that might
-                                         # trip up some insecure BMC
+            if not (payload_type & 0b01000000):  # This would be the line that
+                                         # might trip up some insecure BMC
                                          # implementation
+                self.metrics.drop('integrity')
                 return
-            encrypted = 0
-            if data[5] & 0b10000000:
-                encrypted = 1
-            authcode = rawdata[-12:]
-            expectedauthcode = HMAC.new(
-                self.k1, rawdata[4:-12], SHA).digest()[:12]
-            if authcode != expectedauthcode:
-                return  # BMC failed to assure integrity to us, drop it
-            sid = struct.unpack("<I", rawdata[6:10])[0]
+            if self.integrity is None:
+                # no session established to check it against
+                self.metrics.drop('integrity')
+                return
+            if not codec.rmcpplus_authentic(rawdata, self.integrity):
+                # BMC failed to assure integrity to us, drop it
+                self.metrics.drop('integrity')
+                return
+            if Session.tracer is not None:
+                self.rxmarks.append(('verify', Session.tracer.clock()))
             if sid != self.localsid:  # session id mismatch, drop it
+                self.metrics.drop('sessionid')
                 return
-            remseqnumber = struct.unpack("<I", rawdata[10:14])[0]
-            if (hasattr(self, 'remseqnumber') and
-                (remseqnumber < self.remseqnumber) and
-                    (self.remseqnumber != 0xffffffff)):
+            if not self.remseqwindow.fresh(remseqnumber):
+                self.metrics.drop('replay')
                 return
-            self.remseqnumber = remseqnumber
-            psize = data[14] + (data[15] << 8)
-            payload = data[16:16 + psize]
-            if encrypted:
-                iv = rawdata[16:32]
-                decrypter = AES.new(self.aeskey, AES.MODE_CBC, iv)
-                decrypted = decrypter.decrypt(
-                    struct.pack("%dB" % len(payload[16:]),
-                                *payload[16:]))
-                payload = struct.unpack("%dB" % len(decrypted), decrypted)
-                padsize = payload[-1] + 1
-                payload = list(payload[:-padsize])
+            self.remseqwindow.record(remseqnumber)
+            if payload_type & 0b10000000:
+                payload = codec.decrypt_payload(payload,
+                                                self.confidentiality)
+                if Session.tracer is not None:
+                    self.rxmarks.append(('decrypt', Session.tracer.clock()))
+            else:
+                payload = bytearray(payload)
             if ptype == 0:
                 self._parse_ipmi_payload(payload)
             elif ptype == 1:  # There should be no other option
@@ -884,7 +1655,7 @@ class Session(object):
                 if self.last_payload_type == 1:  # but only if SOL was last tx
                     self.lastpayload = None
                     self.last_payload_type = None
-                    Session.waiting_sessions.pop(self, None)
+                    self._exchange_over(True)
                     if len(self.pendingpayloads) > 0:
                         (nextpayload, nextpayloadtype, retry) = \
                             self.pendingpayloads.popleft()
@@ -897,27 +1668,37 @@ class Session(object):
     def _got_rmcp_response(self, data):
         # see RMCP+ open session response table
         if not (self.sessioncontext and self.sessioncontext != "Established"):
+            self.metrics.drop('stale')
             return -9
             # ignore payload as we are not in a state valid it
         if data[0] != self.rmcptag:
+            self.metrics.drop('stale')
             return -9  # use rmcp tag to track and reject stale responses
         if data[1] != 0:  # response code...
             if data[1] in constants.rmcp_codes:
                 errstr = constants.rmcp_codes[data[1]]
             else:
                 errstr = "Unrecognized RMCP code %d" % data[1]
+            self.loginbusy = data[1] in constants.rmcp_busy_codes
             self.onlogon({'error': errstr})
             return -9
         self.allowedpriv = data[2]
         # TODO(jbjohnso): enable lower priv access (e.g. operator/user)
         localsid = struct.unpack("<I", struct.pack("4B", *data[4:8]))[0]
         if self.localsid != localsid:
+            self.metrics.drop('sessionid')
             return -9
         self.pendingsessionid = struct.unpack(
             "<I", struct.pack("4B", *data[8:12]))[0]
+        if len(data) >= 36:
+            # the algorithm of each of the authentication, integrity and
+            # confidentiality payloads, table 13-10
+            self.ciphersuite = constants.cipher_suites.get(
+                (data[16], data[24], data[32]))
         # TODO(jbjohnso): currently, we take it for granted that the responder
         # accepted our integrity/auth/confidentiality proposal
         self.lastpayload = None
+        self._exchange_over(True)
         self._send_rakp1()
 
     def _send_rakp1(self):
@@ -937,10 +1718,12 @@ class Session(object):
 
     def _got_rakp2(self, data):
         if not (self.sessioncontext in ('EXPECTINGRAKP2', 'EXPECTINGRAKP4')):
+            self.metrics.drop('stale')
             return -9  # if we are not expecting rakp2, ignore. In a retry
                       # scenario, replying from stale RAKP2 after sending
                       # RAKP3 seems to be best
         if data[0] != self.rmcptag:  # ignore mismatched tags for retry logic
+            self.metrics.drop('stale')
             return -9
         if data[1] != 0:  # if not successful, consider next move
             if data[1] == 2:  # invalid sessionid 99% of the time means a retry
@@ -950,10 +1733,12 @@ class Session(object):
                 errstr = constants.rmcp_codes[data[1]]
             else:
                 errstr = "Unrecognized RMCP code %d" % data[1]
+            self.loginbusy = data[1] in constants.rmcp_busy_codes
             self.onlogon({'error': errstr + " in RAKP2"})
             return -9
         localsid = struct.unpack("<I", struct.pack("4B", *data[4:8]))[0]
         if localsid != self.localsid:
+            self.metrics.drop('sessionid')
             return -9  # discard mismatch in the session identifier
         self.remoterandombytes = struct.pack("16B", *data[8:24])
         self.remoteguid = struct.pack("16B", *data[24:40])
@@ -979,6 +1764,7 @@ class Session(object):
         self.aeskey = self.k2[0:16]
         self.sessioncontext = "EXPECTINGRAKP4"
         self.lastpayload = None
+        self._exchange_over(True)
         self._send_rakp3()
 
     def _send_rakp3(self):  # rakp message 3
@@ -995,13 +1781,28 @@ class Session(object):
         self.send_payload(
             payload=payload, payload_type=constants.payload_types['rakp3'])
 
+    def _abandon_payloads(self):
+        """Forget what the handshake had in flight before starting it over
+
+        Otherwise the fresh request would be parked behind a payload that
+        will never be answered or retried.
+        """
+        self.lastpayload = None
+        self.pendingpayloads.clear()
+        # pipelined requests held back are not part of the handshake
+        self.heldpackets = collections.deque(
+            held for held in self.heldpackets if held[2] is not None)
+        self._exchange_over(False)
+
     def _relog(self):
+        self._abandon_payloads()
         self._initsession()
         self.logontries -= 1
-        return self._get_channel_auth_cap()
+        return self._start_handshake()
 
     def _got_rakp4(self, data):
         if self.sessioncontext != "EXPECTINGRAKP4" or data[0] != self.rmcptag:
+            self.metrics.drop('stale')
             return -9
         if data[1] != 0:
             if data[1] == 2 and self.logontries:  # if we retried RAKP3 because
@@ -1016,10 +1817,12 @@ class Session(object):
                 errstr = constants.rmcp_codes[data[1]]
             else:
                 errstr = "Unrecognized RMCP code %d" % data[1]
+            self.loginbusy = data[1] in constants.rmcp_busy_codes
             self.onlogon({'error': errstr + " reported in RAKP4"})
             return -9
         localsid = struct.unpack("<I", struct.pack("4B", *data[4:8]))[0]
         if localsid != self.localsid:  # ignore if wrong session id indicated
+            self.metrics.drop('sessionid')
             return -9
         hmacdata = self.randombytes +\
             struct.pack("<I", self.pendingsessionid) +\
@@ -1032,9 +1835,14 @@ class Session(object):
         self.sessionid = self.pendingsessionid
         self.integrityalgo = 'sha1'
         self.confalgo = 'aes'
+        # the keyed state is worked out once here and reused for every packet
+        # of the session
+        self.integrity = Session.crypto.integrity(self.k1)
+        self.confidentiality = Session.crypto.confidentiality(self.aeskey)
         self.sequencenumber = 1
         self.sessioncontext = 'ESTABLISHED'
         self.lastpayload = None
+        self._exchange_over(True)
         self._req_priv_level()
 
     '''
@@ -1045,10 +1853,18 @@ class Session(object):
         # For now, skip the checksums since we are in LAN only,
         # TODO(jbjohnso): if implementing other channels, add checksum checks
         # here
+        if self.pipelined:
+            request = self.pipelined.get(
+                (payload[1] >> 2, payload[5], payload[4]))
+            if request is not None:
+                return self._pipelined_response(request, payload)
         if (payload[4] != self.seqlun or
                 payload[1] >> 2 != self.expectednetfn or
                 payload[5] != self.expectedcmd):
+            self.metrics.drop('unexpected')
             return -1  # payload is not a match for our last packet
+        self.metrics.command(self.expectednetfn - 1, self.expectedcmd,
+                             _monotonic_time() - self.firstxmit)
         if hasattr(self, 'hasretried') and self.hasretried:
             self.hasretried = 0
             self.tabooseq[
@@ -1060,7 +1876,7 @@ class Session(object):
         self.expectedcmd = 0x1ff
         self.seqlun += 4  # prepare seqlun for next transmit
         self.seqlun &= 0xff  # when overflowing, wrap around
-        Session.waiting_sessions.pop(self, None)
+        self._exchange_over(True)
         self.lastpayload = None  # render retry mechanism utterly incapable of
                                  # doing anything, though it shouldn't matter
         self.last_payload_type = None
@@ -1072,8 +1888,12 @@ class Session(object):
         response['command'] = payload[0]
         response['code'] = payload[1]
         del payload[0:2]
-        response['data'] = payload
-        self.timeout = initialtimeout + (0.5 * random.random())
+        response['data'] = list(payload)
+        trace = self.trace
+        if trace is not None:
+            self.trace = None
+            trace.marks.extend(self.rxmarks)
+            trace.mark('parse')
         if len(self.pendingpayloads) > 0:
             (nextpayload, nextpayloadtype, retry) = \
                 self.pendingpayloads.popleft()
@@ -1084,27 +1904,50 @@ class Session(object):
         call_with_optional_args(self.ipmicallback,
                                 response,
                                 self.ipmicallbackargs)
+        if trace is not None:
+            trace.finish('answered')
+        self._next_command()
 
     def _timedout(self):
         if not self.lastpayload:
             return
         self.nowait = True
-        self.timeout += 1
-        if self.timeout > 5:
+        elapsed = _monotonic_time() - self.firstxmit
+        if elapsed >= self.retrydeadline:
+            self.metrics.timeout()
             response = {'error': 'timeout'}
+            # give up on the payload, or the next one sent would be parked
+            # behind it forever
+            self.lastpayload = None
+            self.last_payload_type = None
+            self._exchange_over(False)
+            self.incommand = False
+            self.nowait = False
+            trace = self.trace
+            self.trace = None
             call_with_optional_args(self.ipmicallback,
                                     response,
                                     self.ipmicallbackargs)
-            self.incommand = False
-            self.nowait = False
+            if trace is not None:
+                trace.finish('timeout')
+            self._next_command()
             return
         elif self.sessioncontext == 'FAILED':
+            self._exchange_over(False)
             self.nowait = False
             return
+        if self.xmittime is not None:  # else held back by delay_xmit, not lost
+            self.timeout = min(self.rtt.backoff(self.timeout),
+                               self.retrydeadline - elapsed)
+            self.retransmitted = True
+            self.metrics.retry()
+            if self.trace is not None:
+                self.trace.mark('retransmit')
         if self.sessioncontext == 'OPENSESSION':
             # In this case, we want to craft a new session request to have
             # unambiguous session id regardless of how packet was dropped or
             # delayed in this case, it's safe to just redo the request
+            self._abandon_payloads()
             self._open_rmcpplus_request()
         elif (self.sessioncontext == 'EXPECTINGRAKP2' or
               self.sessioncontext == 'EXPECTINGRAKP4'):
@@ -1126,45 +1969,112 @@ class Session(object):
         self.nowait = False
 
     def _xmit_packet(self, retry=True, delay_xmit=None):
-        if not self.nowait:  # if we are retrying, we really need to get the
-                            # packet out and get our timeout updated
-            Session.wait_for_rsp(timeout=0, callout=False)  # take opportunity
-                                                 # to drain the socket queue if
-                                                 # applicable
-            while Session.pending > Session.maxpending:
-                Session.wait_for_rsp()
         if self.sequencenumber:  # seq number of zero will be left alone, it is
                                 # special, otherwise increment
             self.sequencenumber += 1
-        if retry:
-            Session.waiting_sessions[self] = {}
-            Session.waiting_sessions[self]['ipmisession'] = self
-            Session.waiting_sessions[self]['timeout'] = self.timeout + \
-                _monotonic_time()
-            Session.pending += 1
         if delay_xmit is not None:
-            Session.waiting_sessions[self]['timeout'] = delay_xmit + \
-                _monotonic_time()
+            self._arm_retry(delay_xmit + _monotonic_time())
             return  # skip transmit, let retry timer do it's thing
+        if not self.nowait and self._hold(self.netpacket, retry):
+            # if we are retrying, we really need to get the packet out and
+            # get our timeout updated, otherwise it waits its turn
+            return
+        self._put_packet(self.netpacket, retry)
+
+    def _put_packet(self, netpacket, retry):
+        if self.trace is not None:
+            self.trace.mark('throttle')
+        newflight = False
+        if retry:
+            self._arm_retry(self.timeout + _monotonic_time())
+            self.xmittime = _monotonic_time()
+            newflight = not self.inflight
+            self.inflight = True
+        Session.pacer.sent(self.pacescopes, newflight)
         if self.sockaddr:
-            Session.socket.sendto(self.netpacket, self.sockaddr)
+            self._sendto(netpacket, self.sockaddr)
         else:  # he have not yet picked a working sockaddr for this connection,
-              # try all the candidates that getaddrinfo provides
+              # try all the candidates that getaddrinfo provided, as cached so
+              # that no lookup holds up the event loop
             try:
-                for res in socket.getaddrinfo(self.bmc,
-                                              self.port,
-                                              0,
-                                              socket.SOCK_DGRAM):
-                    sockaddr = res[4]
-                    if (res[0] == socket.AF_INET):  # convert the sockaddr
-                                                    # to AF_INET6
-                        newhost = '::ffff:' + sockaddr[0]
-                        sockaddr = (newhost, sockaddr[1], 0, 0)
+                for sockaddr in Session.resolvercache.cached(self.bmc,
+                                                             self.port):
                     Session.bmc_handlers[sockaddr] = self
-                    Session.socket.sendto(self.netpacket, sockaddr)
+                    self._sendto(netpacket, sockaddr)
             except socket.gaierror:
                 raise exc.IpmiException(
                     "Unable to transmit to specified address")
+        if self.trace is not None:
+            self.trace.mark('xmit')
+
+    def _hold(self, netpacket=None, retry=True, request=None):
+        """Hold a new request back if the pacer will not let it out yet
+
+        Rather than have the caller run the event loop until the pacer
+        lets it go, which would block asynchronous callers, the event loop
+        sends it once it may go.  Packets of the session after a held one
+        are held behind it.
+
+        :returns: whether the packet was held
+        """
+        if (not self.heldpackets and
+                Session.pacer.delay(self.pacescopes) == 0):
+            return False
+        self.heldpackets.append((netpacket, retry, request))
+        Session.pacedsessions[self] = True
+        return True
+
+    def _release(self, held):
+        netpacket, retry, request = held
+        if request is not None:
+            self._xmit_request(request, throttle=False)
+            return
+        # the exchange starts now as far as the retry deadline goes
+        self.firstxmit = _monotonic_time()
+        self._put_packet(netpacket, retry)
+
+    @classmethod
+    def _release_paced(cls):
+        """Send the packets held back that the pacer now lets out
+        """
+        globalscope = (cls.pacer.globalscope,)
+        for session in cls.pacedsessions.keys():
+            if cls.pacer.delay(globalscope) != 0:
+                return  # nothing else is going anywhere either
+            held = session.heldpackets
+            while held and cls.pacer.delay(session.pacescopes) == 0:
+                session._release(held.popleft())
+            if not held:
+                del cls.pacedsessions[session]
+
+    @classmethod
+    def _paced_delay(cls):
+        """Seconds until the pacer lets out a held packet
+
+        :returns: None if none is held or they all wait for requests in
+                  flight to land, which wakes up the event loop anyway
+        """
+        soonest = None
+        for session in cls.pacedsessions:
+            delay = cls.pacer.delay(session.pacescopes)
+            if delay is not None and (soonest is None or delay < soonest):
+                soonest = delay
+        return soonest
+
+    def _sendto(self, packet, sockaddr):
+        if Session.sendbatching:
+            txqueue = self.iosocket.txqueue
+            txqueue.append((packet, sockaddr))
+            if len(txqueue) >= Session.sendbatchsize:
+                self.iosocket.flush()
+            return
+        try:
+            self.iosocket.socket.sendto(packet, sockaddr)
+        except socket.error as err:
+            # the socket is non-blocking, treat a full send buffer like a
+            # packet lost on the wire and let the retry timer cover it
+            if err.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
 
     def logout(self, callback=None, callback_args=None):
         if not self.logged:
@@ -1183,6 +2093,13 @@ class Session(object):
                          callback=callback,
                          callback_args=callback_args)
         self.logged = 0
+        timer = Session.keepalive_sessions.pop(self, None)
+        if timer is not None:
+            Session.timerheap.cancel(timer)
+        Session.sessionpool.pop(self, None)
+        timer = Session.idle_sessions.pop(self, None)
+        if timer is not None:
+            Session.timerheap.cancel(timer)
         self.nowait = False
         if not callback:
             return {'success': True}
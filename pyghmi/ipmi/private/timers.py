@@ -0,0 +1,139 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides the deadline tracking used by the session event loop
+
+import heapq
+import itertools
+
+
+class Timer(object):
+    """A handle on a scheduled callback
+
+    Callers keep this around to cancel or reschedule the callback.  The
+    deadline attribute is None once the timer has fired or been cancelled.
+    """
+    __slots__ = ('deadline', 'callback', 'args', 'entry')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.entry = None
+
+
+class TimerHeap(object):
+    """Deadline ordered set of timers
+
+    Insert and reschedule to an earlier deadline are O(log n), cancel is O(1)
+    and finding the soonest deadline is O(1) amortized.  Cancelled entries are
+    left in the heap and discarded as they surface, with the heap rebuilt if
+    they come to dominate it.  Pushing a deadline further out, which is what
+    happens to every keepalive each time a session sends a packet, only
+    touches the timer and is reconciled when its old heap entry surfaces.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.live = 0
+
+    def __len__(self):
+        return self.live
+
+    def _push(self, timer):
+        entry = [timer.deadline, next(self.counter), timer]
+        timer.entry = entry
+        heapq.heappush(self.heap, entry)
+
+    def schedule(self, deadline, callback, *args):
+        """Call callback with args once deadline has passed
+
+        :param deadline: time, in terms of _monotonic_time, to fire
+        :param callback: function to invoke
+        :returns: Timer -- handle to cancel or reschedule with
+        """
+        timer = Timer(deadline, callback, args)
+        self._push(timer)
+        self.live += 1
+        return timer
+
+    def reschedule(self, timer, deadline):
+        """Move an existing timer to a new deadline
+
+        A timer that has already fired or been cancelled is scheduled anew.
+        """
+        if timer.deadline is None:
+            timer.deadline = deadline
+            self._push(timer)
+            self.live += 1
+        elif deadline < timer.entry[0]:
+            timer.deadline = deadline
+            self._push(timer)  # the old entry is now stale
+            self._maybe_compact()
+        else:
+            timer.deadline = deadline
+
+    def cancel(self, timer):
+        if timer.deadline is None:
+            return
+        timer.deadline = None
+        timer.entry = None
+        self.live -= 1
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if len(self.heap) > 64 and len(self.heap) > 2 * self.live:
+            self.heap = [entry for entry in self.heap
+                         if entry[2].entry is entry]
+            heapq.heapify(self.heap)
+
+    def _settle(self):
+        """Discard or requeue stale entries at the top of the heap
+        """
+        heap = self.heap
+        while heap:
+            entry = heap[0]
+            timer = entry[2]
+            if timer.entry is not entry:
+                heapq.heappop(heap)
+            elif timer.deadline > entry[0]:  # was pushed out lazily
+                heapq.heappop(heap)
+                self._push(timer)
+            else:
+                return entry
+        return None
+
+    def next_deadline(self):
+        """Return the soonest deadline, or None if there are no timers
+        """
+        entry = self._settle()
+        if entry is None:
+            return None
+        return entry[0]
+
+    def run_expired(self, now):
+        """Fire every timer with a deadline at or before now
+        """
+        while True:
+            entry = self._settle()
+            if entry is None or entry[0] > now:
+                return
+            heapq.heappop(self.heap)
+            timer = entry[2]
+            timer.deadline = None
+            timer.entry = None
+            self.live -= 1
+            timer.callback(*timer.args)
@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# This provides timelines of commands as they make their way through a session
+#
+# A sampled command carries a Trace that is stamped as it passes each step,
+# from being taken up by raw_command to its callback returning, so that it
+# can be told whether time goes to building the packet, encryption, being
+# held back by pacing, the network, checking and parsing the answer or the
+# callback.  Finished timelines go to a sink, a ring buffer in memory or a
+# file of JSON lines, or anything else with a write method taking a dict.
+#
+# The phases, in the order a command normally goes through them, are
+#   raw_command: taken up by the session
+#   payload:     IPMI message built
+#   encrypt:     framed for the wire, with authcode or encryption
+#   throttle:    let through by pacing
+#   xmit:        handed to the socket, or queued to be in a batch
+#   retransmit:  its retry timer ran out, from here it is sent again
+#   receive:     the answer came in from the socket
+#   verify:      its authcode or integrity checked out
+#   decrypt:     its payload decrypted
+#   parse:       the answer taken apart
+#   callback:    the callback returned, or for a timeout, given up on
+
+import collections
+import json
+import random
+import time
+
+
+class Trace(object):
+    """Timeline of a command, stamped as it goes through a session
+    """
+
+    def __init__(self, tracer, bmc, port, netfn, command):
+        self.tracer = tracer
+        self.clock = tracer.clock
+        self.bmc = bmc
+        self.port = port
+        self.netfn = netfn
+        self.command = command
+        self.start = self.clock()
+        self.marks = [('raw_command', self.start)]
+
+    def mark(self, phase, when=None):
+        """Stamp the command as having got through phase
+
+        :param when: time it did, if not now
+        """
+        if when is None:
+            when = self.clock()
+        self.marks.append((phase, when))
+
+    def record(self, outcome):
+        """The timeline as a dict, with times in seconds from the start
+        """
+        return {
+            'bmc': self.bmc,
+            'port': self.port,
+            'netfn': self.netfn,
+            'command': self.command,
+            'start': self.start,
+            'outcome': outcome,
+            'phases': [(phase, when - self.start)
+                       for phase, when in self.marks],
+        }
+
+    def finish(self, outcome):
+        """Pass on the timeline of a command that has come to an end
+
+        :param outcome: 'answered', or 'timeout' if given up on
+        """
+        self.mark('callback')
+        self.tracer.traced += 1
+        self.tracer.sink.write(self.record(outcome))
+
+
+class RingBufferSink(object):
+    """Keeps the latest timelines in memory
+
+    :param size: how many timelines to keep
+    """
+
+    def __init__(self, size=1024):
+        self.buffer = collections.deque(maxlen=size)
+
+    def write(self, record):
+        self.buffer.append(record)
+
+    def records(self):
+        return list(self.buffer)
+
+
+class JsonLinesSink(object):
+    """Appends timelines to a file, one JSON object per line
+
+    :param path: file to append to
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class Tracer(object):
+    """Picks the commands to trace and passes their timelines on to a sink
+
+    :param sink: where finished timelines go, an object with a write method
+                 taking a dict as made by Trace.record
+    :param samplerate: fraction of commands to trace
+    :param clock: function returning the current time in seconds, fine
+                  grained enough to tell the phases apart
+    """
+
+    def __init__(self, sink, samplerate=0.01, clock=time.time):
+        self.sink = sink
+        self.samplerate = samplerate
+        self.clock = clock
+        self.traced = 0
+
+    def start(self, bmc, port, netfn, command):
+        """A Trace for a command being taken up, or None to leave it be
+        """
+        if self.samplerate < 1 and random.random() >= self.samplerate:
+            return None
+        return Trace(self, bmc, port, netfn, command)
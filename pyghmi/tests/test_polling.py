@@ -0,0 +1,66 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Tests of the spacing of polls made while waiting on BMCs
+
+import testtools
+
+from pyghmi.ipmi.private import polling
+
+
+class BackoffTestCase(testtools.TestCase):
+
+    def test_grows_to_ceiling(self):
+        self.assertLessEqual(polling.backoff(0, 0.5, 5.0), 0.75)
+        self.assertGreaterEqual(polling.backoff(20, 0.5, 5.0), 2.5)
+        self.assertLessEqual(polling.backoff(20, 0.5, 5.0), 7.5)
+
+    def test_long_wait_does_not_overflow(self):
+        interval = polling.backoff(100000, 0.5, 5.0)
+        self.assertGreaterEqual(interval, 2.5)
+        self.assertLessEqual(interval, 7.5)
+
+
+class PollBudgetTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(PollBudgetTestCase, self).setUp()
+        self.now = 1000.0
+        self.budget = polling.PollBudget(200, clock=lambda: self.now)
+
+    def test_free_slot_is_taken_as_asked(self):
+        self.assertEqual(self.now + 0.5, self.budget.slot(self.now + 0.5))
+
+    def test_busy_slot_is_put_off(self):
+        first = self.budget.slot(self.now + 0.5)
+        second = self.budget.slot(self.now + 0.5)
+        self.assertGreater(second, first)
+        self.assertLess(second - first, 0.01)
+
+    def test_far_booking_does_not_hold_up_near_ones(self):
+        self.budget.slot(self.now + 5)
+        self.assertEqual(self.now + 0.5, self.budget.slot(self.now + 0.5))
+
+    def test_past_slots_are_let_go(self):
+        for _ in range(10):
+            self.budget.slot(self.now)
+        self.now += 1
+        self.budget.slot(self.now)
+        self.assertEqual(1, len(self.budget.taken))
+
+    def test_no_limit(self):
+        budget = polling.PollBudget(None)
+        self.assertEqual(5.0, budget.slot(5.0))
+        self.assertEqual(5.0, budget.slot(5.0))
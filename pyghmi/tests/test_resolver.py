@@ -0,0 +1,149 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 IBM Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Tests that a slow name service does not hold up the event loop
+
+import select
+import socket
+import threading
+import time
+
+import testtools
+
+from pyghmi.ipmi.private import resolver
+from pyghmi.ipmi.private import session
+
+_delay = 0.5
+
+
+class SlowResolver(object):
+    """Stand-in for getaddrinfo that takes _delay seconds to answer
+
+    Names starting with 'bad' do not resolve, all others resolve to the
+    loopback address.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def __call__(self, host, port, family=0, socktype=0):
+        with self.lock:
+            self.calls.append(host)
+        time.sleep(_delay)
+        if host.startswith('bad'):
+            raise socket.gaierror(socket.EAI_NONAME,
+                                  'Name or service not known')
+        return [(socket.AF_INET, socket.SOCK_DGRAM, 17, '',
+                 ('127.0.0.1', port))]
+
+
+class ResolverCacheTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(ResolverCacheTestCase, self).setUp()
+        self.getaddrinfo = SlowResolver()
+        self.cache = resolver.ResolverCache(getaddrinfo=self.getaddrinfo)
+        self.results = []
+
+    def _complete(self):
+        deadline = time.time() + 10 * _delay
+        while self.cache.pending() and time.time() < deadline:
+            select.select([self.cache], [], [], deadline - time.time())
+            self.cache.complete()
+
+    def test_resolve_does_not_block(self):
+        start = time.time()
+        self.cache.resolve('bmc1', 623, self.results.append)
+        self.assertLess(time.time() - start, _delay / 2)
+        self.assertEqual([], self.results)
+        self._complete()
+        self.assertEqual([(('::ffff:127.0.0.1', 623, 0, 0),)], self.results)
+        self.assertEqual((('::ffff:127.0.0.1', 623, 0, 0),),
+                         self.cache.cached('bmc1', 623))
+
+    def test_concurrent_callers_share_lookup(self):
+        for _ in range(3):
+            self.cache.resolve('bmc1', 623, self.results.append)
+        self._complete()
+        self.assertEqual(['bmc1'], self.getaddrinfo.calls)
+        self.assertEqual(3, len(self.results))
+
+    def test_current_entry_answers_at_once(self):
+        self.cache.resolve('bmc1', 623, self.results.append)
+        self._complete()
+        self.cache.resolve('bmc1', 623, self.results.append)
+        self.assertEqual(2, len(self.results))
+        self.assertFalse(self.cache.pending())
+
+    def test_failed_lookup(self):
+        self.cache.resolve('badbmc', 623, self.results.append)
+        self._complete()
+        self.assertIsInstance(self.results[0], socket.gaierror)
+        self.assertRaises(socket.gaierror, self.cache.cached, 'badbmc', 623)
+
+
+class SessionResolveTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(SessionResolveTestCase, self).setUp()
+        self.getaddrinfo = SlowResolver()
+        # sessions outlive the test, so keep what they looked up cached
+        cache = session.Session.resolvercache
+        self.addCleanup(setattr, cache, 'getaddrinfo', cache.getaddrinfo)
+        cache.getaddrinfo = self.getaddrinfo
+        self.results = []
+
+    def _onlogon(self, response):
+        self.results.append(response)
+
+    def _run_loop(self, done):
+        deadline = time.time() + 10 * _delay
+        while not done() and time.time() < deadline:
+            session.Session.wait_for_rsp(timeout=0.1)
+
+    def test_constructor_does_not_block(self):
+        start = time.time()
+        sess = session.Session('badbmc1', 'user', 'pass',
+                               onlogon=self._onlogon)
+        self.assertLess(time.time() - start, _delay / 2)
+        self.assertTrue(sess.resolving)
+        self._run_loop(lambda: self.results)
+        self.assertFalse(sess.resolving)
+        self.assertIn('error', self.results[0])
+        self.assertNotIn(('badbmc1', 623), session.Session.resolving_sessions)
+
+    def test_lookup_completes_from_loop(self):
+        sess = session.Session('bmc2', 'user', 'pass', port=60623,
+                               onlogon=self._onlogon)
+        self._run_loop(lambda: not sess.resolving)
+        self.assertFalse(sess.resolving)
+        self.assertIs(sess, session.Session.bmc_handlers[
+            ('::ffff:127.0.0.1', 60623, 0, 0)])
+        self.assertEqual(['bmc2'], self.getaddrinfo.calls)
+
+    def test_sessions_found_while_resolving(self):
+        first = session.Session('badbmc3', 'user', 'pass',
+                                onlogon=self._onlogon)
+        second = session.Session('badbmc3', 'user', 'pass',
+                                 onlogon=self._onlogon)
+        self.assertIs(first, second)
+        self._run_loop(lambda: len(self.results) == 2)
+        self.assertEqual(2, len(self.results))
+        self.assertEqual(['badbmc3'], self.getaddrinfo.calls)
+
+    def test_sync_constructor_raises_lookup_error(self):
+        self.assertRaises(socket.gaierror, session.Session, 'badbmc4',
+                          'user', 'pass')